@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import deque
+
+# Feedback controller for the recognizer's quality knobs. It watches how long detection
+# plus encoding takes per frame and trades detail (upsample, downscale, frame skip) for
+# speed when over budget, then gives the detail back once there is headroom again.
+
+DEFAULT_BUDGET_MS = 150
+SMOOTHING = 0.3  # weight of the newest sample in the moving average
+HEADROOM = 0.6  # step quality back up when latency is under this share of the budget
+SETTLE_FRAMES = 5  # detection frames to wait after a change before judging it
+RECOVERY_FRAMES = 50  # after going over budget, wait longer before stepping quality back up
+DECISION_HISTORY = 20
+
+
+class AdaptiveController:
+    """
+    Keeps detection + encoding latency inside a per-frame budget by adjusting the
+    downscale factor, the frame-skip interval and the HOG upsample count. downscale=None
+    leaves out the downscale knob, for sources whose lores stream sets the detection size.
+    """
+
+    def __init__(self, budget_ms=DEFAULT_BUDGET_MS, downscale=3, skip_interval=2, upsample=1,
+                 min_downscale=2, max_downscale=5, max_skip_interval=5, max_upsample=2, enabled=True):
+        self.budget = budget_ms / 1000.0
+        self.enabled = enabled
+        self.downscale = downscale
+        self.skip_interval = skip_interval
+        self.upsample = upsample
+        self.min_downscale = min_downscale
+        self.max_downscale = max_downscale
+        self.max_skip_interval = max_skip_interval
+        self.max_upsample = max_upsample
+
+        self.avg_detect = None
+        self.avg_encode = None
+        self._since_change = 0
+        self._since_degrade = RECOVERY_FRAMES
+        self._lock = threading.Lock()
+        self.decisions = deque(maxlen=DECISION_HISTORY)
+
+    @classmethod
+    def from_config(cls, config, downscale, skip_interval, fixed_resolution=False):
+        """
+        Builds the controller from the optional keys in session_config.json. With
+        fixed_resolution (detection on a dual-stream source's lores plane) there is no
+        downscale to adjust.
+        """
+        return cls(
+            budget_ms=config.get("latency_budget_ms", DEFAULT_BUDGET_MS),
+            downscale=None if fixed_resolution else config.get("downscale", downscale),
+            skip_interval=config.get("frame_skip", skip_interval),
+            upsample=config.get("upsample", 1),
+            min_downscale=config.get("min_downscale", 2),
+            max_downscale=config.get("max_downscale", 5),
+            max_skip_interval=config.get("max_frame_skip", 5),
+            max_upsample=config.get("max_upsample", 2),
+            enabled=config.get("adaptive_quality", True),
+        )
+
+    def settings(self):
+        with self._lock:
+            return self.downscale, self.skip_interval, self.upsample
+
+    def _smooth(self, avg, sample):
+        return sample if avg is None else (1 - SMOOTHING) * avg + SMOOTHING * sample
+
+    def record(self, detect_seconds, encode_seconds):
+        """
+        Feeds the timings of one detection frame and adjusts the settings if needed.
+        """
+        with self._lock:
+            self.avg_detect = self._smooth(self.avg_detect, detect_seconds)
+            self.avg_encode = self._smooth(self.avg_encode, encode_seconds)
+            self._since_change += 1
+            self._since_degrade += 1
+            if not self.enabled or self._since_change < SETTLE_FRAMES:
+                return
+
+            latency = self.avg_detect + self.avg_encode
+            if latency > self.budget:
+                self._degrade(latency)
+            elif latency < HEADROOM * self.budget and self._since_degrade >= RECOVERY_FRAMES:
+                self._improve(latency)
+
+    def _degrade(self, latency):
+        self._since_degrade = 0
+        # Cheapest loss first: upsampling only helps tiny faces, then resolution, then frame rate
+        if self.upsample > 0:
+            self._change("upsample", self.upsample - 1, latency, "over budget")
+        elif self.downscale is not None and self.downscale < self.max_downscale:
+            self._change("downscale", self.downscale + 1, latency, "over budget")
+        elif self.skip_interval < self.max_skip_interval:
+            self._change("skip_interval", self.skip_interval + 1, latency, "over budget")
+
+    def _improve(self, latency):
+        # Give back in reverse order: frame rate first, then resolution, then small-face upsampling
+        if self.skip_interval > 1:
+            self._change("skip_interval", self.skip_interval - 1, latency, "headroom")
+        elif self.downscale is not None and self.downscale > self.min_downscale:
+            self._change("downscale", self.downscale - 1, latency, "headroom")
+        elif self.upsample < self.max_upsample:
+            self._change("upsample", self.upsample + 1, latency, "headroom")
+
+    def _change(self, knob, value, latency, reason):
+        old = getattr(self, knob)
+        setattr(self, knob, value)
+        self._since_change = 0
+        # The averages describe the old settings; start over so the next decision is fair
+        self.avg_detect = None
+        self.avg_encode = None
+        self.decisions.append({
+            "time": time.strftime("%H:%M:%S"),
+            "knob": knob,
+            "from": old,
+            "to": value,
+            "latency_ms": round(latency * 1000, 1),
+            "reason": reason,
+        })
+        print(f"[CONTROLLER] {knob} {old} -> {value} ({reason}, {latency * 1000:.0f} ms vs {self.budget * 1000:.0f} ms budget)")
+
+    def report(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "budget_ms": round(self.budget * 1000, 1),
+                "downscale": self.downscale,
+                "skip_interval": self.skip_interval,
+                "upsample": self.upsample,
+                "avg_detect_ms": round(self.avg_detect * 1000, 1) if self.avg_detect is not None else None,
+                "avg_encode_ms": round(self.avg_encode * 1000, 1) if self.avg_encode is not None else None,
+                "decisions": list(self.decisions),
+            }
@@ -0,0 +1,183 @@
+import os
+import numpy as np
+
+INDEX_FILE = "encodings_ivf.npz"
+
+# Below this many students the batched brute-force scan is already cheaper than
+# probing lists: bench_ann.py puts the crossover between 5000 and 6000 faces (at 2000
+# the exact scan takes about half the time). Re-run it to check a given board.
+MIN_INDEXED_FACES = 6000
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 12
+
+
+def _sq_distances(a, b, b_sq_norms=None):
+    """
+    Squared euclidean distances between the rows of a and the rows of b.
+    """
+    if b_sq_norms is None:
+        b_sq_norms = np.einsum("ij,ij->i", b, b)
+    a_sq = np.einsum("ij,ij->i", a, a)
+    d = a_sq[:, None] + b_sq_norms[None, :] - 2.0 * (a @ b.T)
+    np.maximum(d, 0.0, out=d)
+    return d
+
+
+def _kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Plain Lloyd k-means, good enough to partition a few thousand 128-d encodings.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    assign = np.zeros(len(vectors), dtype=np.int32)
+
+    for _ in range(iterations):
+        assign = np.argmin(_sq_distances(vectors, centroids), axis=1).astype(np.int32)
+        counts = np.bincount(assign, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty lists from random points so every list stays useful
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+    return centroids, assign
+
+
+class IVFIndex:
+    """
+    Inverted-file index over the enrolled encodings. The gallery is split into
+    nlist k-means cells and a lookup only scans the nprobe closest cells, so the
+    cost grows with about sqrt(N) instead of N.
+    """
+
+    def __init__(self, names, centroids, list_offsets, ids, vectors, nprobe=DEFAULT_NPROBE):
+        self.names = list(names)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        self.offsets_list = self.list_offsets.tolist()
+        # ids[k] is the position in names of the k-th stored vector; vectors are grouped by list
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        self.centroid_sq_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        self.nprobe = min(nprobe, len(self.centroids))
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, names, encodings, nlist=None, nprobe=DEFAULT_NPROBE, seed=0):
+        """
+        Trains the coarse quantizer on the gallery itself and groups the vectors by cell.
+        """
+        vectors = np.ascontiguousarray(np.vstack(encodings), dtype=np.float32)
+        if nlist is None:
+            nlist = max(1, int(round(np.sqrt(len(vectors)))))
+        nlist = min(nlist, len(vectors))
+
+        centroids, assign = _kmeans(vectors, nlist, seed=seed)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        list_offsets = np.concatenate(([0], np.cumsum(counts)))
+        return cls(names, centroids, list_offsets, order, vectors[order], nprobe=nprobe)
+
+    def save(self, path=INDEX_FILE):
+        # Write to a temp file first so a crash never leaves a truncated index behind
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, names=np.asarray(self.names, dtype=str), centroids=self.centroids,
+                     list_offsets=self.list_offsets, ids=self.ids, vectors=self.vectors,
+                     nprobe=np.int32(self.nprobe))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["names"].tolist(), data["centroids"], data["list_offsets"],
+                       data["ids"], data["vectors"], nprobe=int(data["nprobe"]))
+
+    def search(self, queries, nprobe=None):
+        """
+        Returns (best_ids, best_distances, second_distances) for every query row.
+        best_ids index into self.names; -1 means no candidate was found in the probed cells.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.vectors.shape[1])
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        n = len(queries)
+        best_ids = np.full(n, -1, dtype=np.int64)
+
+        cell_dist = _sq_distances(queries, self.centroids, self.centroid_sq_norms)
+        if nprobe < self.nlist:
+            probes = np.argpartition(cell_dist, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.nlist), (n, self.nlist))
+
+        best_dist = np.full(n, np.inf)
+        second_dist = np.full(n, np.inf)
+        offsets = self.offsets_list
+
+        for qi, cells in enumerate(probes.tolist()):
+            # Each probed list is a contiguous slice, so score it in place without gathering rows
+            q = queries[qi]
+            parts = []
+            part_ids = []
+            for cell in cells:
+                lo, hi = offsets[cell], offsets[cell + 1]
+                if lo != hi:
+                    parts.append(self.sq_norms[lo:hi] - 2.0 * (self.vectors[lo:hi] @ q))
+                    part_ids.append(self.ids[lo:hi])
+            if not parts:
+                continue
+            d = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            ids = np.concatenate(part_ids) if len(part_ids) > 1 else part_ids[0]
+            q_sq = float(q @ q)
+            if len(d) == 1:
+                best_ids[qi] = ids[0]
+                best_dist[qi] = np.sqrt(max(d[0] + q_sq, 0.0))
+                continue
+            top2 = np.argpartition(d, 1)[:2]
+            if d[top2[1]] < d[top2[0]]:
+                top2 = top2[::-1]
+            best_ids[qi] = ids[top2[0]]
+            best_dist[qi] = np.sqrt(max(d[top2[0]] + q_sq, 0.0))
+            second_dist[qi] = np.sqrt(max(d[top2[1]] + q_sq, 0.0))
+
+        return best_ids, best_dist, second_dist
+
+
+def build_index(names, encodings, path=INDEX_FILE):
+    """
+    Builds and saves the IVF index for a gallery, or removes a stale one when the
+    gallery is small enough for a brute-force scan. Returns the index or None.
+    """
+    if len(names) < MIN_INDEXED_FACES:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    index = IVFIndex.build(names, encodings)
+    index.save(path)
+    return index
+
+
+def load_index(names, path=INDEX_FILE):
+    """
+    Loads the on-disk index if it exists and still matches the current gallery.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        index = IVFIndex.load(path)
+    except Exception as e:
+        print(f"[WARNING] Could not load ANN index {path}: {e}")
+        return None
+    if index.names != list(names):
+        print(f"[WARNING] ANN index {path} is out of date with the encodings, using exact scan")
+        return None
+    return index
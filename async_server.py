@@ -0,0 +1,293 @@
+import asyncio
+import threading
+import time
+from aiohttp import web
+from metrics import CONTENT_TYPE, HTTP_SECONDS, render_metrics
+from recognition_events import HEARTBEAT_SECONDS, format_sse
+
+# asyncio (aiohttp) HTTP surface of the recognizer, replacing Flask's threaded dev server.
+#
+# Viewers are coroutines, not threads. One pump thread takes each new annotated frame
+# from the FrameBroadcaster, JPEG-encodes it once and hands the bytes to the event loop
+# with call_soon_threadsafe, so the recognition thread never waits on a client. Every
+# /video_feed client has a one-frame mailbox: when a client cannot keep up, its unsent
+# frame is replaced by the newest one. Slow viewers drop frames; nobody else notices.
+#
+# Recognition events wake long-polls and SSE streams through the same loop, so dashboards
+# waiting on /recognized.json?wait= or /events do not hold a thread either.
+
+BOUNDARY = "frame"
+LONG_POLL_MAX = 30
+SHUTDOWN_TIMEOUT = 2.0  # open streams never finish on their own; do not wait for them
+
+
+class StreamClient:
+    def __init__(self, peer):
+        self.peer = peer
+        self.mailbox = asyncio.Queue(maxsize=1)
+        self.sent = 0
+        self.dropped = 0
+
+    def offer(self, jpeg):
+        # Runs on the loop thread: the newest frame replaces one the client has not taken yet
+        if self.mailbox.full():
+            self.mailbox.get_nowait()
+            self.dropped += 1
+        self.mailbox.put_nowait(jpeg)
+
+
+class FrameHub:
+    """
+    Moves encoded frames from the broadcaster to the connected /video_feed clients.
+    """
+
+    def __init__(self, broadcaster, loop):
+        self.broadcaster = broadcaster
+        self.loop = loop
+        self.clients = set()
+        self.frames = 0
+        self.dropped = 0  # drops of clients that already disconnected
+        self._watching = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._pump, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _pump(self):
+        seq = 0
+        while not self._closed and not self.broadcaster.closed:
+            # Nothing is encoded while nobody watches
+            if not self._watching.wait(timeout=1.0):
+                continue
+            seq, jpeg = self.broadcaster.wait_for_frame(seq)
+            if jpeg is not None:
+                self._call_soon(self._deliver, jpeg)
+        self._call_soon(self._deliver, None)  # end of the streams
+
+    def _call_soon(self, callback, *args):
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass  # the loop is already closed
+
+    def _deliver(self, jpeg):
+        if jpeg is not None:
+            self.frames += 1
+        for client in self.clients:
+            client.offer(jpeg)
+
+    def subscribe(self, peer):
+        client = StreamClient(peer)
+        self.clients.add(client)
+        self._watching.set()
+        return client
+
+    def unsubscribe(self, client):
+        self.clients.discard(client)
+        self.dropped += client.dropped
+        if not self.clients:
+            self._watching.clear()
+
+    def stats(self):
+        return {
+            "clients": len(self.clients),
+            "frames": self.frames,
+            "dropped": self.dropped + sum(client.dropped for client in self.clients),
+        }
+
+    def close(self):
+        self._closed = True
+        self._watching.set()
+
+
+class EventNotifier:
+    """
+    Wakes coroutines waiting for recognition events; notify() may be called from any thread.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        try:
+            self.loop.call_soon_threadsafe(self._notify)
+        except RuntimeError:
+            pass
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+HUB = web.AppKey("hub", FrameHub)
+NOTIFIER = web.AppKey("notifier", EventNotifier)
+EVENTS = web.AppKey("events", object)
+RECOGNIZED = web.AppKey("recognized", object)
+SHOULD_STOP = web.AppKey("should_stop", object)
+
+
+def _query_number(request, name, default, kind=int):
+    try:
+        return kind(request.query.get(name, default))
+    except ValueError:
+        return default
+
+
+@web.middleware
+async def timing_middleware(request, handler):
+    # CORS preflight for the dashboards, which are served from class_control on another port
+    if request.method == "OPTIONS":
+        return web.Response(headers={"Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+                                     "Access-Control-Allow-Headers": "Content-Type"})
+    start = time.perf_counter()
+    response = None
+    try:
+        response = await handler(request)
+        return response
+    except web.HTTPException as e:
+        response = e  # 404s and friends are timed too, then raised on as aiohttp expects
+        raise
+    finally:
+        # Streams are not timed: their "latency" is how long the viewer watched
+        if isinstance(response, (web.Response, web.HTTPException)):
+            resource = request.match_info.route.resource
+            endpoint = resource.canonical if resource is not None else "unmatched"
+            HTTP_SECONDS.observe(time.perf_counter() - start, endpoint, request.method, str(response.status))
+
+
+async def add_cors_header(request, response):
+    response.headers["Access-Control-Allow-Origin"] = "*"
+
+
+async def video_feed(request):
+    hub = request.app[HUB]
+    response = web.StreamResponse(headers={
+        "Content-Type": f"multipart/x-mixed-replace; boundary={BOUNDARY}",
+        "Cache-Control": "no-cache",
+    })
+    await response.prepare(request)
+    client = hub.subscribe(request.remote)
+    try:
+        while True:
+            jpeg = await client.mailbox.get()
+            if jpeg is None:
+                break
+            # Awaiting the write is the backpressure: this client's mailbox keeps only the newest frame meanwhile
+            await response.write(b"--" + BOUNDARY.encode() + b"\r\nContent-Type: image/jpeg\r\n\r\n" + jpeg + b"\r\n")
+            client.sent += 1
+    except ConnectionResetError:
+        pass
+    finally:
+        hub.unsubscribe(client)
+    return response
+
+
+async def recognized(request):
+    # Same contract as the Flask route: updates after ?since=<id>, long-poll with ?wait=<seconds>
+    ring = request.app[EVENTS]
+    cursor = _query_number(request, "since", 0)
+    wait = min(_query_number(request, "wait", 0, float), LONG_POLL_MAX)
+    updates = ring.since(cursor)
+    if not updates and wait > 0 and not ring.closed:
+        await request.app[NOTIFIER].wait(wait)
+        updates = ring.since(cursor)
+    return web.json_response({
+        "recognized": request.app[RECOGNIZED](),
+        "updates": updates,
+        "cursor": updates[-1]["id"] if updates else ring.cursor(cursor),
+    })
+
+
+async def event_stream(request):
+    # Server-Sent Events; browsers resume from Last-Event-ID after a reconnect
+    ring = request.app[EVENTS]
+    try:
+        cursor = int(request.headers["Last-Event-ID"])
+    except (KeyError, ValueError):
+        cursor = _query_number(request, "since", ring.last_id)
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    should_stop = request.app[SHOULD_STOP]
+    try:
+        while not ring.closed and not should_stop():
+            events = ring.since(cursor)
+            if not events:
+                if not await request.app[NOTIFIER].wait(HEARTBEAT_SECONDS):
+                    await response.write(b": keep-alive\n\n")
+                continue
+            for event in events:
+                cursor = event["id"]
+                await response.write(format_sse(event).encode())
+    except ConnectionResetError:
+        pass
+    return response
+
+
+async def metrics(request):
+    return web.Response(body=render_metrics().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+def _json_route(report):
+    async def handler(request):
+        return web.json_response(report())
+    return handler
+
+
+def _post_route(action):
+    async def handler(request):
+        return web.json_response(action())
+    return handler
+
+
+def create_app(broadcaster, events, recognized_fn, json_routes=None, post_routes=None, should_stop=lambda: False):
+    """
+    Builds the aiohttp app. recognized_fn returns the recognized student ids; json_routes
+    maps GET paths to report callables and post_routes maps POST paths to actions (both
+    run on the event loop, so they must be quick).
+    """
+    app = web.Application(middlewares=[timing_middleware])
+    app.on_response_prepare.append(add_cors_header)
+    app[EVENTS] = events
+    app[RECOGNIZED] = recognized_fn
+    app[SHOULD_STOP] = should_stop
+    app.router.add_get("/video_feed", video_feed)
+    app.router.add_get("/recognized.json", recognized)
+    app.router.add_get("/events", event_stream)
+    app.router.add_get("/metrics", metrics)
+    for path, report in (json_routes or {}).items():
+        app.router.add_get(path, _json_route(report))
+    for path, action in (post_routes or {}).items():
+        app.router.add_post(path, _post_route(action))
+
+    async def start_hub(app):
+        loop = asyncio.get_running_loop()
+        app[HUB] = FrameHub(broadcaster, loop).start()
+        app[NOTIFIER] = EventNotifier(loop)
+        events.add_listener(app[NOTIFIER].notify)
+
+    async def close_hub(app):
+        app[HUB].close()
+
+    app.on_startup.append(start_hub)
+    app.on_cleanup.append(close_hub)
+    return app
+
+
+def run(app, host="0.0.0.0", port=8090):
+    """
+    Serves app on the calling thread until the process is stopped. The recognizer's own
+    SIGINT/SIGTERM handlers stay in charge of shutting down.
+    """
+    print(f"[INFO] Serving on http://{host}:{port} (asyncio)")
+    web.run_app(app, host=host, port=port, handle_signals=False, print=None,
+                shutdown_timeout=SHUTDOWN_TIMEOUT, access_log=None)
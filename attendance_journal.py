@@ -0,0 +1,162 @@
+import json
+import os
+import sys
+import threading
+from metrics import LOG_SAVE_SECONDS
+
+# Append-only attendance journal for a session.
+#
+# Instead of rewriting logs/<course>/<course>_<session>.json on every change, full_log.py
+# and run_recognition_stream.py append one JSON line per change to
+# logs/<course>/<course>_<session>.journal.jsonl. Lines are buffered and written with a
+# single fsync per commit window. The usual JSON snapshot is only materialized on demand
+# (end_class, or `python3 attendance_journal.py <course> <session>`), atomically, so a
+# power cut can at worst lose the last commit window and never leaves half a JSON file.
+#
+# Event lines:
+#   {"op": "init", "students": [...]}                      full roster, resets the state
+#   {"op": "update", "student_id": "...", "fields": {...}}  partial update of one student
+
+LOGS_FOLDER = "logs"
+COMMIT_INTERVAL = 1.0  # seconds of events coalesced into one write + fsync
+
+
+def session_log_path(course_id, session_id):
+    return os.path.join(LOGS_FOLDER, course_id, f"{course_id}_{session_id}.json")
+
+
+def journal_path(course_id, session_id):
+    return os.path.join(LOGS_FOLDER, course_id, f"{course_id}_{session_id}.journal.jsonl")
+
+
+def replay(path):
+    """
+    Rebuilds the {student_id: record} state from a journal, in roster order.
+    Torn lines (power cut mid-write) are skipped.
+    """
+    students = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event["op"] == "init":
+                students = {s["student_id"]: dict(s) for s in event["students"]}
+            elif event["op"] == "update":
+                students.setdefault(event["student_id"], {"student_id": event["student_id"]}).update(event["fields"])
+    return students
+
+
+def load_session_students(course_id, session_id):
+    """
+    Current student records of a session: replayed from the journal when there is one,
+    otherwise read from the JSON snapshot. Returns a list like the JSON log.
+    """
+    path = journal_path(course_id, session_id)
+    if os.path.exists(path):
+        return list(replay(path).values())
+    with open(session_log_path(course_id, session_id)) as f:
+        return json.load(f)
+
+
+def write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def materialize(course_id, session_id):
+    """
+    Writes the JSON snapshot of a session from its journal. Returns False when there is no journal.
+    """
+    path = journal_path(course_id, session_id)
+    if not os.path.exists(path):
+        return False
+    write_json_atomic(session_log_path(course_id, session_id), list(replay(path).values()))
+    print(f"[INFO] Materialized {session_log_path(course_id, session_id)} from journal")
+    return True
+
+
+class AttendanceJournal:
+    """
+    Buffered writer of journal events. append() is O(1) and never touches the disk; a
+    background thread commits the buffer every COMMIT_INTERVAL with one write and one fsync.
+    """
+
+    def __init__(self, course_id, session_id, commit_interval=COMMIT_INTERVAL):
+        self.path = journal_path(course_id, session_id)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.commit_interval = commit_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._file = open(self.path, "a")
+        # Terminate a line torn by a power cut so the next event starts on a clean line
+        if self._file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+        self.commits = 0
+        self.events = 0
+        self._thread = threading.Thread(target=self._commit_loop, daemon=True)
+        self._thread.start()
+
+    def append(self, event):
+        line = json.dumps(event, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._buffer.append(line)
+            self.events += 1
+
+    def reset(self, students):
+        """
+        Starts the session state over with a full roster (replaces the old whole-file rewrite).
+        """
+        self.append({"op": "init", "students": list(students)})
+
+    def update(self, student_id, **fields):
+        self.append({"op": "update", "student_id": student_id, "fields": fields})
+
+    def commit(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        try:
+            with LOG_SAVE_SECONDS.time():
+                self._file.write("".join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self.commits += 1
+        except Exception as e:
+            print(f"[ERROR] Failed to commit attendance journal: {e}")
+            with self._lock:
+                self._buffer[:0] = lines  # keep them for the next attempt
+
+    def _commit_loop(self):
+        while not self._closed:
+            self._wake.wait(self.commit_interval)
+            self.commit()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=2)
+        self.commit()
+        self._file.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python3 attendance_journal.py <course_id> <session_id>")
+        sys.exit(1)
+    if not materialize(sys.argv[1], sys.argv[2]):
+        print("[ERROR] No journal found for that session")
+        sys.exit(1)
@@ -0,0 +1,219 @@
+"""
+Attendance from a recorded lecture instead of the live camera.
+
+Splits the video into time chunks and runs them on a pool of worker processes, each
+with the detection, encoding, tracking and matching steps of run_recognition_stream.py.
+The per-student sightings of every chunk are merged and written to the session's
+attendance journal, then materialized into logs/<course>/<course>_<session>.json like
+end_class does.
+
+    python3 batch_attendance.py lecture.mp4
+    python3 batch_attendance.py lecture.mp4 --workers 4 --sample-fps 2 --chunk-seconds 120
+
+Only sampled frames are detected on (--sample-fps, 2 by default); the others are
+skipped without being converted. A student counts as seen after --min-sightings
+sampled frames; "attended" still follows the live rule (face seen and enough minutes
+on the Wi-Fi, when the session has them).
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import cv2
+
+from attendance_journal import AttendanceJournal, journal_path, materialize, session_log_path
+from face_tracker import FaceTracker
+from frame_sources import VideoFileSource
+from recognition_core import prepare_detection_frame, detect_and_encode
+from run_recognition_stream import load_session_config, load_session_roster, load_gallery, FACE_DETECTION_DOWNSCALE_FACTOR
+
+DEFAULT_SAMPLE_FPS = 2.0
+DEFAULT_CHUNK_SECONDS = 120.0
+DEFAULT_MIN_SIGHTINGS = 2
+
+# Set in the parent before the pool forks; the workers share the memory-mapped gallery
+_matcher = None
+
+
+def plan_chunks(frame_count, fps, chunk_seconds):
+    """
+    Splits [0, frame_count) into (start_frame, end_frame) chunks of about chunk_seconds.
+    """
+    chunk_frames = max(1, int(round(chunk_seconds * fps)))
+    return [(start, min(start + chunk_frames, frame_count)) for start in range(0, frame_count, chunk_frames)]
+
+
+def process_chunk(task):
+    """
+    Worker: detects, encodes and matches the sampled frames of one chunk.
+    Returns the chunk's sightings {student_id: [first_s, last_s, sampled_frames]} and counters.
+    """
+    path, start_frame, end_frame, fps, step, downscale, upsample = task
+    started = time.monotonic()
+    capture = cv2.VideoCapture(path)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    tracker = FaceTracker()
+    sightings = {}
+    sampled = faces = 0
+
+    for index in range(start_frame, end_frame):
+        # grab() decodes without the BGR conversion; only sampled frames are retrieved
+        if not capture.grab():
+            break
+        if (index - start_frame) % step:
+            continue
+        ok, frame = capture.retrieve()
+        if not ok:
+            continue
+        sampled += 1
+        # Video time instead of wall time, so the tracker's re-encode schedule follows the lecture
+        now = index / fps
+        rgb_small_frame = prepare_detection_frame(frame, downscale)
+        face_locations, face_encs = detect_and_encode(rgb_small_frame, upsample, downscale,
+                                                      tracker.settled_boxes(now))
+        faces += len(face_locations)
+        tracks = tracker.update(face_locations, now)
+        encoded = [(track, enc) for track, enc in zip(tracks, face_encs) if enc is not None]
+        for track, enc in zip(tracks, face_encs):
+            if enc is None:
+                tracker.reuse(track)
+        for (track, _), face_match in zip(encoded, _matcher.match([enc for _, enc in encoded])):
+            tracker.identify(track, face_match, now)
+
+        # A student matched on two tracks of the same frame is still one sighting
+        for student_id in {track.student_id for track in tracker.visible_tracks()} - {None}:
+            seen = sightings.setdefault(student_id, [now, now, 0])
+            seen[1] = now
+            seen[2] += 1
+
+    capture.release()
+    return {
+        "start_frame": start_frame,
+        "end_frame": end_frame,
+        "sampled": sampled,
+        "faces": faces,
+        "encoded": tracker.encoded,
+        "reused": tracker.reused,
+        "seconds": time.monotonic() - started,
+        "sightings": sightings,
+    }
+
+
+def merge_sightings(results):
+    merged = {}
+    for result in results:
+        for student_id, (first, last, count) in result["sightings"].items():
+            if student_id in merged:
+                seen = merged[student_id]
+                seen[0] = min(seen[0], first)
+                seen[1] = max(seen[1], last)
+                seen[2] += count
+            else:
+                merged[student_id] = [first, last, count]
+    return merged
+
+
+def roster_records(session_config):
+    """
+    Session records in full_log.py's shape, for a session that was never tracked live.
+    """
+    with open("registration.json") as f:
+        registration_data = json.load(f)
+    return [{
+        "student_id": student["student_id"],
+        "name": student["name"],
+        "mac": student["mac"].upper(),
+        "ip": student["ip"],
+        "start": None,
+        "last_seen": None,
+        "total_minutes": 0,
+        "threshold": session_config.get("threshold_minutes", 0),
+        "face": False,
+        "attended": False,
+    } for student in registration_data]
+
+
+def main():
+    global _matcher
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video", help="recorded lecture")
+    parser.add_argument("--config", default="session_config.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-seconds", type=float, default=DEFAULT_CHUNK_SECONDS)
+    parser.add_argument("--sample-fps", type=float, default=DEFAULT_SAMPLE_FPS, help="frames detected per second of video")
+    parser.add_argument("--min-sightings", type=int, default=DEFAULT_MIN_SIGHTINGS,
+                        help="sampled frames a student must be seen in")
+    parser.add_argument("--downscale", type=int, default=FACE_DETECTION_DOWNSCALE_FACTOR)
+    parser.add_argument("--upsample", type=int, default=1)
+    args = parser.parse_args()
+
+    session_config = load_session_config(args.config)
+    course_id = session_config["course_id"]
+    session_id = session_config["session_id"]
+
+    try:
+        video = VideoFileSource(args.video)
+    except (OSError, RuntimeError) as e:
+        print(f"[ERROR] Could not open {args.video}: {e}")
+        sys.exit(1)
+    if video.frame_count <= 0:
+        print(f"[ERROR] {args.video} does not report its frame count")
+        sys.exit(1)
+    duration = video.frame_count / video.fps
+
+    session_data, roster_ids, has_journal = load_session_roster(course_id, session_id)
+    if not session_data and os.path.exists("registration.json"):
+        session_data = roster_records(session_config)
+    _matcher, gallery_source, _ = load_gallery(course_id, roster_ids)
+
+    step = max(1, int(round(video.fps / args.sample_fps)))
+    chunks = plan_chunks(video.frame_count, video.fps, args.chunk_seconds)
+    workers = max(1, min(args.workers, len(chunks)))
+    print(f"[INFO] {video.describe()}: {duration / 60:.1f} min in {len(chunks)} chunks, "
+          f"every {step}th frame, {workers} workers, gallery {len(_matcher)} faces ({gallery_source})")
+
+    started = time.monotonic()
+    tasks = [(args.video, start, end, video.fps, step, args.downscale, args.upsample) for start, end in chunks]
+    results = []
+    # Forked after the gallery is loaded: every worker reads the same memory-mapped matrix
+    with mp.get_context("fork").Pool(workers) as pool:
+        for result in pool.imap_unordered(process_chunk, tasks):
+            results.append(result)
+            print(f"[CHUNK] {result['start_frame'] / video.fps / 60:5.1f}-{result['end_frame'] / video.fps / 60:5.1f} min: "
+                  f"{result['sampled']} frames, {result['faces']} faces, {len(result['sightings'])} students "
+                  f"in {result['seconds']:.1f}s ({len(results)}/{len(chunks)})")
+    elapsed = time.monotonic() - started
+
+    sightings = merge_sightings(results)
+    interval = step / video.fps
+    students = {s["student_id"]: s for s in session_data}
+    journal = AttendanceJournal(course_id, session_id)
+    if not has_journal:
+        journal.reset(session_data)
+    recognized = 0
+    for student_id, (first, last, count) in sorted(sightings.items()):
+        if count < args.min_sightings:
+            continue
+        student = students.get(student_id)
+        if student is None:
+            print(f"[WARNING] {student_id} was recognized but is not on the session roster")
+            continue
+        recognized += 1
+        attended = student.get("total_minutes", 0) >= student.get("threshold", 0)
+        journal.update(student_id, face=True, attended=attended,
+                       face_first_seen=round(first, 1), face_last_seen=round(last, 1),
+                       face_seconds=round(min(count * interval, duration), 1))
+    journal.close()
+    materialize(course_id, session_id)
+
+    print(f"[INFO] {recognized}/{len(students)} students recognized, "
+          f"{sum(r['sampled'] for r in results)} frames in {elapsed:.1f}s "
+          f"({duration / elapsed if elapsed else 0:.1f}x real time)")
+    print(f"[INFO] Attendance written to {session_log_path(course_id, session_id)} "
+          f"(journal {journal_path(course_id, session_id)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Recall/latency benchmark of the IVF index against the exact brute-force scan.
+
+Uses a synthetic gallery shaped like dlib face encodings (different students
+~0.9 apart, a new photo of the same student ~0.35 away), so it runs anywhere.
+
+    python3 bench_ann.py --sizes 500 2000 5000 --queries 400
+"""
+import argparse
+import json
+import time
+import numpy as np
+
+from ann_index import IVFIndex
+from face_matcher import FaceMatcher
+
+STUDENT_SPREAD = 0.9
+SAME_FACE_DISTANCE = 0.35
+
+
+def synthetic_gallery(size, rng):
+    sd = STUDENT_SPREAD / np.sqrt(2 * 128)
+    return rng.normal(0.0, sd, size=(size, 128)).astype(np.float32)
+
+
+def synthetic_queries(gallery, count, rng):
+    truth = rng.integers(0, len(gallery), size=count)
+    noise = rng.normal(0.0, SAME_FACE_DISTANCE / np.sqrt(128), size=(count, 128))
+    return (gallery[truth] + noise).astype(np.float32), truth
+
+
+def time_per_query(fn, queries, batch):
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch):
+        fn(queries[i:i + batch])
+    return (time.perf_counter() - start) / len(queries)
+
+
+def run(sizes, query_count, batch, nprobes, seed):
+    rng = np.random.default_rng(seed)
+    results = []
+
+    for size in sizes:
+        gallery = synthetic_gallery(size, rng)
+        names = [str(i) for i in range(size)]
+        queries, _ = synthetic_queries(gallery, query_count, rng)
+
+        exact = FaceMatcher(names, gallery)
+        exact_ids = np.array([int(m.student_id) if m.student_id else -1 for m in exact.match(queries)])
+        exact_time = time_per_query(exact.match, queries, batch)
+
+        start = time.perf_counter()
+        index = IVFIndex.build(names, gallery)
+        build_time = time.perf_counter() - start
+
+        for nprobe in nprobes:
+            index.nprobe = min(nprobe, index.nlist)
+            ann = FaceMatcher(names, gallery, index=index)
+            ann_ids = np.array([int(m.student_id) if m.student_id else -1 for m in ann.match(queries)])
+            ann_time = time_per_query(ann.match, queries, batch)
+            results.append({
+                "gallery_size": size,
+                "nlist": index.nlist,
+                "nprobe": index.nprobe,
+                "recall_at_1": float(np.mean(ann_ids == exact_ids)),
+                "exact_us_per_query": exact_time * 1e6,
+                "ann_us_per_query": ann_time * 1e6,
+                "build_s": build_time,
+            })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 5000])
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--batch", type=int, default=30, help="faces matched per call (one frame)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.queries, args.batch, args.nprobe, args.seed)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'size':>6} {'nlist':>5} {'nprobe':>6} {'recall@1':>8} {'exact us/q':>10} {'ann us/q':>9} {'build s':>8}")
+    for r in results:
+        print(f"{r['gallery_size']:>6} {r['nlist']:>5} {r['nprobe']:>6} {r['recall_at_1']:>8.3f} "
+              f"{r['exact_us_per_query']:>10.1f} {r['ann_us_per_query']:>9.1f} {r['build_s']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Offline benchmark of the recognizer's hot path, no camera needed.
+
+Feeds recorded frames (--frames-dir with images, or --video) or synthetic frames
+through the same steps run_recognition_stream.py uses: detection-frame preparation,
+HOG detection, encoding, matching against a synthetic gallery of --gallery-size
+students, annotation and the MJPEG JPEG encode. Reports per-stage p50/p95 latency,
+frames/s and memory, optionally as JSON, and can compare against an earlier run.
+--lores 224x168 benchmarks the dual-stream path instead: detection on the Y plane of a
+simulated lores stream (prepare then measures that simulation, which the camera's ISP
+does for free), encoding from crops of the full frame.
+
+    python3 bench_recognition.py --frames 100 --gallery-size 2000 --json --output before.json
+    python3 bench_recognition.py --frames 100 --gallery-size 2000 --baseline before.json
+
+Synthetic frames contain no real faces; use --paste-dir captures/ to paste registration
+photos into them, or --faces to still exercise matching with synthetic encodings.
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import sys
+import time
+import cv2
+import numpy as np
+
+from ann_index import IVFIndex, MIN_INDEXED_FACES
+from bench_ann import synthetic_gallery, synthetic_queries
+from face_matcher import FaceMatcher
+from frame_sources import simulate_lores
+from recognition_core import prepare_detection_frame, detect_and_encode, detect_and_encode_lores, draw_face, draw_fps
+
+STAGES = ["prepare", "detect", "encode", "match", "annotate", "jpeg", "total"]
+JPEG_QUALITY = 70  # same as FrameBroadcaster
+REGRESSION_THRESHOLD = 0.10  # p50 slower by more than this share of the baseline
+
+
+def synthetic_frames(count, width, height, rng, paste_images=()):
+    """
+    Moving gradient + noise frames, with registration photos pasted in when given.
+    """
+    ys, xs = np.mgrid[0:height, 0:width]
+    for i in range(count):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[..., 0] = (xs + 3 * i) % 256
+        frame[..., 1] = (ys + 2 * i) % 256
+        frame[..., 2] = 128
+        frame = cv2.add(frame, rng.integers(0, 20, size=frame.shape, dtype=np.uint8))
+        for j, img in enumerate(paste_images):
+            h, w = img.shape[:2]
+            top = (40 + 60 * j + 2 * i) % max(1, height - h)
+            left = (30 + 180 * j + 3 * i) % max(1, width - w)
+            frame[top:top + h, left:left + w] = img
+        yield frame
+
+
+def load_paste_images(directory, limit, size):
+    images = []
+    for path in sorted(glob.glob(os.path.join(directory, "*")))[:limit]:
+        img = cv2.imread(path)
+        if img is not None:
+            scale = size / max(img.shape[:2])
+            images.append(cv2.resize(img, (0, 0), fx=scale, fy=scale))
+    return images
+
+
+def recorded_frames(frames_dir=None, video=None, limit=None):
+    if frames_dir:
+        paths = sorted(p for p in glob.glob(os.path.join(frames_dir, "*"))
+                       if p.lower().endswith((".jpg", ".jpeg", ".png")))
+        for path in paths[:limit]:
+            frame = cv2.imread(path)
+            if frame is not None:
+                yield frame
+        return
+    capture = cv2.VideoCapture(video)
+    count = 0
+    while limit is None or count < limit:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        count += 1
+        yield frame
+    capture.release()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(samples):
+    values = np.asarray(samples) * 1000
+    if values.size == 0:
+        return {"p50_ms": None, "p95_ms": None, "mean_ms": None}
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+    }
+
+
+def run(frames, matcher, downscale, upsample, synthetic_faces, warmup, rng, lores_size=None):
+    samples = {stage: [] for stage in STAGES}
+    faces_seen = 0
+    processed = 0
+    extra_queries = None
+    if synthetic_faces and len(matcher):
+        extra_queries, _ = synthetic_queries(matcher.matrix, synthetic_faces, rng)
+
+    wall_start = None
+    for i, frame in enumerate(frames):
+        if i == warmup:
+            wall_start = time.perf_counter()
+        t0 = time.perf_counter()
+        if lores_size:
+            luma = simulate_lores(frame, lores_size)
+        else:
+            rgb_small = prepare_detection_frame(frame, downscale)
+        t1 = time.perf_counter()
+        timings = {}
+        if lores_size:
+            locations, encodings = detect_and_encode_lores(luma, frame, frame.shape[1] / lores_size[0], upsample,
+                                                           timings=timings)
+        else:
+            locations, encodings = detect_and_encode(rgb_small, upsample, downscale, timings=timings)
+        t2 = time.perf_counter()
+
+        queries = [enc for enc in encodings if enc is not None]
+        if extra_queries is not None:
+            queries.extend(extra_queries)
+        matches = matcher.match(queries) if queries else []
+        t3 = time.perf_counter()
+
+        annotated = frame  # drawn in place, like the recognizer
+        for location, match in zip(locations, matches):
+            draw_face(annotated, location, match.student_id or "Unknown", match.student_id is not None)
+        draw_fps(annotated, 0.0)
+        t4 = time.perf_counter()
+        ok, _ = cv2.imencode(".jpg", annotated, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        t5 = time.perf_counter()
+
+        if i < warmup:
+            continue
+        processed += 1
+        faces_seen += len(locations)
+        samples["prepare"].append(t1 - t0)
+        samples["detect"].append(timings["detect"])
+        samples["encode"].append(timings["encode"])
+        samples["match"].append(t3 - t2)
+        samples["annotate"].append(t4 - t3)
+        samples["jpeg"].append(t5 - t4)
+        samples["total"].append(t5 - t0)
+
+    wall = time.perf_counter() - wall_start if wall_start is not None else 0.0
+    return {
+        "frames": processed,
+        "faces_detected": faces_seen,
+        "fps": round(processed / wall, 2) if wall else None,
+        "stages": {stage: summarize(values) for stage, values in samples.items()},
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Lists the stages whose p50 got slower than the baseline by more than threshold.
+    """
+    regressions = []
+    for stage, stats in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("p50_ms")
+        after = stats["p50_ms"]
+        if before and after is not None and after > before * (1 + threshold) and after - before > 0.05:
+            regressions.append({"stage": stage, "baseline_p50_ms": before, "p50_ms": after,
+                                "change": round(after / before - 1, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=60, help="frames to measure (after warm-up)")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--frames-dir", help="directory of recorded frames (jpg/png)")
+    parser.add_argument("--video", help="recorded video file")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--paste-dir", help="paste photos from this directory into synthetic frames")
+    parser.add_argument("--paste-count", type=int, default=3)
+    parser.add_argument("--gallery-size", type=int, default=200)
+    parser.add_argument("--faces", type=int, default=0, help="synthetic encodings matched per frame")
+    parser.add_argument("--downscale", type=int, default=3)
+    parser.add_argument("--upsample", type=int, default=1)
+    parser.add_argument("--lores", help="detect on a simulated lores stream of this size, e.g. 224x168")
+    parser.add_argument("--ann", action="store_true", help=f"use the IVF index (gallery >= {MIN_INDEXED_FACES})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    lores_size = tuple(int(v) for v in args.lores.lower().split("x")) if args.lores else None
+    rng = np.random.default_rng(args.seed)
+    rss_before = peak_rss_mb()
+    gallery = synthetic_gallery(args.gallery_size, rng)
+    names = [str(i) for i in range(args.gallery_size)]
+    index = IVFIndex.build(names, gallery) if args.ann and args.gallery_size >= MIN_INDEXED_FACES else None
+    matcher = FaceMatcher(names, gallery, index=index)
+
+    total = args.frames + args.warmup
+    if args.frames_dir or args.video:
+        frames = recorded_frames(args.frames_dir, args.video, total)
+        source = args.frames_dir or args.video
+    else:
+        paste = load_paste_images(args.paste_dir, args.paste_count, args.height // 3) if args.paste_dir else []
+        frames = synthetic_frames(total, args.width, args.height, rng, paste)
+        source = f"synthetic {args.width}x{args.height}" + (f" + {len(paste)} pasted photos" if paste else "")
+
+    # Decoded/generated up front so frames/s only measures the recognition steps
+    frames = list(frames)
+    results = run(frames, matcher, args.downscale, args.upsample, args.faces, args.warmup, rng, lores_size)
+    results.update({
+        "source": source,
+        "gallery_size": args.gallery_size,
+        "ann": index is not None,
+        "downscale": args.downscale,
+        "lores": "x".join(map(str, lores_size)) if lores_size else None,
+        "upsample": args.upsample,
+        "gallery_mb": round(matcher.matrix.nbytes / 2**20, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+    })
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["regressions"] = compare(results, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{results['frames']} frames from {source}, gallery {args.gallery_size}"
+              f"{' (ANN)' if results['ann'] else ''}, {results['faces_detected']} faces detected")
+        print(f"{'stage':>9} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}")
+        for stage, stats in results["stages"].items():
+            if stats["p50_ms"] is not None:
+                print(f"{stage:>9} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} {stats['mean_ms']:>9.3f}")
+        print(f"{results['fps']} frames/s, peak RSS {results['peak_rss_mb']} MB (gallery {results['gallery_mb']} MB)")
+        for r in results.get("regressions", []):
+            print(f"[REGRESSION] {r['stage']}: {r['baseline_p50_ms']} -> {r['p50_ms']} ms p50 (+{r['change']:.0%})")
+
+    # Non-zero exit when compared against a baseline and something got slower
+    if results.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Burst-registration benchmark of the portal's MAC lookup and registration store.
+
+Simulates a class signing up at once: a dnsmasq lease file and an ARP table with
+--students clients, --threads concurrent requests resolving one IP each, and leases
+being added while the burst runs. The same burst is then inserted into the SQLite
+registration store (plus one duplicate per student, which must be rejected) and into
+the old read-scan-rewrite registration.json, counting records that went missing.
+--legacy also times the old ping + arp subprocess lookup (needs both tools; every
+call pings --legacy-ip).
+
+    python3 bench_registration.py --students 200 --threads 16 --legacy
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mac_resolver import MacResolver
+from registration_store import RegistrationStore, DuplicateRegistration
+
+
+def fake_mac(i):
+    return "02:00:00:%02x:%02x:%02x" % ((i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF)
+
+
+def fake_ip(i):
+    return f"192.168.{4 + i // 250}.{10 + i % 250}"
+
+
+def write_tables(directory, students):
+    lease_path = os.path.join(directory, "dnsmasq.leases")
+    arp_path = os.path.join(directory, "arp")
+    expiry = int(time.time()) + 86400
+    with open(lease_path, "w") as f:
+        for i in range(students):
+            f.write(f"{expiry} {fake_mac(i)} {fake_ip(i)} phone-{i} *\n")
+    with open(arp_path, "w") as f:
+        f.write("IP address       HW type     Flags       HW address            Mask     Device\n")
+        for i in range(students):
+            f.write(f"{fake_ip(i):<16} 0x1         0x2         {fake_mac(i)}     *        wlan0\n")
+    return lease_path, arp_path
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def timed_burst(lookup, ips, threads):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(ip):
+        start = time.perf_counter()
+        lookup(ip)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, ips))
+    wall = time.perf_counter() - start
+    return {
+        "lookups": len(ips),
+        "wall_s": wall,
+        "per_s": len(ips) / wall,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+    }
+
+
+def fake_record(i):
+    return {"name": f"Student {i}", "student_id": str(20200000 + i), "ip": fake_ip(i),
+            "mac": fake_mac(i), "photo_path": f"captures/{20200000 + i}.jpg", "timestamp": "20250101-080000"}
+
+
+def store_insert(store, rejected):
+    def insert(i):
+        store.insert(fake_record(i))
+        try:
+            store.insert(dict(fake_record(i), mac=fake_mac(i + 1_000_000)))  # same student_id again
+        except DuplicateRegistration:
+            rejected.append(i)
+    return insert
+
+
+def legacy_json_insert(path):
+    # What portal.register used to do, unlocked
+    def insert(i):
+        record = fake_record(i)
+        with open(path) as f:
+            existing = json.load(f)
+        if any(r["student_id"] == record["student_id"] or r["mac"].lower() == record["mac"] for r in existing):
+            return
+        existing.append(record)
+        with open(path, "w") as f:
+            json.dump(existing, f, indent=2)
+    return insert
+
+
+def safe_json_length(path):
+    try:
+        with open(path) as f:
+            return len(json.load(f))
+    except ValueError:
+        return "corrupt"
+
+
+def legacy_lookup(ping_ip):
+    def lookup(_ip):
+        subprocess.run(["ping", "-c", "1", "-W", "1", ping_ip], stdout=subprocess.DEVNULL)
+        subprocess.run(["arp", "-n", ping_ip], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return lookup
+
+
+def run(students, threads, churn, legacy, legacy_ip):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        lease_path, arp_path = write_tables(directory, students)
+        ips = [fake_ip(i) for i in range(students)]
+
+        # Phones keep joining during the burst, so the lease file changes under the resolver
+        resolver = MacResolver(lease_file=lease_path, arp_table=arp_path, probe=False)
+        stop = threading.Event()
+
+        def add_leases():
+            i = students
+            while churn and not stop.is_set():
+                with open(lease_path, "a") as f:
+                    f.write(f"{int(time.time()) + 86400} {fake_mac(i)} {fake_ip(i)} late-{i} *\n")
+                i += 1
+                time.sleep(1.0 / churn)
+
+        writer = threading.Thread(target=add_leases, daemon=True)
+        writer.start()
+        results["resolver"] = timed_burst(resolver.resolve, ips, threads)
+        stop.set()
+        writer.join()
+        results["resolver"]["sources"] = dict(resolver.stats)
+        results["resolver"]["lease_reloads"] = resolver.leases.reloads
+
+        # Same students submitting again (e.g. after an error page) hit the cache
+        results["resolver_repeat"] = timed_burst(resolver.resolve, ips, threads)
+
+        rejected = []
+        store = RegistrationStore(os.path.join(directory, "registration.db"),
+                                  os.path.join(directory, "registration.json"))
+        results["store_insert"] = timed_burst(store_insert(store, rejected), range(students), threads)
+        results["store_insert"]["stored"] = len(store)
+        results["store_insert"]["duplicates_rejected"] = len(rejected)
+        start = time.perf_counter()
+        store.export_json()
+        results["store_insert"]["export_ms"] = (time.perf_counter() - start) * 1000
+
+        legacy_path = os.path.join(directory, "legacy.json")
+        with open(legacy_path, "w") as f:
+            json.dump([], f)
+        try:
+            results["legacy_json"] = timed_burst(legacy_json_insert(legacy_path), range(students), threads)
+            results["legacy_json"]["stored"] = safe_json_length(legacy_path)
+        except ValueError:
+            results["legacy_json"] = "registration.json corrupted by concurrent rewrites"
+
+    if legacy:
+        if shutil.which("ping") and shutil.which("arp"):
+            results["legacy_ping_arp"] = timed_burst(legacy_lookup(legacy_ip), ips, threads)
+        else:
+            results["legacy_ping_arp"] = "ping/arp not installed"
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16, help="concurrent /register requests")
+    parser.add_argument("--churn", type=float, default=50, help="new leases per second during the burst")
+    parser.add_argument("--legacy", action="store_true", help="also time the old ping + arp subprocesses")
+    parser.add_argument("--legacy-ip", default="127.0.0.1")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    results = run(args.students, args.threads, args.churn, args.legacy, args.legacy_ip)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'lookup':>16} {'count':>6} {'wall s':>7} {'per s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, r in results.items():
+        if isinstance(r, str):
+            print(f"{name:>16} {r}")
+            continue
+        print(f"{name:>16} {r['lookups']:>6} {r['wall_s']:>7.3f} {r['per_s']:>9.0f} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f}")
+    print(f"answers by source: {results['resolver']['sources']}, lease reloads: {results['resolver']['lease_reloads']}")
+    print(f"store: {results['store_insert']['stored']}/{args.students} stored, "
+          f"{results['store_insert']['duplicates_rejected']} duplicates rejected, "
+          f"export {results['store_insert']['export_ms']:.1f} ms")
+    if isinstance(results["legacy_json"], dict):
+        print(f"legacy registration.json: {results['legacy_json']['stored']}/{args.students} stored")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,61 @@
-from flask import Flask, render_template_string, redirect, url_for, jsonify
-import subprocess
+from flask import Flask, Response, render_template_string, redirect, url_for, jsonify
 import os
-import signal
 import json
 import socket
-import time
+import threading
 from datetime import datetime
 
 # Firebase setup for logging
-from firebase_service import upload_session_log, fetch_and_save_session_config
+from firebase_service import upload_session_log, fetch_and_save_session_config, get_sync_worker
+from attendance_journal import materialize, load_session_students
+from station_monitor import StationMonitor, open_source
+from presence_cache import PresenceCache
+from supervisor import Supervisor, ManagedProcess
+from photo_ingest import DRAIN_TIMEOUT
+from metrics import install_flask, gauge
 
 app = Flask(__name__)
+install_flask(app)  # per-route latency and /metrics
 
-# Flags to keep track of portal and session states
 SESSION_CONFIG_FILE = "session_config.json"
-TRACKING_STARTED_FLAG = "tracking_started.flag"
-FACE_STARTED_FLAG = "face_started.flag"
-STOP_RECOGNITION_FLAG = "stop_recognition.flag"
 
-portal_process = None
+# Child processes are owned by the supervisor; tracking and recognition are stopped over
+# their control sockets, the portal with SIGINT as before
+supervisor = Supervisor([
+    # The portal finishes encoding queued registration photos before it exits
+    ManagedProcess("portal", ["python3", "portal.py"], control=False, stop_timeout=DRAIN_TIMEOUT + 5),
+    ManagedProcess("tracking", ["python3", "full_log.py"]),
+    ManagedProcess("recognition", ["python3", "run_recognition_stream.py"]),
+])
+
+gauge("ipbeep_child_running", "Whether a supervised process is running", ["process"],
+      fn=lambda: {(name,): int(child["running"]) for name, child in supervisor.status().items()})
+gauge("ipbeep_sync_outbox_pending", "Session log writes waiting for Firestore", fn=lambda: get_sync_worker().pending())
+gauge("ipbeep_connected_students", "Registered students on the Wi-Fi (as last sampled)",
+      fn=lambda: presence_cache.connected if presence_cache is not None else None)
+
+# Associated Wi-Fi stations are pushed by hostapd; one background sampler turns them into
+# the /connected.json answer that every dashboard shares
+presence_cache = None
+presence_cache_lock = threading.Lock()
+
+def load_connected_roster():
+    # MAC -> student_id of the running session (replayed from the journal while it runs)
+    with open(SESSION_CONFIG_FILE) as f:
+        config = json.load(f)
+    session_data = load_session_students(config["course_id"], config["session_id"])
+    return {student["mac"]: student["student_id"] for student in session_data}
+
+def get_presence_cache():
+    global presence_cache
+    with presence_cache_lock:
+        if presence_cache is None:
+            presence_cache = PresenceCache(StationMonitor(open_source()).start(), load_connected_roster).start()
+        return presence_cache
+
+def invalidate_presence_roster():
+    if presence_cache is not None:
+        presence_cache.invalidate_roster()
 
 def get_wlan0_ip():
     try:
@@ -482,48 +519,62 @@ CONTROL_TEMPLATE = """<!DOCTYPE html>
       // Show loading state initially
       showLoading();
 
-      let lastUpdate = 0;
-      const UPDATE_INTERVAL = 2000; // Update every 2 seconds
-      
-      function updateRecognizedStudents() {
-        const now = Date.now();
-        if (now - lastUpdate < UPDATE_INTERVAL) {
-          return;
+      // Recognized students: one snapshot, then pushed updates over Server-Sent Events.
+      // Each dashboard keeps its own cursor, so several screens all get every update.
+      const recognized = new Set();
+      const RECOGNIZER_URL = `http://${window.location.hostname}:8090`;
+
+      function renderRecognizedStudents() {
+        const studentsDiv = document.getElementById('students');
+        if (recognized.size > 0) {
+          studentsDiv.innerHTML = Array.from(recognized).map(id => 
+            `<span class="badge" style="
+              display: inline-block;
+              padding: 6px 12px;
+              margin: 4px;
+              border-radius: 6px;
+              font-size: 0.9rem;
+              background: linear-gradient(145deg, #27ae60, #2ecc71);
+              color: white;
+              box-shadow: 
+                2px 2px 4px rgba(0,0,0,0.1),
+                -1px -1px 2px rgba(255,255,255,0.5);
+              transition: all 0.2s ease;
+            ">${id}</span>`
+          ).join('');
+        } else {
+          studentsDiv.textContent = 'None';
         }
-        lastUpdate = now;
-        
-        fetch('http://{{ request.host.split(':')[0] }}:8090/recognized.json')
+      }
+
+      function subscribeToRecognitions(cursor) {
+        const events = new EventSource(`${RECOGNIZER_URL}/events?since=${cursor}`);
+        events.addEventListener('recognized', e => {
+          recognized.add(JSON.parse(e.data).student_id);
+          renderRecognizedStudents();
+        });
+        // EventSource reconnects on its own and resumes from the last event id it saw
+        events.onerror = err => console.error('Recognition event stream error:', err);
+      }
+
+      function loadRecognizedStudents(retry = 0) {
+        fetch(`${RECOGNIZER_URL}/recognized.json`)
           .then(res => res.json())
           .then(data => {
-            const studentsDiv = document.getElementById('students');
-            if (data.recognized.length > 0) {
-              studentsDiv.innerHTML = data.recognized.map(id => 
-                `<span class="badge" style="
-                  display: inline-block;
-                  padding: 6px 12px;
-                  margin: 4px;
-                  border-radius: 6px;
-                  font-size: 0.9rem;
-                  background: linear-gradient(145deg, #27ae60, #2ecc71);
-                  color: white;
-                  box-shadow: 
-                    2px 2px 4px rgba(0,0,0,0.1),
-                    -1px -1px 2px rgba(255,255,255,0.5);
-                  transition: all 0.2s ease;
-                ">${id}</span>`
-              ).join('');
-            } else {
-              studentsDiv.textContent = 'None';
-            }
+            data.recognized.forEach(id => recognized.add(id));
+            renderRecognizedStudents();
+            subscribeToRecognitions(data.cursor);
           })
-          .catch(err => console.error('Error fetching recognized students:', err));
+          .catch(err => {
+            console.error('Error fetching recognized students:', err);
+            // The recognizer may still be starting up
+            if (retry < MAX_RETRIES) {
+              setTimeout(() => loadRecognizedStudents(retry + 1), RETRY_DELAY * 2);
+            }
+          });
       }
 
-      // Initial update
-      updateRecognizedStudents();
-      
-      // Update every second, but only fetch if enough time has passed
-      setInterval(updateRecognizedStudents, 1000);
+      loadRecognizedStudents();
     </script>
 
   {% else %}
@@ -543,91 +594,73 @@ def home():
         course_id=config.get("course_id", "N/A"),
         session_id=config.get("session_id", "N/A"),
         threshold=config.get("threshold_minutes", "-"),
-        tracking_started=os.path.exists(TRACKING_STARTED_FLAG),
-        face_started=os.path.exists(FACE_STARTED_FLAG),
-        portal_started=portal_process is not None,
+        tracking_started=supervisor.is_running("tracking") or supervisor.is_running("recognition"),
+        face_started=supervisor.is_running("recognition"),
+        portal_started=supervisor.is_running("portal"),
         portal_ip=get_wlan0_ip()
     )
 
 @app.route("/start_portal", methods=["POST"])
 def start_portal():
-    global portal_process
-    if portal_process is None:
-        portal_process = subprocess.Popen(["python3", "portal.py"])
+    if supervisor.start("portal"):
         print("[INFO] portal.py started")
     return redirect(url_for("home"))
 
 @app.route("/stop_portal", methods=["POST"])
 def stop_portal():
-    global portal_process
-    if portal_process is not None:
-        portal_process.send_signal(signal.SIGINT)
-        portal_process.wait()
-        portal_process = None
+    if supervisor.stop("portal") != "not running":
         print("[INFO] portal.py stopped")
     return redirect(url_for("home"))
 
 @app.route("/start_class", methods=["POST"])
 def start_class():
-    global portal_process
-
-    # Clean previous flags and processes
-    for flag in [TRACKING_STARTED_FLAG, FACE_STARTED_FLAG, STOP_RECOGNITION_FLAG]:
-        if os.path.exists(flag):
-            os.remove(flag)
+    # Stop whatever is left of a previous session
+    supervisor.stop("recognition")
+    supervisor.stop("tracking")
 
-    if portal_process is not None:
-        portal_process.send_signal(signal.SIGINT)
-        portal_process.wait()
-        portal_process = None
+    if supervisor.stop("portal") != "not running":
         print("[INFO] portal.py auto-stopped by start_class")
 
-    subprocess.Popen(["python3", "full_log.py"])
-    with open(TRACKING_STARTED_FLAG, "w") as f:
-        f.write("1")
+    supervisor.start("tracking")
+    invalidate_presence_roster()
+
+    # Changed student records go to Firestore every minute while the class runs
+    try:
+        with open(SESSION_CONFIG_FILE) as f:
+            config = json.load(f)
+        get_sync_worker().live_session = (config["course_id"], config["session_id"])
+    except Exception as e:
+        print(f"[WARNING] Live Firestore sync not started: {e}")
 
     print("[INFO] full_log.py started")
     return redirect(url_for("home"))
 
 @app.route("/start_face_recognition", methods=["POST"])
 def start_face_recognition():
-    os.system("pkill -f full_log.py")
+    # MAC tracking saves its totals and exits before the recognizer takes over the session log
+    supervisor.stop("tracking")
 
-    with open(FACE_STARTED_FLAG, "w") as f:
-        f.write("1")
-
-    subprocess.Popen(["python3", "run_recognition_stream.py"])
+    supervisor.start("recognition")
     print("[INFO] run_recognition_stream.py started")
 
     return redirect(url_for("home"))
 
 @app.route("/end_class", methods=["POST"])
 def end_class():
-    # 1: Signal face recognition to stop gracefully
-    with open(STOP_RECOGNITION_FLAG, "w") as f:
-        f.write("1")
-    print("[INFO] Sent stop signal to run_recognition.py")
-
-    # 2: Wait until run_recognition.py exits
-    timeout = 3 # seconds
-    for _ in range(timeout * 10):  # check every 0.1s
-        time.sleep(0.1)
-        result = os.system("pgrep -f run_recognition.py > /dev/null")
-        if result != 0:
-            print("[INFO] run_recognition.py has stopped.")
-            break
-    else:
-        print("⚠️ Timeout waiting for run_recognition.py to stop.")
-
-    # 3: Remove state flags
-    for flag in [TRACKING_STARTED_FLAG, FACE_STARTED_FLAG]:
-        if os.path.exists(flag):
-            os.remove(flag)
-
-    # 4: Upload final log to Firebase
+    # 1+2: Ask face recognition (and tracking, if recognition never started) to stop; they
+    # acknowledge at once over the control socket and the supervisor waits for the exit
+    for name in ["recognition", "tracking"]:
+        outcome = supervisor.stop(name)
+        if outcome not in ("stopped", "not running"):
+            print(f"⚠️ {name} had to be {outcome}.")
+
+    # 3: Materialize the JSON log from the attendance journal and queue its changes for
+    # Firebase; the sync worker uploads them in the background (later, if offline)
+    get_sync_worker().live_session = None
     try:
         with open(SESSION_CONFIG_FILE) as f:
             config = json.load(f)
+        materialize(config["course_id"], config["session_id"])
         upload_session_log(config["course_id"], config["session_id"])
     except Exception as e:
         print(f"❌ Error reading session config for Firebase upload: {e}")
@@ -637,8 +670,19 @@ def end_class():
 @app.route("/fetch_config", methods=["POST"])
 def fetch_config():
     fetch_and_save_session_config()
+    invalidate_presence_roster()
     return redirect(url_for("home"))
 
+@app.route("/processes.json")
+def processes():
+    # Supervisor view: running state, pid and uptime, plus each child's own health report
+    return jsonify(supervisor.status(with_health=True))
+
+@app.route("/sync.json")
+def sync_status():
+    # Firestore outbox: queued writes, failures/backoff and the last successful flush
+    return jsonify(get_sync_worker().status())
+
 @app.route("/status")
 def status():
     if os.path.exists(SESSION_CONFIG_FILE):
@@ -648,46 +692,8 @@ def status():
 
 @app.route("/connected.json")
 def get_connected():
-    try:
-        # Get current session info
-        with open(SESSION_CONFIG_FILE) as f:
-            config = json.load(f)
-        
-        course_id = config["course_id"]
-        session_id = config["session_id"]
-        session_file = f"{course_id}_{session_id}.json"
-        session_path = os.path.join("logs", course_id, session_file)
-        
-        # Read session data
-        with open(session_path, "r") as f:
-            session_data = json.load(f)
-        
-        # Get current connected MACs from iw command
-        iw_output = subprocess.check_output(["iw", "dev", "wlan0", "station", "dump"]).decode()
-        connected_macs = set()
-        
-        for line in iw_output.splitlines():
-            if line.strip().startswith("Station"):
-                mac = line.strip().split()[1].upper()
-                connected_macs.add(mac)
-        
-        # Count students that are currently connected
-        connected = 0
-        connected_students = []
-        
-        for student in session_data:
-            if student["mac"] in connected_macs:
-                connected += 1
-                connected_students.append(student["student_id"])
-        
-        print(f"[DEBUG] Found {connected} currently connected students")
-        return jsonify({
-            "connected": connected,
-            "students": connected_students
-        })
-    except Exception as e:
-        print(f"[ERROR] Failed to get connected students: {e}")
-        return jsonify({"connected": 0, "students": []})
+    # Served from the shared in-memory snapshot: no file reads or subprocesses per request
+    return Response(get_presence_cache().snapshot_json(), mimetype="application/json")
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
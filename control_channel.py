@@ -0,0 +1,96 @@
+import json
+import os
+import socket
+import threading
+
+# Unix-domain control socket shared by class_control.py's supervisor and its children
+# (full_log.py, run_recognition_stream.py). One JSON object per line in each direction:
+#
+#   -> {"cmd": "status"}      <- {"ok": true, "pid": 1234, ...}
+#   -> {"cmd": "health"}      <- {"ok": true, ...child specific stats...}
+#   -> {"cmd": "stop"}        <- {"ok": true, "state": "stopping"}   (acknowledged at once)
+#
+# Replaces the flag files the processes used to poll for and the pgrep/pkill loops.
+
+CONTROL_DIR = "run"
+CONTROL_ENV = "IPBEEP_CONTROL_SOCKET"
+REQUEST_TIMEOUT = 2.0
+
+
+def control_path(name):
+    """
+    Socket path of a child: the one the supervisor passed in the environment, else run/<name>.sock.
+    """
+    return os.environ.get(CONTROL_ENV) or os.path.join(CONTROL_DIR, f"{name}.sock")
+
+
+class ControlServer:
+    """
+    Serves control requests on a background thread. handlers maps a command name to a
+    callable returning a dict; they should return quickly (stop just sets an event).
+    """
+
+    def __init__(self, path, handlers):
+        self.path = path
+        self.handlers = dict(handlers)
+        self.handlers.setdefault("status", lambda: {})
+        self._sock = None
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        self._sock.listen(8)
+        threading.Thread(target=self._serve, daemon=True).start()
+        return self
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return  # closed
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn, conn.makefile("rw") as stream:
+            for line in stream:
+                try:
+                    cmd = json.loads(line).get("cmd")
+                    handler = self.handlers.get(cmd)
+                    if handler is None:
+                        reply = {"ok": False, "error": f"unknown command {cmd!r}"}
+                    else:
+                        reply = dict(handler() or {}, ok=True)
+                        if cmd == "status":
+                            reply.setdefault("pid", os.getpid())
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                stream.write(json.dumps(reply) + "\n")
+                stream.flush()
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def send_command(path, cmd, timeout=REQUEST_TIMEOUT):
+    """
+    Sends one command and returns the reply dict. Raises OSError when nobody is listening.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((json.dumps({"cmd": cmd}) + "\n").encode())
+        with sock.makefile("r") as stream:
+            line = stream.readline()
+    if not line:
+        raise OSError(f"{path} closed the connection")
+    return json.loads(line)
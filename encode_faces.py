@@ -1,43 +1,187 @@
 import face_recognition
+import argparse
+import fcntl
+import hashlib
+import json
 import os
-import pickle
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+from ann_index import build_index, INDEX_FILE
+from encoding_store import open_store, STORE_DIR
 
 CAPTURE_DIR = "captures"
-ENCODING_FILE = "encodings.pkl"
+# Which photo (and which version of it) every student's encoding came from
+MANIFEST_FILE = "encodings_manifest.json"
 
-# Load existing encodings if available
-if os.path.exists(ENCODING_FILE):
-    with open(ENCODING_FILE, "rb") as f:
-        known_faces = pickle.load(f)
-    print(f"[INFO] Loaded {len(known_faces)} previously encoded students.")
-else:
-    known_faces = {}
+# Phone photos are often 12 MP; a selfie face is still ~200 px wide at this size,
+# well above what HOG needs, and detection runs many times faster
+MAX_DETECTION_SIDE = 800
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
 
-print("[INFO] Scanning for new images to encode...")
 
-new_encodings = 0
+def file_signature(path):
+    stat = os.stat(path)
+    return {"mtime": stat.st_mtime, "size": stat.st_size}
 
-for file in os.listdir(CAPTURE_DIR):
-    if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-        student_id = file.split("_")[0]
-        if student_id in known_faces:
-            print(f"[SKIP] {student_id} already encoded.")
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_for_detection(path, max_side=MAX_DETECTION_SIDE):
+    """
+    Opens a photo, applies its EXIF orientation and shrinks it to max_side before detection.
+    For JPEGs draft() lets the decoder skip most of the full-resolution work.
+    """
+    img = Image.open(path)
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_side, max_side))
+    return np.asarray(img)
+
+
+def encode_image(image):
+    """
+    Encoding of the largest face in an RGB image, or None. With several faces in the
+    photo the largest one is taken as the student.
+    """
+    locations = face_recognition.face_locations(image)
+    if not locations:
+        return None
+    largest = max(locations, key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]))
+    return face_recognition.face_encodings(image, [largest])[0]
+
+
+def encode_photo(path, max_side=MAX_DETECTION_SIDE):
+    """
+    Worker: returns (path, encoding or None, seconds).
+    """
+    start = time.monotonic()
+    try:
+        encoding = encode_image(load_for_detection(path, max_side))
+        return path, encoding, time.monotonic() - start
+    except Exception as e:
+        print(f"[ERROR] Could not encode {path}: {e}")
+        return path, None, time.monotonic() - start
+
+
+def newest_photo_per_student(capture_dir):
+    """
+    Maps student_id -> path of that student's most recently modified photo.
+    """
+    newest = {}
+    for file in os.listdir(capture_dir):
+        if not file.lower().endswith(IMAGE_EXTENSIONS):
             continue
+        student_id = file.split("_")[0]
+        path = os.path.join(capture_dir, file)
+        if student_id not in newest or os.path.getmtime(path) > os.path.getmtime(newest[student_id]):
+            newest[student_id] = path
+    return newest
+
+
+def manifest_entry(path):
+    return dict(file_signature(path), path=path, sha1=file_hash(path))
 
-        image_path = os.path.join(CAPTURE_DIR, file)
-        image = face_recognition.load_image_file(image_path)
-        encodings = face_recognition.face_encodings(image)
 
-        if not encodings:
-            print(f"[WARNING] No face found in {file}")
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    with open(MANIFEST_FILE) as f:
+        return json.load(f)
+
+
+def update_manifest(entries):
+    """
+    Merges {student_id: entry} into the manifest under a lock, so this script and the
+    portal's on-upload encoder never overwrite each other's entries.
+    """
+    with open(MANIFEST_FILE + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        manifest = load_manifest()
+        manifest.update(entries)
+        tmp_path = MANIFEST_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, MANIFEST_FILE)
+
+
+def is_unchanged(path, entry):
+    """
+    True when the photo is the same one the stored encoding came from. mtime/size is the
+    fast check; the content hash settles the case where only the mtime moved.
+    """
+    if entry is None or entry.get("path") != path:
+        return False
+    signature = file_signature(path)
+    if signature["size"] == entry["size"] and signature["mtime"] == entry["mtime"]:
+        return True
+    return signature["size"] == entry["size"] and file_hash(path) == entry["sha1"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode new or changed student photos in parallel.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-side", type=int, default=MAX_DETECTION_SIDE,
+                        help="longest image side used for detection (default %(default)s)")
+    parser.add_argument("--force", action="store_true", help="re-encode every photo")
+    args = parser.parse_args()
+
+    # Existing encodings (an old encodings.pkl is imported into the store the first time)
+    store = open_store()
+    known_ids = set(store.load()[0]) if store.exists() else set()
+    if known_ids:
+        print(f"[INFO] Loaded {len(known_ids)} previously encoded students.")
+
+    manifest = load_manifest()
+    new_entries = {}
+
+    print("[INFO] Scanning for new or changed images to encode...")
+
+    todo = {}
+    for student_id, path in newest_photo_per_student(CAPTURE_DIR).items():
+        if not args.force and student_id in known_ids and is_unchanged(path, manifest.get(student_id)):
             continue
+        todo[path] = student_id
+    print(f"[INFO] {len(todo)} photo(s) to encode, {len(known_ids)} student(s) already up to date or kept")
+
+    start = time.monotonic()
+    new_encodings = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for path, encoding, seconds in pool.map(encode_photo, list(todo), [args.max_side] * len(todo)):
+            student_id = todo[path]
+            if encoding is None:
+                print(f"[WARNING] No face found in {os.path.basename(path)}")
+                continue
+            new_encodings.append((student_id, encoding))
+            new_entries[student_id] = manifest_entry(path)
+            print(f"[ENCODED] {student_id} from {os.path.basename(path)} ({seconds:.2f}s)")
+    elapsed = time.monotonic() - start
+
+    # New students are appended and re-enrolled ones overwritten in place; the manifest is
+    # written last so a crash only causes re-encoding
+    if new_encodings:
+        generation = store.upsert_many(new_encodings)
+        print(f"[INFO] Saved {len(new_encodings)} encoding(s) to {STORE_DIR}/ (generation {generation})")
+    if new_entries:
+        update_manifest(new_entries)
+
+    # Rebuild the ANN index next to the encodings so the recognizer never loads a stale one
+    ids, matrix = store.load() if store.exists() else ([], [])
+    index = build_index(ids, matrix, INDEX_FILE)
+    if index is not None:
+        print(f"[INFO] Built ANN index: {index.nlist} lists over {len(index)} students -> {INDEX_FILE}")
 
-        known_faces[student_id] = encodings[0]
-        new_encodings += 1
-        print(f"[ENCODED] {student_id} from {file}")
+    if todo:
+        print(f"[INFO] Throughput: {len(todo) / elapsed:.1f} photos/s over {elapsed:.1f}s with {args.workers} workers")
+    print(f"[✅ DONE] Encoded {len(new_encodings)} new student(s). Total: {len(ids)}")
 
-# Save updated encodings
-with open(ENCODING_FILE, "wb") as f:
-    pickle.dump(known_faces, f)
 
-print(f"[✅ DONE] Encoded {new_encodings} new student(s). Total: {len(known_faces)}")
+if __name__ == "__main__":
+    main()
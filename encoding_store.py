@@ -0,0 +1,214 @@
+import fcntl
+import json
+import os
+import pickle
+import time
+import numpy as np
+
+# Versioned on-disk store of the enrolled face encodings, replacing encodings.pkl.
+#
+#   encodings_store/header.json   format/version, model metadata, row count, generation
+#   encodings_store/ids.txt       one student_id per line, row order
+#   encodings_store/vectors.f32   raw little-endian float32 rows of ENCODING_SIZE values
+#
+# Readers memory-map vectors.f32 (no copy, no unpickling) and only trust the first
+# header["count"] rows/ids, so a writer that crashed half-way never corrupts a load.
+# Writers take an flock and append new rows past header["count"], which readers'
+# mappings never cover. A batch that replaces existing rows writes a new vectors.f32
+# next to the old one and swaps it in instead, so rows are never rewritten under a
+# running recognizer (it keeps mapping the old file until it reloads). ids.txt and
+# header.json are then replaced atomically.
+
+STORE_DIR = "encodings_store"
+LEGACY_PICKLE = "encodings.pkl"
+STORE_FORMAT = "ipbeep-encodings"
+STORE_VERSION = 1
+ENCODING_SIZE = 128
+DTYPE = np.dtype("<f4")
+MODEL = "dlib_face_recognition_resnet_model_v1"
+
+
+def _write_atomic(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class EncodingStore:
+    """
+    Reader/writer for one encoding store directory. load() is cheap enough to call again
+    whenever header()["generation"] changes.
+    """
+
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+        self.header_path = os.path.join(directory, "header.json")
+        self.ids_path = os.path.join(directory, "ids.txt")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.lock_path = os.path.join(directory, ".lock")
+
+    def exists(self):
+        return os.path.exists(self.header_path)
+
+    def header(self):
+        with open(self.header_path) as f:
+            header = json.load(f)
+        if header.get("format") != STORE_FORMAT:
+            raise ValueError(f"{self.header_path} is not an encoding store")
+        if header.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported encoding store version {header.get('version')}")
+        if header.get("dim") != ENCODING_SIZE:
+            raise ValueError(f"Store holds {header.get('dim')}-d encodings, expected {ENCODING_SIZE}")
+        return header
+
+    def _read_ids(self, count):
+        if count == 0:
+            return []
+        with open(self.ids_path) as f:
+            ids = f.read().split("\n")
+        return ids[:count]
+
+    def load(self):
+        """
+        Returns (ids, matrix) where matrix is a read-only (N x 128) float32 memmap.
+        """
+        header = self.header()
+        count = header["count"]
+        ids = self._read_ids(count)
+        if count == 0:
+            return ids, np.empty((0, ENCODING_SIZE), dtype=DTYPE)
+        matrix = np.memmap(self.vectors_path, dtype=DTYPE, mode="r", shape=(count, ENCODING_SIZE))
+        return ids, matrix
+
+    def as_dict(self):
+        ids, matrix = self.load()
+        return {student_id: np.array(matrix[i]) for i, student_id in enumerate(ids)}
+
+    def _lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(self.lock_path, "w")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def upsert_many(self, items):
+        """
+        Adds or replaces encodings for [(student_id, encoding), ...]. Existing students get
+        their row replaced; new ones are appended. Returns the new generation number.
+        """
+        lock_file = self._lock()
+        try:
+            if self.exists():
+                header = self.header()
+            else:
+                header = {"format": STORE_FORMAT, "version": STORE_VERSION, "model": MODEL,
+                          "dim": ENCODING_SIZE, "dtype": DTYPE.str, "count": 0, "generation": 0,
+                          "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+            count = header["count"]
+            ids = self._read_ids(count) if count else []
+            rows = {student_id: i for i, student_id in enumerate(ids)}
+            replaced = {}
+            added = []
+            for student_id, encoding in items:
+                vector = np.asarray(encoding, dtype=DTYPE).reshape(ENCODING_SIZE)
+                row = rows.get(student_id)
+                if row is None:
+                    rows[student_id] = row = len(ids)
+                    ids.append(student_id)
+                    added.append(vector)
+                elif row < count:
+                    replaced[row] = vector
+                else:
+                    added[row - count] = vector  # the same new student twice in one batch
+
+            if replaced:
+                # Copy-on-write: running matchers map the old file and must not see it change
+                matrix = np.fromfile(self.vectors_path, dtype=DTYPE, count=count * ENCODING_SIZE)
+                matrix = matrix.reshape(count, ENCODING_SIZE)
+                for row, vector in replaced.items():
+                    matrix[row] = vector
+                tmp_path = self.vectors_path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    np.concatenate([matrix, np.asarray(added, dtype=DTYPE).reshape(-1, ENCODING_SIZE)]).tofile(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.vectors_path)
+            elif added:
+                # Append after the last committed row; anything past it is left over from a crashed writer
+                with open(self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "w+b") as f:
+                    f.truncate(count * ENCODING_SIZE * DTYPE.itemsize)
+                    f.seek(0, os.SEEK_END)
+                    np.asarray(added, dtype=DTYPE).tofile(f)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            _write_atomic(self.ids_path, "\n".join(ids))
+            header["count"] = len(ids)
+            header["generation"] += 1
+            header["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            _write_atomic(self.header_path, json.dumps(header, indent=2))
+            return header["generation"]
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def upsert(self, student_id, encoding):
+        return self.upsert_many([(student_id, encoding)])
+
+
+def open_store(directory=STORE_DIR, legacy_pickle=LEGACY_PICKLE):
+    """
+    Opens the encoding store, importing a legacy encodings.pkl once if the store does not exist yet.
+    """
+    store = EncodingStore(directory)
+    if not store.exists() and os.path.exists(legacy_pickle):
+        with open(legacy_pickle, "rb") as f:
+            known_faces = pickle.load(f)
+        store.upsert_many(known_faces.items())
+        print(f"[INFO] Imported {len(known_faces)} encodings from {legacy_pickle} into {directory}/")
+    return store
+
+
+def load_course_gallery(store, course_id, roster_ids):
+    """
+    Returns (ids, matrix, cached) with only the encodings of the students on a course roster.
+
+    The subset is cached as encodings_store/courses/<course_id>.f32 plus a small JSON
+    sidecar, reused while the store generation and the roster stay the same, so a session
+    start maps a few hundred rows instead of the whole department.
+    """
+    header = store.header()
+    roster = sorted(set(roster_ids))
+    course_dir = os.path.join(store.directory, "courses")
+    meta_path = os.path.join(course_dir, f"{course_id}.json")
+    vectors_path = os.path.join(course_dir, f"{course_id}.f32")
+
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["generation"] == header["generation"] and meta["roster"] == roster:
+            ids = meta["ids"]
+            if not ids:
+                return ids, np.empty((0, ENCODING_SIZE), dtype=DTYPE), True
+            matrix = np.memmap(vectors_path, dtype=DTYPE, mode="r", shape=(len(ids), ENCODING_SIZE))
+            return ids, matrix, True
+    except (OSError, ValueError, KeyError):
+        pass
+
+    all_ids, all_matrix = store.load()
+    wanted = set(roster)
+    rows = [i for i, student_id in enumerate(all_ids) if student_id in wanted]
+    ids = [all_ids[i] for i in rows]
+    matrix = np.ascontiguousarray(all_matrix[rows], dtype=DTYPE)
+
+    try:
+        os.makedirs(course_dir, exist_ok=True)
+        with open(vectors_path + ".tmp", "wb") as f:
+            f.write(matrix.tobytes())
+        os.replace(vectors_path + ".tmp", vectors_path)
+        _write_atomic(meta_path, json.dumps({"generation": header["generation"], "roster": roster, "ids": ids}))
+    except OSError as e:
+        print(f"[WARNING] Could not cache the gallery of {course_id}: {e}")
+    return ids, matrix, False
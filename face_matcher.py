@@ -0,0 +1,94 @@
+import numpy as np
+from collections import namedtuple
+
+# Same cut-off face_recognition.compare_faces uses by default
+DEFAULT_TOLERANCE = 0.6
+ENCODING_SIZE = 128
+
+# student_id is None when the closest known face is further than the tolerance.
+# margin is the gap between the best and the second best distance (inf with one known face).
+FaceMatch = namedtuple("FaceMatch", ["student_id", "distance", "margin"])
+
+
+class FaceMatcher:
+    """
+    Keeps the known encodings as one contiguous (N x 128) float32 matrix and
+    scores every face of a frame against it in a single batched computation.
+    When an ANN index (see ann_index.py) is attached, lookups go through it instead
+    of the exact scan.
+    """
+
+    def __init__(self, names, encodings, tolerance=DEFAULT_TOLERANCE, index=None):
+        self.names = list(names)
+        self.tolerance = tolerance
+        self.index = index
+        if isinstance(encodings, np.ndarray) and encodings.ndim == 2:
+            # Already a matrix (e.g. the memmap from encoding_store.py): use it without copying
+            self.matrix = np.ascontiguousarray(encodings, dtype=np.float32)
+        elif self.names:
+            self.matrix = np.ascontiguousarray(np.vstack(encodings), dtype=np.float32)
+        else:
+            self.matrix = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        # Squared norms are fixed, so precompute them once for the ||a||^2 + ||b||^2 - 2ab expansion
+        self.sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+
+    @classmethod
+    def from_dict(cls, known_faces, tolerance=DEFAULT_TOLERANCE, index=None):
+        """
+        Builds a matcher from a {student_id: encoding} dict.
+        """
+        return cls(list(known_faces.keys()), list(known_faces.values()), tolerance, index)
+
+    def __len__(self):
+        return len(self.names)
+
+    def distances(self, face_encs):
+        """
+        Returns the (F x N) matrix of euclidean distances between F face encodings and the N known faces.
+        """
+        queries = np.asarray(face_encs, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        sq_dist = q_norms[:, None] + self.sq_norms[None, :] - 2.0 * (queries @ self.matrix.T)
+        np.maximum(sq_dist, 0.0, out=sq_dist)  # rounding can make near-identical pairs slightly negative
+        return np.sqrt(sq_dist, out=sq_dist)
+
+    def match(self, face_encs):
+        """
+        Matches every face encoding of a frame at once and returns one FaceMatch per face,
+        picking the closest known face rather than the first one under the tolerance.
+        """
+        if len(face_encs) == 0:
+            return []
+        if not self.names:
+            return [FaceMatch(None, float("inf"), float("inf")) for _ in face_encs]
+
+        if self.index is not None:
+            best, best_dist, second_dist = self.index.search(face_encs)
+            with np.errstate(invalid="ignore"):
+                margins = np.where(np.isfinite(best_dist), second_dist - best_dist, np.inf)
+            return self._results(best, best_dist, margins)
+
+        dist = self.distances(face_encs)
+        rows = np.arange(dist.shape[0])
+
+        if dist.shape[1] == 1:
+            best = np.zeros(dist.shape[0], dtype=np.intp)
+            best_dist = dist[:, 0]
+            margins = np.full(dist.shape[0], np.inf)
+        else:
+            # Only the two smallest distances per face are needed, no full sort
+            top2 = np.argpartition(dist, 1, axis=1)[:, :2]
+            d_top2 = dist[rows[:, None], top2]
+            order = np.argsort(d_top2, axis=1)
+            best = top2[rows, order[:, 0]]
+            best_dist = d_top2[rows, order[:, 0]]
+            margins = d_top2[rows, order[:, 1]] - best_dist
+
+        return self._results(best, best_dist, margins)
+
+    def _results(self, best, best_dist, margins):
+        results = []
+        for idx, d, m in zip(best, best_dist, margins):
+            student_id = self.names[idx] if idx >= 0 and d <= self.tolerance else None
+            results.append(FaceMatch(student_id, float(d), float(m)))
+        return results
@@ -0,0 +1,149 @@
+import time
+from itertools import count
+
+# Boxes are (top, right, bottom, left) in full-frame pixels, the face_recognition order.
+
+IOU_MATCH_THRESHOLD = 0.3
+MAX_MISSED_DETECTIONS = 3
+# A confidently identified track is only re-encoded this often, to catch identity swaps
+REENCODE_SECONDS = 30
+# Tracks that matched nobody are retried at this pace instead of every detection frame
+UNKNOWN_RETRY_SECONDS = 2
+# Below this distance gap to the runner-up a match is treated as uncertain
+MIN_CONFIDENT_MARGIN = 0.08
+
+
+def box_iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+def overlaps_any(box, boxes, threshold=IOU_MATCH_THRESHOLD):
+    return any(box_iou(box, other) >= threshold for other in boxes)
+
+
+class Track:
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.student_id = None
+        self.distance = None
+        self.margin = None
+        self.hits = 1
+        self.missed = 0
+        self.created_at = now
+        self.next_encode_at = now  # new tracks are always encoded
+
+    @property
+    def label(self):
+        return self.student_id if self.student_id is not None else "Unknown"
+
+
+class FaceTracker:
+    """
+    IoU tracker linking face boxes across detection frames so each track keeps its identity.
+    Only new, unknown-and-due or uncertain tracks need a fresh 128-d encoding.
+    """
+
+    def __init__(self, iou_threshold=IOU_MATCH_THRESHOLD, max_missed=MAX_MISSED_DETECTIONS):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = []
+        self._ids = count(1)
+        self.encoded = 0
+        self.reused = 0
+
+    def update(self, boxes, now=None, region=None):
+        """
+        Associates this frame's detections with the current tracks (greedy by IoU), starts
+        tracks for unmatched boxes and ages out tracks missed too many times. When detection
+        only ran on a region, tracks outside of it are left untouched.
+        Returns the track of every box, in the same order as boxes.
+        """
+        now = time.time() if now is None else now
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            for di, box in enumerate(boxes):
+                iou = box_iou(track.box, box)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, ti, di))
+        pairs.sort(reverse=True)
+
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        for _, ti, di in pairs:
+            if ti in used_tracks or assigned[di] is not None:
+                continue
+            track = self.tracks[ti]
+            track.box = boxes[di]
+            track.hits += 1
+            track.missed = 0
+            assigned[di] = track
+            used_tracks.add(ti)
+
+        kept = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in used_tracks and (region is None or box_iou(track.box, region) > 0):
+                track.missed += 1
+            if track.missed <= self.max_missed:
+                kept.append(track)
+        self.tracks = kept
+
+        for di, box in enumerate(boxes):
+            if assigned[di] is None:
+                track = Track(next(self._ids), box, now)
+                self.tracks.append(track)
+                assigned[di] = track
+        return assigned
+
+    def settled_boxes(self, now=None):
+        """
+        Boxes of tracks that do not need a new encoding yet. Detections overlapping one
+        of these can skip the encoder entirely.
+        """
+        now = time.time() if now is None else now
+        return [t.box for t in self.tracks if t.missed == 0 and t.next_encode_at > now]
+
+    def identify(self, track, face_match, now=None):
+        """
+        Stores a fresh match on a track and schedules its next encoding based on how sure it is.
+        Returns True when the track's identity changed.
+        """
+        now = time.time() if now is None else now
+        changed = face_match.student_id != track.student_id
+        track.student_id = face_match.student_id
+        track.distance = face_match.distance
+        track.margin = face_match.margin
+        self.encoded += 1
+
+        if face_match.student_id is None:
+            track.next_encode_at = now + UNKNOWN_RETRY_SECONDS
+        elif face_match.margin >= MIN_CONFIDENT_MARGIN:
+            track.next_encode_at = now + REENCODE_SECONDS
+        else:
+            track.next_encode_at = now  # uncertain, try again on the next detection
+        return changed
+
+    def reuse(self, track):
+        """
+        Counts a detection that kept its track identity without running the encoder.
+        """
+        self.reused += 1
+
+    def visible_tracks(self):
+        return [t for t in self.tracks if t.missed == 0]
+
+    def stats(self):
+        total = self.encoded + self.reused
+        return {
+            "tracks": len(self.tracks),
+            "encoded": self.encoded,
+            "reused": self.reused,
+            "encode_ratio": round(self.encoded / total, 3) if total else None,
+        }
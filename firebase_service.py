@@ -1,37 +1,310 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import os
 import json
+import hashlib
+import random
+import sqlite3
+import threading
+import time
 from datetime import datetime
 
+# Session logs reach Firestore through a local outbox instead of one blocking set() at
+# end_class. Only student records that changed since the last sync are queued; queued
+# changes survive restarts in sync_outbox.db and are flushed by a background worker in
+# batched merge writes, retrying with exponential backoff while the Pi has no uplink.
+#
+# The backend is pluggable: Firestore (which also talks to the emulator when
+# FIRESTORE_EMULATOR_HOST is set) or LocalBackend, a JSON-file fake for testing.
+# IPBEEP_SYNC_BACKEND=local:<directory> selects the fake.
+
+SESSION_COLLECTION = "FlatDesign"
+OUTBOX_FILE = "sync_outbox.db"
+MAX_BATCH_WRITES = 500  # Firestore's limit per batched write
+LIVE_SYNC_INTERVAL = 60  # seconds between delta syncs of the running session
+BASE_BACKOFF = 2
+MAX_BACKOFF = 300
+
+_db = None
+
+
 def initialize_firebase():
     """
     Initializes the Firebase Admin SDK.
     Checks if it's already initialized to prevent errors.
     """
+    import firebase_admin
+    from firebase_admin import credentials, firestore
     if not firebase_admin._apps:
         cred = credentials.Certificate("firebase_key.json")
         firebase_admin.initialize_app(cred)
     return firestore.client()
 
-db = initialize_firebase()
 
 def get_db():
     """
-    Returns the Firestore client instance.
+    Returns the Firestore client instance, initializing it on first use.
+    """
+    global _db
+    if _db is None:
+        _db = initialize_firebase()
+    return _db
+
+
+def deep_merge(target, update):
+    """
+    Merges update into target the way a Firestore merge write does (maps merge, values replace).
+    """
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            deep_merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+class FirestoreBackend:
+    def get(self, collection, doc_id):
+        doc = get_db().collection(collection).document(doc_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def commit(self, writes):
+        """
+        Applies [(collection, doc_id, data), ...] as merge writes in batches.
+        """
+        db = get_db()
+        for i in range(0, len(writes), MAX_BATCH_WRITES):
+            batch = db.batch()
+            for collection, doc_id, data in writes[i:i + MAX_BATCH_WRITES]:
+                batch.set(db.collection(collection).document(doc_id), data, merge=True)
+            batch.commit()
+
+
+class LocalBackend:
+    """
+    Stand-in for Firestore that keeps documents as JSON files under directory.
+    Set offline = True to simulate a missing uplink.
+    """
+
+    def __init__(self, directory="firebase_local"):
+        self.directory = directory
+        self.offline = False
+        self.commits = 0
+
+    def _path(self, collection, doc_id):
+        return os.path.join(self.directory, collection, f"{doc_id}.json")
+
+    def get(self, collection, doc_id):
+        if self.offline:
+            raise ConnectionError("offline")
+        try:
+            with open(self._path(collection, doc_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def commit(self, writes):
+        if self.offline:
+            raise ConnectionError("offline")
+        for collection, doc_id, data in writes:
+            path = self._path(collection, doc_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            doc = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    doc = json.load(f)
+            with open(path + ".tmp", "w") as f:
+                json.dump(deep_merge(doc, data), f, indent=2)
+            os.replace(path + ".tmp", path)
+        self.commits += 1
+
+
+def make_backend(spec=None):
+    spec = spec or os.environ.get("IPBEEP_SYNC_BACKEND", "firestore")
+    if spec.startswith("local"):
+        _, _, directory = spec.partition(":")
+        return LocalBackend(directory or "firebase_local")
+    return FirestoreBackend()
+
+
+def _record_hash(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+
+class SyncWorker:
+    """
+    Persistent outbox plus the background thread that flushes it.
     """
-    return db
+
+    def __init__(self, backend=None, outbox_path=OUTBOX_FILE):
+        self.backend = backend or make_backend()
+        self._conn = sqlite3.connect(outbox_path, check_same_thread=False, isolation_level=None)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS outbox (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                collection TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            -- What has already been queued per student, so unchanged records are never resent
+            CREATE TABLE IF NOT EXISTS synced (
+                doc_id TEXT NOT NULL,
+                student_id TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (doc_id, student_id)
+            );
+        """)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.live_session = None  # (course_id, session_id) synced every LIVE_SYNC_INTERVAL
+        self.failures = 0
+        self.last_error = None
+        self.last_flush = None
+        self.sent_writes = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def enqueue_session(self, course_id, session_id, students):
+        """
+        Queues the student records of a session that changed since they were last queued.
+        Returns the number of changed records.
+        """
+        doc_id = f"{course_id}_{session_id}"
+        with self._lock:
+            synced = dict(self._conn.execute("SELECT student_id, hash FROM synced WHERE doc_id = ?", (doc_id,)))
+            changed = {}
+            hashes = []
+            for student in students:
+                student_id = student.get("student_id", "unknown")
+                record_hash = _record_hash(student)
+                if synced.get(student_id) != record_hash:
+                    changed[student_id] = student
+                    hashes.append((doc_id, student_id, record_hash))
+            if not changed:
+                return 0
+            data = {
+                "course_id": course_id,
+                "session_id": session_id,
+                "timestamp": datetime.now().isoformat(),
+                "students": changed,
+            }
+            # The change and its "already queued" marker commit together
+            self._conn.execute("BEGIN")
+            self._conn.execute("INSERT INTO outbox (collection, doc_id, data) VALUES (?, ?, ?)",
+                               (SESSION_COLLECTION, doc_id, json.dumps(data)))
+            self._conn.executemany("INSERT OR REPLACE INTO synced (doc_id, student_id, hash) VALUES (?, ?, ?)", hashes)
+            self._conn.execute("COMMIT")
+        self._wake.set()
+        return len(changed)
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def flush(self):
+        """
+        Sends everything in the outbox. Entries for the same document are coalesced into
+        one merge write. Raises when the backend fails; nothing is removed in that case.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT seq, collection, doc_id, data FROM outbox ORDER BY seq").fetchall()
+        if not rows:
+            return 0
+        merged = {}
+        for _, collection, doc_id, data in rows:
+            deep_merge(merged.setdefault((collection, doc_id), {}), json.loads(data))
+        writes = [(collection, doc_id, data) for (collection, doc_id), data in merged.items()]
+        self.backend.commit(writes)
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE seq <= ?", (rows[-1][0],))
+        self.sent_writes += len(writes)
+        self.last_flush = datetime.now().isoformat()
+        return len(writes)
+
+    def _sync_live_session(self):
+        from attendance_journal import load_session_students
+        course_id, session_id = self.live_session
+        try:
+            self.enqueue_session(course_id, session_id, load_session_students(course_id, session_id))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # A bad journal or outbox write must not end the sync thread; the next interval retries
+            print(f"[SYNC] Could not queue the live session {course_id}/{session_id}: {e}")
+
+    def _loop(self):
+        next_live_sync = time.monotonic() + LIVE_SYNC_INTERVAL
+        retry_at = 0.0
+        while not self._stop.is_set():
+            wait_until = min(next_live_sync, retry_at) if self.failures else next_live_sync
+            self._wake.wait(max(0.0, wait_until - time.monotonic()))
+            self._wake.clear()
+            if self.live_session is not None and time.monotonic() >= next_live_sync:
+                self._sync_live_session()
+                next_live_sync = time.monotonic() + LIVE_SYNC_INTERVAL
+            # New changes do not cut a backoff short; they wait in the outbox for the retry
+            if self.failures and time.monotonic() < retry_at:
+                continue
+            try:
+                sent = self.flush()
+                if sent:
+                    print(f"[SYNC] Sent {sent} document write(s) to {type(self.backend).__name__}")
+                self.failures = 0
+                self.last_error = None
+            except Exception as e:
+                # No uplink (or Firestore unavailable): keep the outbox and retry with backoff
+                self.failures += 1
+                self.last_error = str(e)
+                delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (self.failures - 1)) * random.uniform(0.8, 1.2)
+                retry_at = time.monotonic() + delay
+                print(f"[SYNC] Flush failed ({e}); {self.pending()} queued, retrying in {delay:.0f}s")
+
+    def flush_soon(self):
+        self._wake.set()
+
+    def status(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "pending": self.pending(),
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_flush": self.last_flush,
+            "sent_writes": self.sent_writes,
+            "live_session": "_".join(self.live_session) if self.live_session else None,
+        }
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+_sync_worker = None
+_sync_worker_lock = threading.Lock()
+
+
+def get_sync_worker():
+    """
+    The process-wide sync worker, started on first use.
+    """
+    global _sync_worker
+    with _sync_worker_lock:
+        if _sync_worker is None:
+            _sync_worker = SyncWorker().start()
+        return _sync_worker
+
 
 def fetch_and_save_session_config(config_file="session_config.json"):
     """
     Fetches the session configuration from Firestore and saves it to a local file.
     """
     try:
-        config_ref = db.collection("Session_config").document("details")
-        config_doc = config_ref.get()
-        
-        if config_doc.exists:
-            config_data = config_doc.to_dict()
+        config_data = get_sync_worker().backend.get("Session_config", "details")
+
+        if config_data is not None:
             with open(config_file, "w") as f:
                 json.dump(config_data, f)
             print("[INFO] Successfully fetched and saved config from Firestore")
@@ -39,14 +312,16 @@ def fetch_and_save_session_config(config_file="session_config.json"):
         else:
             print("[WARNING] No config found in Firestore")
             return False
-            
+
     except Exception as e:
         print(f"[ERROR] Failed to fetch config: {e}")
         return False
 
+
 def upload_session_log(course_id, session_id):
     """
-    Reads a session's log file, formats it, and uploads it to Firestore.
+    Reads a session's log file and queues its changed student records for Firestore.
+    Returns right away; the sync worker sends them as soon as there is an uplink.
     """
     try:
         session_file = f"{course_id}_{session_id}.json"
@@ -55,24 +330,13 @@ def upload_session_log(course_id, session_id):
         with open(session_path, "r") as f:
             session_data = json.load(f)
 
-        student_map = {}
-        if isinstance(session_data, list):
-            for student in session_data:
-                student_id = student.get("student_id", "unknown")
-                student_map[student_id] = student
-        else:
-            student_map = session_data
-
-        doc_id = f"{course_id}_{session_id}"
-        db.collection("FlatDesign").document(doc_id).set({
-            "course_id": course_id,
-            "session_id": session_id,
-            "timestamp": datetime.now().isoformat(),
-            "students": student_map
-        })
-        print(f"✅ Uploaded session to FlatDesign/{doc_id} in Firestore.")
+        students = session_data if isinstance(session_data, list) else list(session_data.values())
+        worker = get_sync_worker()
+        changed = worker.enqueue_session(course_id, session_id, students)
+        worker.flush_soon()
+        print(f"✅ Queued {changed} changed student record(s) for {SESSION_COLLECTION}/{course_id}_{session_id}.")
         return True
 
     except Exception as e:
-        print(f"❌ Error uploading to Firebase: {e}")
-        return False 
\ No newline at end of file
+        print(f"❌ Error queuing session log for Firebase: {e}")
+        return False
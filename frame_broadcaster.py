@@ -0,0 +1,92 @@
+import threading
+import time
+import cv2
+from metrics import STAGE_SECONDS
+
+JPEG_QUALITY = 70
+
+
+class FrameBroadcaster:
+    """
+    Fan-out of the annotated frames to every /video_feed client.
+
+    The recognition thread only swaps in the new frame and bumps a sequence number.
+    The first subscriber that wants a frame JPEG-encodes it, once, and every other
+    subscriber reuses those bytes. Subscribers block on a condition variable until a
+    frame newer than the last one they sent is available.
+    """
+
+    def __init__(self, quality=JPEG_QUALITY):
+        self.quality = quality
+        self._cond = threading.Condition()
+        self._encode_lock = threading.Lock()
+        self._frame = None
+        self._seq = 0
+        self._jpeg = None
+        self._jpeg_seq = 0
+        self._closed = False
+        self.subscribers = 0
+        self.encoded_frames = 0
+
+    def publish(self, frame):
+        """
+        Hands over a new annotated frame. Never encodes, so it costs the caller almost nothing.
+        """
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _jpeg_for(self, seq, frame):
+        with self._encode_lock:
+            if self._jpeg_seq < seq:
+                start = time.perf_counter()
+                ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                STAGE_SECONDS.observe(time.perf_counter() - start, "jpeg")
+                if not ok:
+                    return None
+                self._jpeg = buffer.tobytes()
+                self._jpeg_seq = seq
+                self.encoded_frames += 1
+            return self._jpeg
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """
+        Waits for a frame newer than last_seq and returns (seq, jpeg_bytes).
+        Returns (last_seq, None) on timeout or once the broadcaster is closed.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > last_seq or self._closed, timeout):
+                return last_seq, None
+            if self._closed:
+                return last_seq, None
+            seq, frame = self._seq, self._frame
+        jpeg = self._jpeg_for(seq, frame)
+        return seq, jpeg
+
+    def stream(self, should_stop=lambda: False):
+        """
+        Generator of multipart MJPEG chunks for one client; only new frames are sent.
+        """
+        with self._cond:
+            self.subscribers += 1
+        try:
+            seq = 0
+            while not self._closed and not should_stop():
+                seq, jpeg = self.wait_for_frame(seq)
+                if jpeg is None:
+                    continue
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            with self._cond:
+                self.subscribers -= 1
@@ -0,0 +1,464 @@
+import glob
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+
+# Where the recognizer's frames come from. Every source has the same small interface:
+# read() returns the next BGR frame (None when none is ready), finished turns True once a
+# recording is exhausted, frame_shape() tells the pipeline how large its shared-memory
+# slots must be, and close() releases the device. Frames belong to the caller, who may
+# draw on them without copying.
+#
+# Dual-stream sources also deliver a low-resolution greyscale plane for detection:
+# read_pair() returns (frame, luma), where luma is the Y plane of the camera's YUV420
+# lores stream, scaled down from frame by lores_scale. The camera's ISP does the resize
+# and the colour conversion, so the recognizer's hot loop does neither. Single-stream
+# sources return (frame, None).
+#
+# Cameras (Picamera2 on the Pi, any V4L2 device through OpenCV elsewhere) deliver frames
+# in real time. Recordings (a directory of images or a video file) are decoded ahead of
+# the recognizer on a background thread. With speed=0 they run unthrottled, as fast as the
+# recognizer consumes them, and no frame is skipped; speed=1 replays at the recorded rate
+# and drops frames the way a camera does when the recognizer falls behind.
+#
+#   open_frame_source("picamera2")            the Pi camera (default)
+#   open_frame_source("v4l2:0")               /dev/video0 through OpenCV
+#   open_frame_source("images:captures/")     every jpg/png in the directory, sorted by name
+#   open_frame_source("video:lecture.mp4")    a recorded lecture
+#   open_frame_source("fake[:<photo dir>]")   synthetic dual-stream camera, photos pasted in
+
+DEFAULT_SIZE = (640, 480)
+# Detection stream, about the 1/3 of DEFAULT_SIZE the recognizer used to resize to; even
+# sizes with the main stream's aspect ratio
+DEFAULT_LORES_SIZE = (224, 168)
+FAKE_FPS = 30.0
+PREFETCH_FRAMES = 32
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+IMAGE_FPS = 10.0  # timeline of an image directory replayed with speed > 0
+FALLBACK_VIDEO_FPS = 25.0  # when the container does not say
+
+
+def luma_plane(yuv420, size):
+    """
+    Y plane of an I420 / YUV420 array as Picamera2 returns it (the first height rows,
+    rows possibly padded to the stride). No copy unless the rows are padded.
+    """
+    width, height = size
+    return np.ascontiguousarray(yuv420[:height, :width])
+
+
+def simulate_lores(frame, lores_size):
+    """
+    What the camera's lores stream would deliver for frame: downscaled, converted to I420,
+    Y plane only. For fakes and benchmarks; the real camera does this in the ISP.
+    """
+    small = cv2.resize(frame, lores_size, interpolation=cv2.INTER_AREA)
+    return luma_plane(cv2.cvtColor(small, cv2.COLOR_BGR2YUV_I420), lores_size)
+
+
+class FrameSource:
+    realtime = True
+    lores_scale = None  # main width / lores width on dual-stream sources
+
+    def __init__(self):
+        self.finished = False
+        self.frames_read = 0
+        self._peeked = None
+        self._opened_at = time.monotonic()
+
+    def _read(self):
+        raise NotImplementedError
+
+    def _read_pair(self):
+        return self._read(), None
+
+    def read_pair(self):
+        """
+        Returns (frame, luma); luma is None on single-stream sources and frame is None
+        when no frame is ready.
+        """
+        if self._peeked is not None:
+            pair, self._peeked = self._peeked, None
+        else:
+            pair = self._read_pair()
+        if pair[0] is not None:
+            self.frames_read += 1
+        return pair
+
+    def read(self):
+        return self.read_pair()[0]
+
+    def _peek(self, timeout):
+        # Reads one frame ahead; it is still returned by the next read()
+        deadline = time.monotonic() + timeout
+        while self._peeked is None:
+            pair = self._read_pair()
+            if pair[0] is not None:
+                self._peeked = pair
+            elif self.finished or time.monotonic() > deadline:
+                raise RuntimeError(f"{self.describe()} delivered no frame")
+            else:
+                time.sleep(0.01)
+        return self._peeked
+
+    def frame_shape(self, timeout=5.0):
+        """
+        Shape of the frames this source delivers.
+        """
+        return self._peek(timeout)[0].shape
+
+    def lores_shape(self, timeout=5.0):
+        """
+        Shape of the detection plane, None for single-stream sources.
+        """
+        luma = self._peek(timeout)[1]
+        return luma.shape if luma is not None else None
+
+    def describe(self):
+        return type(self).__name__
+
+    def stats(self):
+        elapsed = time.monotonic() - self._opened_at
+        return {
+            "source": self.describe(),
+            "realtime": self.realtime,
+            "frames": self.frames_read,
+            "fps": round(self.frames_read / elapsed, 1) if elapsed > 0 else None,
+            "finished": self.finished,
+        }
+
+    def close(self):
+        pass
+
+
+class Picamera2Source(FrameSource):
+    """
+    The Pi camera. With lores_size it runs two streams from one capture: main (BGR, for
+    display and encoding) and lores (YUV420, for detection).
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, lores_size=DEFAULT_LORES_SIZE):
+        super().__init__()
+        # Only importable on the Pi; the other sources work anywhere
+        from picamera2 import Picamera2
+        self.size = tuple(size)
+        self.lores_size = None
+        self.camera = Picamera2()
+        # Despite the name, RGB888 arrays are laid out B, G, R, which is what OpenCV expects
+        if lores_size:
+            config = self.camera.create_preview_configuration(
+                main={"size": self.size, "format": "RGB888"},
+                lores={"size": tuple(lores_size), "format": "YUV420"})
+            self.camera.align_configuration(config)
+            self.camera.configure(config)
+            self.size = tuple(config["main"]["size"])
+            self.lores_size = tuple(config["lores"]["size"])
+            self.lores_scale = self.size[0] / self.lores_size[0]
+        else:
+            self.camera.preview_configuration.main.size = self.size
+            self.camera.preview_configuration.main.format = "RGB888"
+            self.camera.configure("preview")
+        self.camera.start()
+        time.sleep(1)
+
+    def _read(self):
+        return self.camera.capture_array()
+
+    def _read_pair(self):
+        if self.lores_size is None:
+            return self._read(), None
+        # Both streams of the same capture; make_array copies out of the camera buffer
+        request = self.camera.capture_request()
+        try:
+            frame = request.make_array("main")
+            luma = luma_plane(request.make_array("lores"), self.lores_size)
+        finally:
+            request.release()
+        return frame, luma
+
+    def describe(self):
+        lores = f" + lores {self.lores_size[0]}x{self.lores_size[1]}" if self.lores_size else ""
+        return f"picamera2 {self.size[0]}x{self.size[1]}{lores}"
+
+    def close(self):
+        self.camera.stop()
+
+
+class OpenCVSource(FrameSource):
+    """
+    USB/V4L2 camera (or anything else cv2.VideoCapture opens live), e.g. on a laptop.
+    """
+
+    def __init__(self, device=0, size=DEFAULT_SIZE):
+        super().__init__()
+        self.device = device
+        self.capture = cv2.VideoCapture(device, cv2.CAP_V4L2)
+        if not self.capture.isOpened():
+            self.capture = cv2.VideoCapture(device)
+        if not self.capture.isOpened():
+            raise RuntimeError(f"Could not open camera {device}")
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+        # Keep only the newest frame in the driver so a slow recognizer never sees stale ones
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def _read(self):
+        ok, frame = self.capture.read()
+        return frame if ok else None
+
+    def describe(self):
+        return f"v4l2 {self.device}"
+
+    def close(self):
+        self.capture.release()
+
+
+class FakeCameraSource(FrameSource):
+    """
+    Synthetic stand-in for the dual-stream Pi camera, for tests and development off the
+    Pi: moving-gradient frames (with the photos of paste_dir pasted in) on the main stream
+    and, with lores_size, the Y plane of an I420 lores frame laid out like Picamera2's.
+    fps=0 runs unthrottled; frames limits the run (None runs until closed).
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, lores_size=DEFAULT_LORES_SIZE, fps=FAKE_FPS, paste_dir=None, frames=None):
+        super().__init__()
+        self.size = tuple(size)
+        self.lores_size = tuple(lores_size) if lores_size else None
+        self.lores_scale = self.size[0] / self.lores_size[0] if self.lores_size else None
+        self.fps = fps
+        self.realtime = fps > 0
+        self.frames = frames
+        self._index = 0
+        self._next_at = time.monotonic()
+        width, height = self.size
+        ys, xs = np.mgrid[0:height, 0:width]
+        self._xs = xs.astype(np.uint8)
+        self._ys = ys.astype(np.uint8)
+        self._paste = []
+        if paste_dir:
+            for path in sorted(glob.glob(os.path.join(paste_dir, "*")))[:3]:
+                img = cv2.imread(path)
+                if img is not None:
+                    scale = (height // 3) / max(img.shape[:2])
+                    self._paste.append(cv2.resize(img, (0, 0), fx=scale, fy=scale))
+
+    def _render(self, i):
+        width, height = self.size
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[..., 0] = self._xs + np.uint8(3 * i % 256)
+        frame[..., 1] = self._ys + np.uint8(2 * i % 256)
+        frame[..., 2] = 128
+        for j, img in enumerate(self._paste):
+            h, w = img.shape[:2]
+            top = (40 + 60 * j + 2 * i) % max(1, height - h)
+            left = (30 + 180 * j + 3 * i) % max(1, width - w)
+            frame[top:top + h, left:left + w] = img
+        return frame
+
+    def _read_pair(self):
+        if self.finished or (self.frames is not None and self._index >= self.frames):
+            self.finished = True
+            return None, None
+        if self.fps:
+            self._next_at += 1 / self.fps
+            time.sleep(max(0.0, self._next_at - time.monotonic()))
+        frame = self._render(self._index)
+        self._index += 1
+        return frame, simulate_lores(frame, self.lores_size) if self.lores_size else None
+
+    def _read(self):
+        return self._read_pair()[0]
+
+    def describe(self):
+        lores = f" + lores {self.lores_size[0]}x{self.lores_size[1]}" if self.lores_size else ""
+        return f"fake camera {self.size[0]}x{self.size[1]}{lores}"
+
+    def close(self):
+        self.finished = True
+
+
+class ReadAheadSource(FrameSource):
+    """
+    Base of the recording sources: a thread decodes frames into a bounded queue ahead of
+    the recognizer. speed=0 blocks the decoder while the queue is full, so every frame is
+    delivered; speed > 0 paces frames by their timestamps and drops the oldest queued frame
+    when the recognizer falls behind. loop=True restarts the recording at its end.
+    """
+
+    def __init__(self, speed=0, loop=False, prefetch=PREFETCH_FRAMES):
+        super().__init__()
+        self.speed = speed
+        self.realtime = speed > 0
+        self.loop = loop
+        self.decoded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=prefetch)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._decode_loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _frames(self):
+        """
+        Yields (seconds into the recording, frame) for one pass over the recording.
+        """
+        raise NotImplementedError
+
+    def _decode_loop(self):
+        try:
+            while not self._closed.is_set():
+                start = time.monotonic()
+                count = 0
+                for offset, frame in self._frames():
+                    if self._closed.is_set():
+                        return
+                    if self.speed:
+                        time.sleep(max(0.0, offset / self.speed - (time.monotonic() - start)))
+                    self._put(frame)
+                    count += 1
+                if not self.loop or count == 0:
+                    break
+        except Exception as e:
+            print(f"[ERROR] {self.describe()} stopped decoding: {e}")
+        finally:
+            self._put(None)  # end of the recording
+
+    def _put(self, frame):
+        if frame is not None:
+            self.decoded += 1
+        if self.realtime:
+            while True:
+                try:
+                    self._queue.put_nowait(frame)
+                    return
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        while not self._closed.is_set():
+            try:
+                self._queue.put(frame, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _read(self):
+        if self.finished:
+            return None
+        try:
+            frame = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return None
+        if frame is None:
+            self.finished = True
+        return frame
+
+    def stats(self):
+        report = super().stats()
+        report.update({"decoded": self.decoded, "dropped": self.dropped,
+                       "buffered": self._queue.qsize(), "speed": self.speed})
+        return report
+
+    def close(self):
+        self._closed.set()
+        # Unblock a decoder waiting for room in the queue
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        if self._thread.is_alive():
+            self._thread.join(timeout=2)
+
+
+class ImageDirectorySource(ReadAheadSource):
+    def __init__(self, directory, fps=IMAGE_FPS, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.fps = fps
+        self.paths = sorted(path for path in glob.glob(os.path.join(directory, "*"))
+                            if path.lower().endswith(IMAGE_EXTENSIONS))
+        if not self.paths:
+            raise RuntimeError(f"No images in {directory}")
+        self._size = None
+
+    def _frames(self):
+        for i, path in enumerate(self.paths):
+            frame = cv2.imread(path)
+            if frame is None:
+                print(f"[WARNING] Could not decode {path}, skipped")
+                continue
+            # The pipeline's frame slots have one fixed shape: the first image's
+            if self._size is None:
+                self._size = (frame.shape[1], frame.shape[0])
+            elif (frame.shape[1], frame.shape[0]) != self._size:
+                frame = cv2.resize(frame, self._size)
+            yield i / self.fps, frame
+
+    def describe(self):
+        return f"images {self.directory} ({len(self.paths)} files)"
+
+
+class VideoFileSource(ReadAheadSource):
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise RuntimeError(f"Could not open video {path}")
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or FALLBACK_VIDEO_FPS
+        self.frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+
+    def _frames(self):
+        capture = cv2.VideoCapture(self.path)
+        index = 0
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield index / self.fps, frame
+                index += 1
+        finally:
+            capture.release()
+
+    def describe(self):
+        return f"video {self.path} ({self.frame_count} frames at {self.fps:.0f} fps)"
+
+
+def open_frame_source(spec=None, size=DEFAULT_SIZE, speed=0, loop=False, lores_size=DEFAULT_LORES_SIZE):
+    """
+    Opens a source from a spec: "picamera2" (default), "v4l2[:device]", "images:<directory>",
+    "video:<file>" or "fake[:<photo directory>]"; a bare directory or file path is replayed
+    too. speed and loop only apply to recordings, lores_size (None for a single stream)
+    to the cameras that have a lores stream.
+    """
+    spec = spec or "picamera2"
+    kind, _, arg = spec.partition(":")
+    if kind == "picamera2":
+        return Picamera2Source(size, lores_size)
+    if kind == "fake":
+        return FakeCameraSource(size, lores_size, paste_dir=arg or None)
+    if kind == "v4l2":
+        device = int(arg) if arg.isdigit() else (arg or 0)
+        return OpenCVSource(device, size)
+    if kind == "images":
+        return ImageDirectorySource(arg, speed=speed, loop=loop).start()
+    if kind == "video":
+        return VideoFileSource(arg, speed=speed, loop=loop).start()
+    if os.path.isdir(spec):
+        return ImageDirectorySource(spec, speed=speed, loop=loop).start()
+    if os.path.isfile(spec):
+        return VideoFileSource(spec, speed=speed, loop=loop).start()
+    raise ValueError(f"Unknown frame source '{spec}'")
@@ -1,21 +1,29 @@
 import json
 import os
 import time
-import subprocess
 import signal
 import sys
+import threading
 from datetime import datetime
+from attendance_journal import AttendanceJournal
+from station_monitor import StationMonitor, open_source, wall_clock
+from control_channel import ControlServer, control_path
+from metrics import start_http_server, gauge
 
 # Constants
 REGISTRATION_FILE = "registration.json"
 SESSION_CONFIG_FILE = "session_config.json"
-LOGS_FOLDER = "logs"
+REFRESH_INTERVAL = 30  # seconds between journal updates of the running totals
+METRICS_PORT = 9101  # /metrics of the tracking process ("metrics_port" in session_config.json)
 
 # Global variables forr the wholee file
 students = {}
 course_id = ""
 session_id = ""
-log_path = ""
+journal = None
+monitor = None
+control_server = None
+students_lock = threading.RLock()  # re-entered by the signal handler
 
 # Handle session stop nottteee: it was ctrl c now its ui 
 def handle_exit(signum, frame):
@@ -23,13 +31,19 @@ def handle_exit(signum, frame):
     save_and_exit()
 
 def save_and_exit():
-    global students, log_path
+    global students, journal
     # Save final tracking info
-    for student in students.values():
-        student["total_minutes"] = round(student["total_minutes"])
-    with open(log_path, "w") as f:
-        json.dump(list(students.values()), f, indent=2)
-    print(f"[INFO] Session tracking saved to {log_path}")
+    if journal is not None:
+        with students_lock:
+            for mac, student in students.items():
+                if monitor is not None:
+                    student["total_minutes"] = monitor.present_seconds(mac) / 60
+                student["total_minutes"] = round(student["total_minutes"])
+                journal.update(student["student_id"], total_minutes=student["total_minutes"])
+        journal.close()
+        print(f"[INFO] Session tracking saved to {journal.path}")
+    if control_server is not None:
+        control_server.close()
     sys.exit(0)
 
 #  Attach signal handlers
@@ -70,48 +84,75 @@ with open(REGISTRATION_FILE) as f:
             "attended": False
         }
 
-#  Prepare log path
-log_dir = os.path.join(LOGS_FOLDER, course_id)
-os.makedirs(log_dir, exist_ok=True)
-log_path = os.path.join(log_dir, f"{course_id}_{session_id}.json")
+#  Prepare log path; changes go to the append-only journal, the JSON is materialized at end_class
+journal = AttendanceJournal(course_id, session_id)
+journal.reset(students.values())
 
 print(f"[INFO] Session tracking started for {course_id} - Session {session_id}")
 print("[INFO] Waiting for student MACs...")
 
-# Loop every 30 seconds
+# Joins and leaves come from the station monitor as they happen; minutes are the exact
+# sum of each student's connected intervals
+def handle_station_change(kind, mac, t):
+    with students_lock:
+        student = students.get(mac)
+        if student is None:
+            return
+        seen = wall_clock(t, monitor.clock)
+        if student["start"] is None:
+            student["start"] = seen
+        student["last_seen"] = seen
+        student["total_minutes"] = round(monitor.present_seconds(mac, now=t) / 60, 2)
+        journal.update(student["student_id"], start=student["start"], last_seen=seen,
+                       total_minutes=student["total_minutes"])
+    print(f"[INFO] {student['student_id']} {kind} at {seen}")
+
+monitor = StationMonitor(open_source(session_config.get("station_source")), on_change=handle_station_change)
+monitor.start()
+
+# Control socket for class_control's supervisor. stop is acknowledged right away; the
+# SIGTERM it raises makes the main thread save the session and exit.
+def request_stop():
+    # Delayed a moment so the acknowledgement is written before the process starts exiting
+    threading.Timer(0.1, os.kill, (os.getpid(), signal.SIGTERM)).start()
+    return {"state": "stopping"}
+
+def health():
+    with students_lock:
+        present = sum(1 for mac in monitor.connected_macs() if mac in students)
+    return {"students": len(students), "present": present, "monitor": monitor.stats()}
+
+control_server = ControlServer(control_path("tracking"), {"stop": request_stop, "health": health}).start()
+
+# No web server here, so /metrics gets a small one of its own; the journal's commit
+# latency is recorded by AttendanceJournal itself
+gauge("ipbeep_connected_stations", "Wi-Fi stations associated with the access point",
+      fn=lambda: len(monitor.connected_macs()))
+gauge("ipbeep_present_students", "Registered students currently connected", fn=lambda: health()["present"])
+gauge("ipbeep_tracked_students", "Students on the session roster", fn=lambda: len(students))
 try:
-    while True:
-        iw_output = subprocess.check_output(["iw", "dev", "wlan0", "station", "dump"]).decode()
-        connected_macs = set()
-
-        for line in iw_output.splitlines():
-            if line.strip().startswith("Station"):
-                mac = line.strip().split()[1].upper()
-                connected_macs.add(mac)
+    start_http_server(session_config.get("metrics_port", METRICS_PORT))
+except OSError as e:
+    print(f"[WARNING] Metrics endpoint not available: {e}")
 
+# Refresh the running totals of connected students; no subprocess, just the monitor's intervals
+try:
+    while True:
+        time.sleep(REFRESH_INTERVAL)
         now = datetime.now().strftime("%H:%M:%S")
-        changes_made = False
-
-        for mac, student in students.items():
-            if mac in connected_macs:
-                if student["start"] is None:
-                    student["start"] = now
-                    changes_made = True
+        connected_macs = monitor.connected_macs()
+
+        # One journal line per connected student instead of rewriting the whole log
+        with students_lock:
+            for mac in connected_macs:
+                student = students.get(mac)
+                if student is None:
+                    continue
                 student["last_seen"] = now
-                student["total_minutes"] += 0.5  # Each 30s = 0.5 min
-                changes_made = True
-
-        # Save logs if any changes were made
-        if changes_made:
-            try:
-                with open(log_path, "w") as f:
-                    json.dump(list(students.values()), f, indent=2)
-                print("[INFO] Logs saved after update")
-            except Exception as e:
-                print(f"[ERROR] Failed to save logs: {e}")
+                student["total_minutes"] = round(monitor.present_seconds(mac) / 60, 2)
+                journal.update(student["student_id"], last_seen=now, total_minutes=student["total_minutes"])
 
         print(f"[INFO] Cycle completed at {now}. Connected: {len(connected_macs)} students")
-        time.sleep(30)
 
 except Exception as e:
     print(f"[ERROR] Unexpected error: {e}")
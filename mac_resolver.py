@@ -0,0 +1,169 @@
+import os
+import re
+import socket
+import threading
+import time
+
+# IP -> MAC lookup for the registration portal without forking ping/arp per request.
+#
+# Every phone on the hotspot got its address from dnsmasq, so the lease file already
+# has the answer; the kernel neighbour table (/proc/net/arp) covers static clients.
+# Both are plain file reads, parsed only when they changed. Only when neither knows the
+# IP does the resolver probe: it sends one UDP datagram so the kernel resolves the
+# neighbour itself, then re-reads /proc/net/arp.
+
+ARP_TABLE = "/proc/net/arp"
+DNSMASQ_CONF_FILES = ["Config/dnsmasq.conf", "/etc/dnsmasq.conf"]
+DEFAULT_LEASE_FILE = "/var/lib/misc/dnsmasq.leases"
+CACHE_TTL = 300  # seconds an IP -> MAC answer is trusted without re-checking the tables
+PROBE_TIMEOUT = 0.5
+PROBE_PORT = 9  # discard; the datagram only has to trigger neighbour resolution
+
+MAC_RE = re.compile(r"^([0-9a-f]{2}:){5}[0-9a-f]{2}$")
+INCOMPLETE_MAC = "00:00:00:00:00:00"
+
+
+def find_lease_file(conf_files=DNSMASQ_CONF_FILES):
+    """
+    The dhcp-leasefile= from the dnsmasq config, or dnsmasq's default location.
+    """
+    for path in conf_files:
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, value = line.strip().partition("=")
+                    if key == "dhcp-leasefile" and value:
+                        return value
+        except OSError:
+            continue
+    return DEFAULT_LEASE_FILE
+
+
+def parse_leases(text):
+    # "<expiry> <mac> <ip> <hostname> <client-id>" per line
+    table = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 3 and MAC_RE.match(parts[1].lower()):
+            table[parts[2]] = parts[1].lower()
+    return table
+
+
+def parse_arp(text):
+    # "IP address  HW type  Flags  HW address  Mask  Device", flags 0x0 = incomplete
+    table = {}
+    for line in text.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) >= 4 and parts[2] != "0x0" and parts[3] != INCOMPLETE_MAC:
+            table[parts[0]] = parts[3].lower()
+    return table
+
+
+class _WatchedTable:
+    """
+    A parsed file that is only re-read when its mtime/size changes.
+    """
+
+    def __init__(self, path, parse, always_reload=False):
+        self.path = path
+        self.parse = parse
+        # /proc files report no useful mtime, so they are re-read whenever asked
+        self.always_reload = always_reload
+        self._signature = None
+        self.table = {}
+        self.reloads = 0
+
+    def refresh(self):
+        """
+        Returns True when the table was reloaded.
+        """
+        try:
+            if not self.always_reload:
+                stat = os.stat(self.path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+                if signature == self._signature:
+                    return False
+                self._signature = signature
+            with open(self.path) as f:
+                self.table = self.parse(f.read())
+        except OSError:
+            self.table = {}
+        self.reloads += 1
+        return True
+
+
+class MacResolver:
+    """
+    Thread-safe resolver shared by all portal requests; stats counts where answers came from.
+    """
+
+    def __init__(self, lease_file=None, arp_table=ARP_TABLE, ttl=CACHE_TTL, probe=True):
+        self.leases = _WatchedTable(lease_file or find_lease_file(), parse_leases)
+        self.arp = _WatchedTable(arp_table, parse_arp, always_reload=arp_table.startswith("/proc/"))
+        self.ttl = ttl
+        self.probe_enabled = probe
+        self._cache = {}  # ip -> (mac, resolved_at)
+        self._lock = threading.Lock()
+        self.stats = {"cache": 0, "lease": 0, "arp": 0, "probe": 0, "miss": 0}
+
+    def _lookup_tables(self, ip):
+        # A lease change means addresses may have moved to other devices: drop the cache
+        if self.leases.refresh():
+            self._cache.clear()
+        mac = self.leases.table.get(ip)
+        if mac:
+            return mac, "lease"
+        self.arp.refresh()
+        mac = self.arp.table.get(ip)
+        if mac:
+            return mac, "arp"
+        return None, None
+
+    def _probe(self, ip):
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.sendto(b"", (ip, PROBE_PORT))
+        except OSError:
+            return None
+        deadline = time.monotonic() + PROBE_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.02)
+            with self._lock:
+                self.arp.refresh()
+                mac = self.arp.table.get(ip)
+            if mac:
+                return mac
+        return None
+
+    def resolve(self, ip):
+        """
+        MAC (lowercase) of ip, or None when it cannot be found.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(ip)
+            if cached and now - cached[1] < self.ttl:
+                self.stats["cache"] += 1
+                return cached[0]
+            mac, source = self._lookup_tables(ip)
+            if mac:
+                self._cache[ip] = (mac, now)
+                self.stats[source] += 1
+                return mac
+
+        # Probing waits on the network, so it runs outside the lock
+        mac = self._probe(ip) if self.probe_enabled else None
+        with self._lock:
+            if mac:
+                self._cache[ip] = (mac, time.monotonic())
+                self.stats["probe"] += 1
+            else:
+                self.stats["miss"] += 1
+        return mac
+
+    def invalidate(self, ip=None):
+        with self._lock:
+            if ip is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(ip, None)
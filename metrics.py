@@ -0,0 +1,241 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Shared instrumentation for the recognizer, class_control, the portal and full_log.
+#
+# Metrics are kept in-process and rendered in the Prometheus text format on /metrics.
+# Histograms have fixed buckets, so observe() is a bisect and two additions under a lock
+# (a couple of microseconds on the Pi). Gauges of state that already exists somewhere
+# (queue depth, stream clients, gallery size, ...) take a callback that is only run when
+# /metrics is scraped, so they add nothing to the hot path.
+#
+#   STAGE_SECONDS.observe(seconds, "detect")
+#   with STAGE_SECONDS.time("match"): ...
+#   gauge("ipbeep_gallery_faces", "Faces in the loaded gallery", fn=lambda: len(matcher))
+#
+# Flask services call install_flask(app) for per-route latency and the /metrics route;
+# full_log.py has no web server and uses start_http_server(port).
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds; from sub-millisecond matching up to multi-second detections on a busy Pi
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labelvalues):
+        return _Timer(self, labelvalues)
+
+    def render(self):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        lines = []
+        for labelvalues, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = _format_labels(self.labelnames, labelvalues, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+
+
+class Gauge:
+    """
+    A value that is set, or computed by fn at scrape time. fn may return a number or, for
+    labelled gauges, a {label values tuple: number} dict; None values are left out.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values = {}
+
+    def set(self, value, *labelvalues):
+        self._values[labelvalues] = value
+
+    def inc(self, amount=1, *labelvalues):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def _current(self):
+        if self.fn is None:
+            return dict(self._values)
+        try:
+            value = self.fn()
+        except Exception:
+            return {}  # the object behind the gauge is gone (or not set up yet)
+        return value if isinstance(value, dict) else {(): value}
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+                for labelvalues, value in sorted(self._current().items()) if value is not None]
+
+
+class Counter(Gauge):
+    kind = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # Registering a name twice returns the existing metric, so modules can declare
+        # the metrics they share (e.g. the journal's log-save histogram) independently
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def gauge(name, help, labelnames=(), fn=None):
+    metric = REGISTRY.register(Gauge(name, help, labelnames, fn))
+    if fn is not None:
+        metric.fn = fn  # re-declared by a later setup, e.g. after main() loaded the gallery
+    return metric
+
+
+def counter(name, help, labelnames=(), fn=None):
+    metric = REGISTRY.register(Counter(name, help, labelnames, fn))
+    if fn is not None:
+        metric.fn = fn
+    return metric
+
+
+def render_metrics():
+    return REGISTRY.render()
+
+
+# Hot-path stages of the recognizer, as one labelled histogram:
+# capture, detect, encode, match, draw, jpeg
+STAGE_SECONDS = histogram("ipbeep_stage_seconds", "Time spent per recognition stage", ["stage"])
+LOG_SAVE_SECONDS = histogram("ipbeep_log_save_seconds", "Time to write and fsync one attendance journal commit")
+HTTP_SECONDS = histogram("ipbeep_http_request_seconds", "HTTP handler latency", ["endpoint", "method", "status"])
+
+_started = time.time()
+gauge("ipbeep_process_start_time_seconds", "Start time of the process since the epoch", fn=lambda: _started)
+
+
+def install_flask(app):
+    """
+    Times every request of a Flask app and adds the /metrics route. Endpoints are
+    labelled by their URL rule, so the number of series stays bounded.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            HTTP_SECONDS.observe(time.perf_counter() - start, endpoint, request.method, str(response.status_code))
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render_metrics(), mimetype=CONTENT_TYPE)
+
+    return app
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        start = time.perf_counter()
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        HTTP_SECONDS.observe(time.perf_counter() - start, "/metrics", "GET", "200")
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the log
+
+
+def start_http_server(port, host="0.0.0.0"):
+    """
+    Serves /metrics from a daemon thread, for processes without a web server of their own.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[INFO] Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,87 @@
+import time
+import cv2
+import numpy as np
+
+# Cheap change detector run on a tiny greyscale thumbnail before face detection.
+# A running-average background model is kept per pixel and compared cell by cell,
+# so HOG only runs when (and where) something in the room actually changed.
+
+THUMB_SIZE = (160, 120)  # (width, height), divisible by the grid
+GRID = (8, 6)  # (columns, rows), 20x20 px cells on the thumbnail
+PIXEL_THRESHOLD = 25  # grey levels a pixel must move to count as changed
+CELL_CHANGE_FRACTION = 0.02  # share of changed pixels that marks a cell as changed
+BACKGROUND_ALPHA = 0.05
+FULL_REFRESH_SECONDS = 10  # periodic full-frame detection even if nothing moved
+FULL_FRAME_AREA = 0.6  # regions larger than this share of the frame just use the full frame
+
+
+class MotionGate:
+    """
+    Decides per frame whether face detection should run, and on which region.
+    """
+
+    def __init__(self, refresh_seconds=FULL_REFRESH_SECONDS, pixel_threshold=PIXEL_THRESHOLD,
+                 cell_fraction=CELL_CHANGE_FRACTION, alpha=BACKGROUND_ALPHA):
+        self.refresh_seconds = refresh_seconds
+        self.pixel_threshold = pixel_threshold
+        self.cell_fraction = cell_fraction
+        self.alpha = alpha
+        self._background = None
+        self._last_full = 0.0
+        self.processed = 0
+        self.skipped = 0
+        self.full_refreshes = 0
+        self.region_detections = 0
+
+    def _thumbnail(self, frame):
+        small = cv2.resize(frame, THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0).astype(np.float32)
+
+    def check(self, frame, now=None):
+        """
+        Returns (run_detection, region). region is None for a full-frame detection, otherwise
+        the (top, right, bottom, left) rectangle of the frame that changed.
+        """
+        now = time.time() if now is None else now
+        gray = self._thumbnail(frame)
+
+        if self._background is None or now - self._last_full >= self.refresh_seconds:
+            self._background = gray
+            self._last_full = now
+            self.processed += 1
+            self.full_refreshes += 1
+            return True, None
+
+        changed_px = cv2.absdiff(gray, self._background) > self.pixel_threshold
+        cv2.accumulateWeighted(gray, self._background, self.alpha)
+
+        cols, rows = GRID
+        cell_h, cell_w = THUMB_SIZE[1] // rows, THUMB_SIZE[0] // cols
+        cell_change = changed_px.reshape(rows, cell_h, cols, cell_w).mean(axis=(1, 3))
+        changed = cell_change > self.cell_fraction
+        if not changed.any():
+            self.skipped += 1
+            return False, None
+
+        self.processed += 1
+        row_idx, col_idx = np.nonzero(changed)
+        # Pad by one cell so a face half outside the changed cells is still found
+        r0, r1 = max(int(row_idx.min()) - 1, 0), min(int(row_idx.max()) + 2, rows)
+        c0, c1 = max(int(col_idx.min()) - 1, 0), min(int(col_idx.max()) + 2, cols)
+        if (r1 - r0) * (c1 - c0) >= FULL_FRAME_AREA * rows * cols:
+            return True, None
+
+        frame_h, frame_w = frame.shape[:2]
+        self.region_detections += 1
+        return True, (r0 * frame_h // rows, c1 * frame_w // cols, r1 * frame_h // rows, c0 * frame_w // cols)
+
+    def stats(self):
+        total = self.processed + self.skipped
+        return {
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "full_refreshes": self.full_refreshes,
+            "region_detections": self.region_detections,
+            "skip_ratio": round(self.skipped / total, 3) if total else None,
+        }
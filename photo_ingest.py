@@ -0,0 +1,142 @@
+import multiprocessing as mp
+import os
+import queue
+import signal
+import threading
+import time
+from PIL import Image, ImageOps
+
+# Registration photos, from upload to gallery.
+#
+# save_upload() decodes the uploaded stream once, straight from the request (no temp
+# file, no reopen): EXIF orientation and downscaling happen on the decoded image, and
+# only the cleaned, downscaled JPEG is written. The photo is then queued for a
+# separate encoder process that appends the student's encoding to the encoding store
+# and the encode_faces manifest, so the student is in the gallery seconds after
+# registering and the HTTP response never waits for face detection.
+
+STORED_MAX_SIDE = 1024  # above what encode_faces.py detects at (800), so the photo can be re-encoded
+JPEG_QUALITY = 90
+QUEUE_SIZE = 256
+DRAIN_TIMEOUT = 30  # seconds the portal waits for queued photos at shutdown
+
+
+def save_upload(stream, path, max_side=STORED_MAX_SIDE, quality=JPEG_QUALITY):
+    """
+    Decodes an uploaded photo once, fixes its EXIF orientation, shrinks it to max_side
+    and writes it as a JPEG (atomically). Returns the saved (width, height).
+    """
+    img = Image.open(stream)
+    # For JPEGs the decoder itself skips to the nearest scale >= the target size
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_side, max_side))
+    tmp_path = path + ".tmp"
+    img.save(tmp_path, format="JPEG", quality=quality)
+    os.replace(tmp_path, path)
+    return img.size
+
+
+def _encoder_process(task_queue, result_queue):
+    # The portal drains the queue on Ctrl+C / SIGINT; the encoder stops on the sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # face_recognition (dlib) is only imported here, in the encoder process
+    from encode_faces import encode_photo, manifest_entry, update_manifest
+    from encoding_store import open_store
+
+    store = open_store()
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        student_id, path = task
+        _, encoding, seconds = encode_photo(path)
+        if encoding is None:
+            result_queue.put((student_id, path, False, seconds))
+            continue
+        try:
+            store.upsert(student_id, encoding)
+            update_manifest({student_id: manifest_entry(path)})
+            result_queue.put((student_id, path, True, seconds))
+        except Exception as e:
+            print(f"[ERROR] Could not store the encoding of {student_id}: {e}")
+            result_queue.put((student_id, path, False, seconds))
+
+
+class EncodingQueue:
+    """
+    Background encoder fed by the portal. submit() never blocks the request: when the
+    queue is full the photo is left for the next encode_faces.py run.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE):
+        ctx = mp.get_context("fork")
+        self._tasks = ctx.Queue(queue_size)
+        self._results = ctx.Queue()
+        self._process = ctx.Process(target=_encoder_process, args=(self._tasks, self._results), daemon=True)
+        self.submitted = 0
+        self.encoded = 0
+        self.no_face = 0
+        self.skipped = 0
+        self.last_seconds = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._process.start()
+        threading.Thread(target=self._collect, daemon=True).start()
+        return self
+
+    def submit(self, student_id, path):
+        try:
+            self._tasks.put_nowait((student_id, path))
+        except queue.Full:
+            with self._lock:
+                self.skipped += 1
+            print(f"[WARNING] Encoding queue full; {student_id} will be encoded by encode_faces.py")
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _collect(self):
+        while True:
+            try:
+                student_id, path, ok, seconds = self._results.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                self.last_seconds = seconds
+                if ok:
+                    self.encoded += 1
+                else:
+                    self.no_face += 1
+            if ok:
+                print(f"[ENCODED] {student_id} added to the gallery ({seconds:.2f}s)")
+            else:
+                print(f"[WARNING] No face found in {os.path.basename(path)}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "encoded": self.encoded,
+                "no_face": self.no_face,
+                "skipped": self.skipped,
+                "pending": self.submitted - self.encoded - self.no_face,
+                "last_encode_s": round(self.last_seconds, 2) if self.last_seconds is not None else None,
+                "alive": self._process.is_alive(),
+            }
+
+    def close(self, timeout=DRAIN_TIMEOUT):
+        """
+        Lets the encoder finish what is queued (up to timeout), then stops it.
+        """
+        try:
+            self._tasks.put(None, timeout=1)
+        except queue.Full:
+            pass
+        deadline = time.monotonic() + timeout
+        self._process.join(max(0.0, deadline - time.monotonic()))
+        if self._process.is_alive():
+            print("[WARNING] Encoder still busy at shutdown; remaining photos are left for encode_faces.py")
+            self._process.terminate()
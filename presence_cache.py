@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+
+# One shared answer for /connected.json. Every open dashboard polls it every couple of
+# seconds; instead of each request re-reading session_config.json, replaying the session
+# journal and asking for the station list, a single background sampler keeps the
+# MAC -> student mapping and the connected set in memory and pre-serializes the response.
+# N dashboards therefore cost the same as one.
+
+ROSTER_TTL = 30  # seconds before the MAC -> student mapping is reloaded from disk
+SNAPSHOT_TTL = 5  # recompute at least this often even without station events
+
+
+class PresenceCache:
+    """
+    Background sampler around a StationMonitor. load_roster() returns {mac: student_id}
+    for the running session (or raises when there is none); it is called at most every
+    roster_ttl seconds. snapshot_json() never blocks on disk or on the monitor.
+    """
+
+    def __init__(self, monitor, load_roster, roster_ttl=ROSTER_TTL, snapshot_ttl=SNAPSHOT_TTL):
+        self.monitor = monitor
+        self.load_roster = load_roster
+        self.roster_ttl = roster_ttl
+        self.snapshot_ttl = snapshot_ttl
+        self._roster = {}
+        self._roster_loaded = None
+        self._last_error = None
+        self._json = json.dumps({"connected": 0, "students": []})
+        self.connected = 0
+        self.refreshes = 0
+        self.requests = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.refresh()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        version = self.monitor.version
+        while not self._stop.is_set():
+            # Wakes up on the next join/leave, or after snapshot_ttl to pick up roster changes
+            version = self.monitor.wait_for_change(version, self.snapshot_ttl)
+            self.refresh()
+
+    def refresh(self):
+        now = time.monotonic()
+        # An empty roster (no session yet) is retried on every refresh rather than cached
+        if not self._roster or self._roster_loaded is None or now - self._roster_loaded >= self.roster_ttl:
+            try:
+                self._roster = self.load_roster()
+            except Exception as e:
+                if str(e) != self._last_error:  # retried every refresh, so only log changes
+                    print(f"[WARNING] Could not load the session roster for /connected.json: {e}")
+                self._last_error = str(e)
+                self._roster = {}
+            self._roster_loaded = now
+
+        connected_macs = self.monitor.connected_macs()
+        students = [student_id for mac, student_id in self._roster.items() if mac in connected_macs]
+        # A single reference swap, so readers always see a complete snapshot
+        self._json = json.dumps({"connected": len(students), "students": students})
+        self.connected = len(students)
+        self.refreshes += 1
+
+    def invalidate_roster(self):
+        """
+        Forces the roster to be reloaded on the next refresh (e.g. a new session started).
+        """
+        self._roster_loaded = None
+
+    def snapshot_json(self):
+        self.requests += 1
+        return self._json
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,145 @@
+import time
+import cv2
+import numpy as np
+import face_recognition
+from face_tracker import overlaps_any
+
+# Shared detection/encoding/drawing steps of the recognizer. Kept free of camera and
+# Flask state so the pipeline worker processes can import it on their own.
+
+KNOWN_COLOR = (0, 255, 0)
+UNKNOWN_COLOR = (0, 0, 255)
+CROP_MARGIN = 0.3  # padding around a face crop, as a share of the face height, so the landmarks fit
+
+
+def prepare_detection_frame(frame, downscale):
+    """
+    Downscales a captured BGR frame and converts it to the contiguous RGB image dlib expects.
+    """
+    small_frame = cv2.resize(frame, (0, 0), fx=1 / downscale, fy=1 / downscale)
+    return np.ascontiguousarray(small_frame[:, :, ::-1], dtype=np.uint8)
+
+
+def detect_and_encode(rgb_small_frame, upsample=1, downscale=1, settled_boxes=(), origin=(0, 0), timings=None):
+    """
+    Runs HOG detection on a prepared detection frame and encodes the faces that need it.
+    Faces overlapping one of settled_boxes (full-frame boxes of tracks that are already
+    identified) are not encoded and get None instead. origin is the (top, left) corner of
+    the detection frame inside the full frame when only a region was prepared. If a timings
+    dict is given, the "detect" and "encode" durations in seconds are stored in it.
+    Returns (face_locations, face_encodings) with locations scaled back to full-frame pixels.
+    """
+    start = time.monotonic()
+    small_locations = face_recognition.face_locations(rgb_small_frame, number_of_times_to_upsample=upsample)
+    detected = time.monotonic()
+    if timings is not None:
+        timings["detect"] = detected - start
+        timings["encode"] = 0.0
+    if not small_locations:
+        return [], []
+
+    face_locations = [offset_location(scale_location(loc, downscale), origin) for loc in small_locations]
+    to_encode = [i for i, loc in enumerate(face_locations) if not overlaps_any(loc, settled_boxes)]
+
+    face_encs = [None] * len(face_locations)
+    if to_encode:
+        encoded = face_recognition.face_encodings(rgb_small_frame, [small_locations[i] for i in to_encode])
+        for i, enc in zip(to_encode, encoded):
+            face_encs[i] = enc
+        if timings is not None:
+            timings["encode"] = time.monotonic() - detected
+    return face_locations, face_encs
+
+
+def detect_and_encode_lores(luma, frame, scale, upsample=1, settled_boxes=(), origin=(0, 0), timings=None):
+    """
+    Dual-stream variant of detect_and_encode: HOG runs directly on the greyscale lores
+    plane (or on a crop of it whose corner is origin, in lores pixels) and the faces that
+    need it are encoded from crops of the full-resolution BGR frame. scale is the frame
+    width over the lores width. Same return value and timings as detect_and_encode.
+    """
+    start = time.monotonic()
+    lores_locations = face_recognition.face_locations(luma, number_of_times_to_upsample=upsample)
+    detected = time.monotonic()
+    if timings is not None:
+        timings["detect"] = detected - start
+        timings["encode"] = 0.0
+    if not lores_locations:
+        return [], []
+
+    face_locations = [clip_location(scale_location(offset_location(loc, origin), scale), frame.shape)
+                      for loc in lores_locations]
+    to_encode = [i for i, loc in enumerate(face_locations) if not overlaps_any(loc, settled_boxes)]
+
+    face_encs = [None] * len(face_locations)
+    if to_encode:
+        for i, enc in zip(to_encode, encode_faces(frame, [face_locations[i] for i in to_encode])):
+            face_encs[i] = enc
+        if timings is not None:
+            timings["encode"] = time.monotonic() - detected
+    return face_locations, face_encs
+
+
+def encode_faces(frame, face_locations, margin=CROP_MARGIN):
+    """
+    Encodes faces of a BGR frame from a padded crop around each one. Only the crops are
+    converted to RGB, never the whole frame. Returns one encoding (or None) per location.
+    """
+    height, width = frame.shape[:2]
+    encodings = []
+    for top, right, bottom, left in face_locations:
+        pad = int((bottom - top) * margin)
+        crop_top, crop_left = max(top - pad, 0), max(left - pad, 0)
+        crop_bottom, crop_right = min(bottom + pad, height), min(right + pad, width)
+        rgb_crop = np.ascontiguousarray(frame[crop_top:crop_bottom, crop_left:crop_right, ::-1])
+        box = (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+        encoded = face_recognition.face_encodings(rgb_crop, [box])
+        encodings.append(encoded[0] if encoded else None)
+    return encodings
+
+
+def clip_location(location, shape):
+    top, right, bottom, left = location
+    height, width = shape[:2]
+    return max(top, 0), min(right, width), min(bottom, height), max(left, 0)
+
+
+def lores_region(region, scale):
+    """
+    A full-frame (top, right, bottom, left) region in lores pixels (None stays None).
+    """
+    return scale_location(region, 1 / scale) if region is not None else None
+
+
+def scale_location(location, factor):
+    top, right, bottom, left = location
+    return int(top * factor), int(right * factor), int(bottom * factor), int(left * factor)
+
+
+def offset_location(location, origin):
+    top, right, bottom, left = location
+    return top + origin[0], right + origin[1], bottom + origin[0], left + origin[1]
+
+
+def crop_region(frame, region):
+    """
+    Returns the part of the frame inside a (top, right, bottom, left) region and its origin.
+    """
+    if region is None:
+        return frame, (0, 0)
+    top, right, bottom, left = region
+    return frame[top:bottom, left:right], (top, left)
+
+
+def draw_face(frame, location, label, known):
+    """
+    Draws a face box and its label on a full-resolution frame.
+    """
+    top, right, bottom, left = location
+    color = KNOWN_COLOR if known else UNKNOWN_COLOR
+    cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+    cv2.putText(frame, label, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+
+
+def draw_fps(frame, fps):
+    cv2.putText(frame, f"FPS: {fps:.1f}", (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, KNOWN_COLOR, 2)
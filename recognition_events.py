@@ -0,0 +1,111 @@
+import json
+import threading
+from collections import deque
+
+DEFAULT_CAPACITY = 1000
+HEARTBEAT_SECONDS = 15
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event.get('action', 'message')}\ndata: {json.dumps(event)}\n\n"
+
+
+class EventRing:
+    """
+    In-memory ring buffer of recognition events with monotonically increasing ids.
+
+    Nothing is consumed on read: every client keeps its own cursor (the last id it saw)
+    and asks for what came after it, so any number of dashboards see every event.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self._events = deque(maxlen=capacity)
+        self._next_id = 1
+        self._cond = threading.Condition()
+        self._closed = False
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """
+        Calls callback() after every publish and on close, outside the lock. Used to wake
+        waiters that do not block on the condition (e.g. an asyncio event loop).
+        """
+        self._listeners.append(callback)
+
+    def _notify_listeners(self):
+        for callback in self._listeners:
+            callback()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def last_id(self):
+        with self._cond:
+            return self._next_id - 1
+
+    def publish(self, event):
+        with self._cond:
+            event = dict(event, id=self._next_id)
+            self._next_id += 1
+            self._events.append(event)
+            self._cond.notify_all()
+        self._notify_listeners()
+        return event["id"]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._notify_listeners()
+
+    def _normalize(self, cursor):
+        # A cursor from before a recognizer restart is ahead of the new ids; start over
+        return 0 if cursor >= self._next_id else cursor
+
+    def cursor(self, cursor):
+        """
+        The cursor a client should send next when it got no updates: its own, or 0 when
+        it is from before a recognizer restart (echoing it back would skip the new events).
+        """
+        with self._cond:
+            return max(self._normalize(cursor), 0)
+
+    def _since(self, cursor):
+        # Ids are contiguous, so the position of cursor in the deque is computed, not searched
+        if not self._events or cursor >= self._events[-1]["id"]:
+            return []
+        start = max(cursor + 1 - self._events[0]["id"], 0)
+        return [self._events[i] for i in range(start, len(self._events))]
+
+    def since(self, cursor):
+        """
+        Events newer than cursor. Events that already fell out of the ring are skipped.
+        """
+        with self._cond:
+            return self._since(self._normalize(cursor))
+
+    def wait(self, cursor, timeout):
+        """
+        Long-poll: blocks until there are events newer than cursor, the timeout expires
+        or the ring is closed. Returns the (possibly empty) list of new events.
+        """
+        with self._cond:
+            cursor = self._normalize(cursor)
+            self._cond.wait_for(lambda: self._closed or (self._events and self._events[-1]["id"] > cursor), timeout)
+            return self._since(cursor)
+
+    def sse_stream(self, cursor, should_stop=lambda: False):
+        """
+        Server-Sent Events generator starting after cursor. Sends a comment line as a
+        heartbeat when idle so proxies and browsers keep the connection open.
+        """
+        while not self._closed and not should_stop():
+            events = self.wait(cursor, HEARTBEAT_SECONDS)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                cursor = event["id"]
+                yield format_sse(event)
@@ -0,0 +1,367 @@
+import multiprocessing as mp
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+import numpy as np
+
+# Staged recognizer: capture (main process) -> detect/encode (worker processes reading
+# frames out of shared-memory slots) -> render (main process). Every hand-off is bounded
+# and the capture stage drops the oldest queued frame instead of blocking the camera.
+# Recordings replayed unthrottled submit with block=True instead, so no frame is lost.
+# Dual-stream sources also fill a lores luma slot per frame; workers then detect on the
+# luma plane and encode from crops of the full frame.
+#
+# Workers come from a forkserver, not a plain fork of the recognizer: by the time the
+# pipeline starts, the frame source, the journal and the control socket run threads that
+# may hold a lock (stdout's included) at the moment of a fork. The forkserver preloads
+# recognition_core once, so the workers still share the dlib models copy-on-write.
+
+DEFAULT_QUEUE_SIZE = 2
+STATS_WINDOW_SECONDS = 5.0
+BLOCKING_SUBMIT_TIMEOUT = 10.0  # a blocking submit gives up when the workers stop answering
+
+
+class StageStats:
+    """
+    Thread-safe per-stage counters with a rolling throughput over the last few seconds.
+    """
+
+    def __init__(self, name, window=STATS_WINDOW_SECONDS):
+        self.name = name
+        self.window = window
+        self.total = 0
+        self.dropped = 0
+        self.busy_seconds = 0.0
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds=0.0, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.total += 1
+            self.busy_seconds += busy_seconds
+            self._events.append(now)
+
+    def drop(self, count=1):
+        with self._lock:
+            self.dropped += count
+
+    def fps(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            cutoff = now - self.window
+            while self._events and self._events[0] < cutoff:
+                self._events.popleft()
+            return len(self._events) / self.window
+
+    def snapshot(self):
+        fps = self.fps()
+        with self._lock:
+            avg_ms = 1000 * self.busy_seconds / self.total if self.total else 0.0
+            return {"fps": round(fps, 2), "total": self.total, "dropped": self.dropped, "avg_ms": round(avg_ms, 1)}
+
+
+def _put_drop_oldest(task_queue, item, on_drop):
+    """
+    Puts item on a bounded queue, evicting the oldest entries while it is full.
+    """
+    while True:
+        try:
+            task_queue.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                on_drop(task_queue.get_nowait())
+            except queue.Empty:
+                pass
+
+
+def _detection_worker(shm_name, slots_shape, task_queue, result_queue, lores=None):
+    """
+    Worker process: reads a frame out of its shared-memory slot, detects and encodes faces,
+    and sends back plain lists so nothing large crosses the process boundary. lores is
+    (shm_name, slots_shape, scale) of the luma slots for dual-stream sources.
+    """
+    from recognition_core import (prepare_detection_frame, detect_and_encode, detect_and_encode_lores,
+                                  crop_region, lores_region)
+
+    # Started for the recognizer: leave Ctrl+C and cleanup handlers to the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray(slots_shape, dtype=np.uint8, buffer=shm.buf)
+    luma_shm = luma_slots = None
+    if lores is not None:
+        luma_shm = shared_memory.SharedMemory(name=lores[0])
+        luma_slots = np.ndarray(lores[1], dtype=np.uint8, buffer=luma_shm.buf)
+        scale = lores[2]
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            seq, slot, captured_at, settled_boxes, region, downscale, upsample = task
+            timings = {}
+            if luma_slots is not None:
+                luma, origin = crop_region(luma_slots[slot], lores_region(region, scale))
+                face_locations, face_encs = detect_and_encode_lores(luma, slots[slot], scale, upsample, settled_boxes,
+                                                                    origin, timings)
+            else:
+                frame, origin = crop_region(slots[slot], region)
+                rgb_small_frame = prepare_detection_frame(frame, downscale)
+                face_locations, face_encs = detect_and_encode(rgb_small_frame, upsample, downscale, settled_boxes,
+                                                              origin, timings)
+            result_queue.put((seq, slot, captured_at, region, face_locations,
+                              [e.tolist() if e is not None else None for e in face_encs], timings))
+    finally:
+        del slots, luma_slots
+        shm.close()
+        if luma_shm is not None:
+            luma_shm.close()
+
+
+class RecognitionPipeline:
+    """
+    Owns the shared-memory frame slots, the detection worker pool and the render thread.
+
+    The caller feeds frames with submit() from its capture loop; on_result(frame, face_locations,
+    face_encs, region, timings) runs on the render thread for every detection result newer than
+    the last one rendered, with full-frame locations and None for faces that were not encoded.
+    Frames that skip detection go through submit_skipped() and reach on_result with None for
+    everything but the frame, in capture order with the detection results.
+    """
+
+    def __init__(self, frame_shape, on_result, workers=3, downscale=3, upsample=1, queue_size=DEFAULT_QUEUE_SIZE,
+                 lores_shape=None, lores_scale=None):
+        self.frame_shape = tuple(frame_shape)
+        self.on_result = on_result
+        self.workers = workers
+        self.downscale = downscale
+        self.upsample = upsample
+
+        # One slot per frame that can be in flight: queued, being detected, or waiting to render
+        self.n_slots = workers + queue_size + 2
+        self.slots_shape = (self.n_slots,) + self.frame_shape
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.slots_shape)))
+        self.slots = np.ndarray(self.slots_shape, dtype=np.uint8, buffer=self._shm.buf)
+        # Luma plane of the same frame, for sources with a lores detection stream
+        self.lores_scale = lores_scale
+        self._luma_shm = self.luma_slots = None
+        if lores_shape is not None:
+            self.luma_slots_shape = (self.n_slots,) + tuple(lores_shape)
+            self._luma_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.luma_slots_shape)))
+            self.luma_slots = np.ndarray(self.luma_slots_shape, dtype=np.uint8, buffer=self._luma_shm.buf)
+
+        self._ctx = mp.get_context("forkserver")
+        self._ctx.set_forkserver_preload(["recognition_core"])
+        self._task_queue = self._ctx.Queue(maxsize=queue_size)
+        self._result_queue = self._ctx.Queue()
+        self._free_slots = queue.Queue()
+        for slot in range(self.n_slots):
+            self._free_slots.put(slot)
+
+        # Render thread inbox: detection results, skipped frames and wake-ups for dropped tasks
+        self._inbox = queue.Queue()
+        # Skipped frames waiting for an older detection that is still in flight
+        self._held = deque()
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+
+        self._processes = []
+        self._collect_thread = None
+        self._render_thread = None
+        self._running = False
+        self._seq = 0
+        self._last_rendered = -1
+
+        self.stats = {
+            "capture": StageStats("capture"),
+            "detect": StageStats("detect"),
+            "render": StageStats("render"),
+        }
+
+    def start(self):
+        lores = None
+        if self._luma_shm is not None:
+            lores = (self._luma_shm.name, self.luma_slots_shape, self.lores_scale)
+        for _ in range(self.workers):
+            p = self._ctx.Process(target=_detection_worker, daemon=True,
+                                  args=(self._shm.name, self.slots_shape, self._task_queue, self._result_queue, lores))
+            p.start()
+            self._processes.append(p)
+        self._running = True
+        self._collect_thread = threading.Thread(target=self._collect_loop, daemon=True)
+        self._collect_thread.start()
+        self._render_thread = threading.Thread(target=self._render_loop, daemon=True)
+        self._render_thread.start()
+        print(f"[INFO] Recognition pipeline started with {self.workers} detection workers")
+
+    def _release(self, task):
+        with self._in_flight_lock:
+            self._in_flight.discard(task[0])
+        self._free_slots.put(task[1])
+        self.stats["capture"].drop()
+        # Skipped frames held behind this task can be shown now
+        self._inbox.put(("dropped", task[0]))
+
+    def submit(self, frame, settled_boxes=(), region=None, downscale=None, upsample=None, block=False, luma=None):
+        """
+        Copies a captured frame into a free slot and queues it for detection, optionally limited
+        to a (top, right, bottom, left) region. Faces overlapping settled_boxes (tracks that are
+        already identified) are detected but not re-encoded. downscale/upsample override the
+        pipeline defaults for this frame. block=True waits for a free slot and queue space
+        instead of dropping frames. luma is the frame's lores plane when the pipeline has luma slots.
+        Returns False when every slot is busy and the frame had to be skipped.
+        """
+        start = time.monotonic()
+        try:
+            if block:
+                slot = self._free_slots.get(timeout=BLOCKING_SUBMIT_TIMEOUT)
+            else:
+                slot = self._free_slots.get_nowait()
+        except queue.Empty:
+            self.stats["capture"].drop()
+            return False
+
+        self.slots[slot][...] = frame
+        if self.luma_slots is not None:
+            self.luma_slots[slot][...] = luma
+        self._seq += 1
+        task = (self._seq, slot, time.time(), list(settled_boxes), region,
+                downscale or self.downscale, self.upsample if upsample is None else upsample)
+        with self._in_flight_lock:
+            self._in_flight.add(self._seq)
+        if block:
+            try:
+                self._task_queue.put(task, timeout=BLOCKING_SUBMIT_TIMEOUT)
+            except queue.Full:
+                self._release(task)
+                return False
+        else:
+            _put_drop_oldest(self._task_queue, task, self._release)
+        self.stats["capture"].record(time.monotonic() - start)
+        return True
+
+    def submit_skipped(self, frame):
+        """
+        Queues a frame that skips detection for the render thread, so the caller never renders
+        on its own thread. It is held until every older frame still in detection has rendered.
+        """
+        self._seq += 1
+        self._inbox.put(("skipped", self._seq, frame))
+
+    def drain(self, timeout=10.0):
+        """
+        Waits until every submitted frame has been rendered (or dropped). Returns False on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while self._free_slots.qsize() < self.n_slots or self._inbox.unfinished_tasks or self._held:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _collect_loop(self):
+        while self._running:
+            try:
+                result = self._result_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._inbox.put(("detected", result))
+
+    def _render_loop(self):
+        while self._running:
+            try:
+                item = self._inbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if item[0] == "detected":
+                    self._render_detection(*item[1])
+                elif item[0] == "skipped":
+                    self._held.append(item[1:])
+                    if len(self._held) > self.n_slots:
+                        self._held.popleft()
+                        self.stats["render"].drop()
+                self._render_held()
+            finally:
+                self._inbox.task_done()
+
+    def _render_detection(self, seq, slot, captured_at, region, face_locations, face_encs, timings):
+        self.stats["detect"].record(timings["detect"] + timings["encode"])
+        with self._in_flight_lock:
+            self._in_flight.discard(seq)
+
+        # Workers finish out of order; never render a frame older than one already shown
+        if seq <= self._last_rendered:
+            self._free_slots.put(slot)
+            self.stats["render"].drop()
+            return
+        frame = self.slots[slot].copy()
+        self._free_slots.put(slot)
+        self._render(seq, frame, face_locations, [np.asarray(e) if e is not None else None for e in face_encs],
+                     region, timings)
+
+    def _render_held(self):
+        with self._in_flight_lock:
+            oldest_in_flight = min(self._in_flight, default=None)
+        while self._held and (oldest_in_flight is None or self._held[0][0] < oldest_in_flight):
+            seq, frame = self._held.popleft()
+            if seq <= self._last_rendered:
+                self.stats["render"].drop()
+                continue
+            self._render(seq, frame, None, None, None, None)
+
+    def _render(self, seq, frame, face_locations, face_encs, region, timings):
+        self._last_rendered = seq
+        start = time.monotonic()
+        try:
+            self.on_result(frame, face_locations, face_encs, region, timings)
+        except Exception as e:
+            print(f"[ERROR] Render stage failed: {e}")
+        self.stats["render"].record(time.monotonic() - start)
+
+    def report(self):
+        """
+        Per-stage throughput, average busy time and drop counters.
+        """
+        report = {name: stats.snapshot() for name, stats in self.stats.items()}
+        report["workers"] = self.workers
+        try:
+            report["queue_depth"] = self._task_queue.qsize()
+        except NotImplementedError:  # not available on macOS
+            report["queue_depth"] = None
+        return report
+
+    def stop(self):
+        self._running = False
+        # Throw away queued frames so every worker can receive its stop sentinel
+        while True:
+            try:
+                self._task_queue.get_nowait()
+            except queue.Empty:
+                break
+        for _ in self._processes:
+            try:
+                self._task_queue.put(None, timeout=1)
+            except queue.Full:
+                break
+        for p in self._processes:
+            p.join(timeout=2)
+            if p.is_alive():
+                p.terminate()
+        for thread in (self._collect_thread, self._render_thread):
+            if thread is not None:
+                thread.join(timeout=2)
+        del self.slots
+        self._shm.close()
+        self._shm.unlink()
+        if self._luma_shm is not None:
+            del self.luma_slots
+            self._luma_shm.close()
+            self._luma_shm.unlink()
+        print("[INFO] Recognition pipeline stopped")
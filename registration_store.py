@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Registration records for the portal, in SQLite instead of a JSON list that every
+# /register request read, scanned and rewrote.
+#
+# Unique indexes on student_id and on the (case-insensitive) MAC make duplicate checks
+# O(log n) and let the database reject a racing duplicate atomically, so concurrent
+# sign-ups can neither lose records nor register twice. WAL mode keeps readers and the
+# single writer from blocking each other.
+#
+# full_log.py still reads registration.json: export_json() writes it (atomically) in the
+# same shape as before, a couple of seconds after the last change and when the portal stops.
+
+DB_FILE = "registration.db"
+JSON_FILE = "registration.json"
+EXPORT_DELAY = 2.0  # seconds of quiet before registration.json is rewritten
+FIELDS = ["name", "student_id", "ip", "mac", "photo_path", "timestamp"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS registrations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    student_id TEXT NOT NULL UNIQUE,
+    ip TEXT,
+    mac TEXT NOT NULL,
+    photo_path TEXT,
+    timestamp TEXT
+);
+-- Failed lookups (MAC_NOT_FOUND / MAC_ERROR) are not real addresses and may repeat
+CREATE UNIQUE INDEX IF NOT EXISTS registrations_mac
+    ON registrations (lower(mac)) WHERE mac LIKE '__:__:__:__:__:__';
+"""
+
+
+class DuplicateRegistration(Exception):
+    pass
+
+
+class InvalidRegistration(Exception):
+    """
+    A record the schema rejects for another reason than a duplicate, e.g. a missing name or MAC.
+    """
+
+
+class RegistrationStore:
+    def __init__(self, db_path=DB_FILE, json_path=JSON_FILE, export_delay=EXPORT_DELAY):
+        self.db_path = db_path
+        self.json_path = json_path
+        self.export_delay = export_delay
+        self._local = threading.local()
+        self._export_timer = None
+        self._export_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+        self._import_json()
+
+    def _connection(self):
+        # One connection per thread; Flask serves every request on its own thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _import_json(self):
+        # One-time migration of an existing registration.json into an empty database
+        conn = self._connection()
+        if conn.execute("SELECT COUNT(*) FROM registrations").fetchone()[0] or not os.path.exists(self.json_path):
+            return
+        with open(self.json_path) as f:
+            records = json.load(f)
+        imported = 0
+        for record in records:
+            try:
+                self.insert(record, export=False)
+                imported += 1
+            except DuplicateRegistration:
+                print(f"[WARNING] Skipped duplicate registration of {record.get('student_id')} while importing")
+            except InvalidRegistration as e:
+                print(f"[WARNING] Skipped malformed registration of {record.get('student_id')} while importing: {e}")
+        if imported:
+            print(f"[INFO] Imported {imported} registrations from {self.json_path} into {self.db_path}")
+
+    def is_registered(self, student_id, mac):
+        """
+        Index lookup for an existing registration with this student_id or MAC.
+        """
+        row = self._connection().execute(
+            "SELECT 1 FROM registrations WHERE student_id = ? "
+            "OR (lower(mac) = lower(?) AND mac LIKE '__:__:__:__:__:__') LIMIT 1",
+            (student_id, mac)).fetchone()
+        return row is not None
+
+    def insert(self, record, export=True):
+        """
+        Atomically adds a registration. Raises DuplicateRegistration when the student_id
+        or MAC is taken, even if another request inserted it a moment ago, and
+        InvalidRegistration when a required field is missing.
+        """
+        try:
+            self._connection().execute(
+                "INSERT INTO registrations (name, student_id, ip, mac, photo_path, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                tuple(record.get(field) for field in FIELDS))
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE constraint failed" in str(e):
+                raise DuplicateRegistration(str(e)) from e
+            raise InvalidRegistration(str(e)) from e
+        if export:
+            self.schedule_export()
+
+    def records(self):
+        rows = self._connection().execute(
+            f"SELECT {', '.join(FIELDS)} FROM registrations ORDER BY seq").fetchall()
+        return [dict(row) for row in rows]
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM registrations").fetchone()[0]
+
+    def export_json(self):
+        """
+        Writes registration.json in the shape full_log.py reads, via a temp file and rename.
+        """
+        with self._export_lock:
+            if self._export_timer is not None:
+                self._export_timer.cancel()
+                self._export_timer = None
+            records = self.records()
+            tmp_path = self.json_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(records, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.json_path)
+        return len(records)
+
+    def schedule_export(self):
+        # Debounced: a burst of sign-ups costs one export, not one rewrite per student
+        with self._export_lock:
+            if self._export_timer is not None:
+                self._export_timer.cancel()
+            self._export_timer = threading.Timer(self.export_delay, self.export_json)
+            self._export_timer.daemon = True
+            self._export_timer.start()
+
+
+if __name__ == "__main__":
+    # python3 registration_store.py — rewrites registration.json from registration.db now
+    start = time.monotonic()
+    count = RegistrationStore().export_json()
+    print(f"[INFO] Exported {count} registrations to {JSON_FILE} in {(time.monotonic() - start) * 1000:.0f} ms")
@@ -1,228 +1,385 @@
-import face_recognition
+import argparse
 import json
 import os
-import pickle
+import sys
 from datetime import datetime
-from picamera2 import Picamera2
-import cv2
-import numpy as np
 import time
-from flask import Flask, Response, jsonify
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 import threading
 import atexit
 import signal
 from collections import deque
-from queue import Queue
+from face_matcher import FaceMatcher
+from ann_index import load_index
+from encoding_store import open_store, load_course_gallery
+from recognition_core import (prepare_detection_frame, detect_and_encode, detect_and_encode_lores, crop_region,
+                              lores_region, scale_location, draw_face, draw_fps)
+from motion_gate import MotionGate
+from frame_broadcaster import FrameBroadcaster
+from adaptive_controller import AdaptiveController
+from recognition_events import EventRing
+from attendance_journal import AttendanceJournal, journal_path, load_session_students
+from face_tracker import FaceTracker
+from recognition_pipeline import RecognitionPipeline
+from control_channel import ControlServer, control_path
+from frame_sources import open_frame_source, DEFAULT_LORES_SIZE
+from metrics import STAGE_SECONDS, install_flask, gauge, counter
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+install_flask(app)  # per-route latency and /metrics
 
 # === Setup and cleanup
-STOP_FLAG = "stop_recognition.flag"
-if os.path.exists(STOP_FLAG):
-    os.remove(STOP_FLAG)
-
-# === Load encodings
-try:
-    with open("encodings.pkl", "rb") as f:
-        known_faces = pickle.load(f)
-except Exception as e:
-    print("[ERROR] Could not load encodings.pkl:", e)
-    exit()
-
-names = list(known_faces.keys())
-encodings = list(known_faces.values())
-
-# === Load session config
-try:
-    with open("session_config.json") as f:
-        session_config = json.load(f)
-        course_id = session_config["course_id"]
-        session_id = session_config["session_id"]
-        threshold = session_config.get("threshold", 60)
-except Exception as e:
-    print("[ERROR] Could not load session_config.json:", e)
-    exit()
-
-# Ensure logs directory exists
-log_dir = f"logs/{course_id}"
-os.makedirs(log_dir, exist_ok=True)
-log_path = f"{log_dir}/{course_id}_{session_id}.json"
-
-# Initialize session data if log file doesn't exist
-if not os.path.exists(log_path):
-    print(f"[WARNING] Session log not found: {log_path}. Initializing with empty student data.")
-    session_data = []
-else:
-    with open(log_path) as f:
-        session_data = json.load(f)
-
-students_by_id = {s["student_id"]: s for s in session_data}
-
-# === Camera Configuration
-picam2 = Picamera2()
-picam2.preview_configuration.main.size = (640, 480)
-picam2.preview_configuration.main.format = "RGB888"
-picam2.configure("preview")
-picam2.start()
-time.sleep(1)
-
-print("[INFO] Camera started. Press Ctrl+C to exit.")
+# Set by the supervisor's "stop" command (or /stop_face_recognition); the hot loops only
+# check this in-memory event, never the filesystem
+stop_event = threading.Event()
+
+# Session, gallery, frame source and workers are set up by main(), so the module can be
+# imported (e.g. by batch tools) without touching the camera or forking anything
+session_config = None
+course_id = session_id = None
+students_by_id = {}
+matcher = None
+gallery_source = None
+load_ms = 0.0
+journal = None
+source = None
+pipeline = None
+frame_processing_thread = None
+control_server = None
+async_app = None  # the aiohttp app when the asyncio server is used
+
+def load_session_config(path="session_config.json"):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[ERROR] Could not load {path}:", e)
+        sys.exit(1)
+
+def load_session_roster(course_id, session_id):
+    """
+    Returns (session_data, roster_ids, has_journal) for the session.
+    """
+    # Session state comes from the attendance journal full_log.py appended to (or an older JSON log)
+    has_journal = os.path.exists(journal_path(course_id, session_id))
+    try:
+        session_data = load_session_students(course_id, session_id)
+    except FileNotFoundError:
+        print(f"[WARNING] Session log not found for {course_id}_{session_id}. Initializing with empty student data.")
+        session_data = []
+
+    # Only the students of this session's roster are matched: a smaller matrix and no false
+    # positives from other courses. The roster comes from the session log, or from
+    # registration.json when the session has not been logged yet; without either the whole
+    # gallery is used.
+    roster_ids = [s["student_id"] for s in session_data]
+    if not roster_ids and os.path.exists("registration.json"):
+        try:
+            with open("registration.json") as f:
+                roster_ids = [s["student_id"] for s in json.load(f)]
+        except Exception as e:
+            print("[WARNING] Could not read registration.json for the roster:", e)
+    return session_data, roster_ids, has_journal
+
+def load_gallery(course_id, roster_ids):
+    """
+    Returns (matcher, gallery_source, load_ms) for the roster (the whole gallery when empty).
+    """
+    try:
+        load_start = time.monotonic()
+        encoding_store = open_store()
+        if roster_ids:
+            known_ids, known_matrix, cached = load_course_gallery(encoding_store, course_id, roster_ids)
+            gallery_source = f"course {course_id} ({'cached' if cached else 'rebuilt'} subset, {len(roster_ids)} on roster)"
+        else:
+            known_ids, known_matrix = encoding_store.load()
+            gallery_source = "full gallery"
+    except Exception as e:
+        print("[ERROR] Could not load the encoding store:", e)
+        sys.exit(1)
+
+    # All known encodings live in one (N x 128) matrix so a frame is matched in one batched call.
+    # The matrix is memory-mapped from encodings_store/, nothing is copied.
+    # Large full galleries are searched through the IVF index that encode_faces.py builds
+    ann_index = load_index(known_ids) if not roster_ids else None
+    matcher = FaceMatcher(known_ids, known_matrix, index=ann_index)
+    load_ms = (time.monotonic() - load_start) * 1000
+    if ann_index is not None:
+        print(f"[INFO] Gallery: {len(matcher)} faces from {gallery_source} in {load_ms:.1f} ms with ANN index ({ann_index.nlist} lists, nprobe={ann_index.nprobe})")
+    else:
+        print(f"[INFO] Gallery: {len(matcher)} faces from {gallery_source} in {load_ms:.1f} ms")
+    if roster_ids and len(matcher) < len(set(roster_ids)):
+        print(f"[WARNING] {len(set(roster_ids)) - len(matcher)} student(s) on the roster have no encoding yet")
+    return matcher, gallery_source, load_ms
 
 # === Face Recognition Parameters
+# Starting points only: the controller moves them to keep detection + encoding inside
+# latency_budget_ms (session_config.json, "adaptive_quality": false pins them)
 FACE_DETECTION_DOWNSCALE_FACTOR = 3
 FRAME_SKIP_INTERVAL = 2
+controller = None
+
+# "interval" runs detection on every Nth frame; "motion" additionally skips frames where
+# nothing changed and limits detection to the changed region, with a periodic full refresh
+DETECTION_MODE = "interval"
+motion_gate = MotionGate()
+
+# Detection/encoding worker processes; 0 keeps the original single-threaded loop
+DETECTION_WORKERS = 0
+PIPELINE_REPORT_INTERVAL = 10
 
 # Shared state with thread safety
 cooldown = {}
 COOLDOWN_SECONDS = 5
 recognized_students = set()
+tracker = FaceTracker()  # keeps identities between detections so settled faces are not re-encoded
 last_frame_time = time.time()
-last_save_time = time.time()
-SAVE_INTERVAL = 5
 
 # Thread-safe state management
 state_lock = threading.Lock()
-current_annotated_frame = None
-frame_lock = threading.Lock()
-recognition_queue = Queue()  # Queue for recognition updates
+broadcaster = FrameBroadcaster()  # encode-once fan-out of annotated frames to /video_feed
+recognition_events = EventRing()  # recognition updates; each client reads from its own cursor
 
-def save_logs():
-    try:
-        with open(log_path, "w") as f:
-            json.dump(list(students_by_id.values()), f, indent=2)
-        print("[INFO] Logs saved successfully")
-    except Exception as e:
-        print(f"[ERROR] Failed to save logs: {e}")
+cleaned_up = False
 
 def cleanup():
+    global cleaned_up
+    if cleaned_up:
+        return
+    cleaned_up = True
     print("[INFO] Cleaning up resources...")
-    try:
-        picam2.stop()
-        print("[INFO] Camera stopped")
-    except Exception as e:
-        print(f"[ERROR] Error stopping camera: {e}")
-    
-    save_logs()
-    
-    if os.path.exists(STOP_FLAG):
-        os.remove(STOP_FLAG)
-        print("[INFO] Removed stop flag")
+    if source is not None:
+        try:
+            source.close()
+            print("[INFO] Frame source closed")
+        except Exception as e:
+            print(f"[ERROR] Error closing frame source: {e}")
+
+    if journal is not None:
+        journal.close()
+        print("[INFO] Attendance journal committed")
+
+    if control_server is not None:
+        control_server.close()
+
+def mark_recognized(student_id, now):
+    """
+    Records a face recognition for a student. Caller holds state_lock.
+    """
+    last_seen = cooldown.get(student_id, 0)
+    if now - last_seen <= COOLDOWN_SECONDS:
+        return
+    cooldown[student_id] = now
+    student = students_by_id.get(student_id)
+
+    if student:
+        student["face"] = True
+        if student["total_minutes"] >= student["threshold"]:
+            student["attended"] = True
+        print(f"[RECOGNIZED] ✅ {student_id}")
+        recognized_students.add(student_id)
+        # Publish the recognition to every dashboard
+        recognition_events.publish({
+            "student_id": student_id,
+            "timestamp": now,
+            "action": "recognized"
+        })
+        journal.update(student_id, face=True, attended=student["attended"])
+
+def handle_detections(frame, face_locations=None, face_encs=None, region=None):
+    """
+    Feeds a frame's detections to the tracker, matches the faces that were encoded,
+    updates attendance and publishes the annotated frame. Without detections (skipped
+    frame) the overlay is drawn from the current track state. region is the part of the
+    frame detection ran on, None for the full frame.
+    Called from the serial loop, or from the render stage when the pipeline is enabled.
+    """
+    global last_frame_time
 
-# Register cleanup handlers
-atexit.register(cleanup)
-signal.signal(signal.SIGINT, lambda s, f: (cleanup(), exit(0)))
-signal.signal(signal.SIGTERM, lambda s, f: (cleanup(), exit(0)))
+    current_time = time.time()
+    fps = 1.0 / max(current_time - last_frame_time, 1e-6)
+    last_frame_time = current_time
+
+    # Annotate the frame in place: sources hand out frames the caller owns
+    annotated_frame = frame
+
+    with state_lock:
+        if face_locations is not None:
+            tracks = tracker.update(face_locations, current_time, region)
+            encoded = [(track, enc) for track, enc in zip(tracks, face_encs) if enc is not None]
+            for track, enc in zip(tracks, face_encs):
+                if enc is None:
+                    tracker.reuse(track)
+
+            # Score every newly encoded face of this frame against the whole gallery at once
+            if encoded:
+                with STAGE_SECONDS.time("match"):
+                    face_matches = matcher.match([enc for _, enc in encoded])
+                for (track, _), face_match in zip(encoded, face_matches):
+                    tracker.identify(track, face_match, current_time)
+                    if face_match.student_id is not None:
+                        mark_recognized(face_match.student_id, current_time)
+
+        draw_start = time.perf_counter()
+        for track in tracker.visible_tracks():
+            draw_face(annotated_frame, track.box, track.label, track.student_id is not None)
+
+    # Add FPS counter
+    draw_fps(annotated_frame, fps)
+    STAGE_SECONDS.observe(time.perf_counter() - draw_start, "draw")
+
+    # Hand the frame to the stream clients; JPEG encoding happens once, on their side
+    broadcaster.publish(annotated_frame)
+
+def should_detect(frame, frame_count, luma=None):
+    """
+    Detection gate shared by both loops. Returns (run_detection, region); region is None
+    for a full-frame detection. With a lores plane the motion gate compares that instead
+    of the frame, and its region is scaled back to frame pixels.
+    """
+    if frame_count % controller.skip_interval != 0:
+        return False, None
+    if DETECTION_MODE == "motion":
+        if luma is None:
+            return motion_gate.check(frame)
+        run_detection, region = motion_gate.check(luma)
+        return run_detection, scale_location(region, source.lores_scale) if region is not None else None
+    return True, None
 
 def process_frames():
-    global last_frame_time, last_save_time, current_annotated_frame
     frame_count = 0
     
     while True:
-        if os.path.exists(STOP_FLAG):
+        if stop_event.is_set():
             break
 
-        frame = picam2.capture_array()
+        capture_start = time.perf_counter()
+        frame, luma = source.read_pair()
         if frame is None:
+            if source.finished:
+                break
             time.sleep(0.01)
             continue
+        STAGE_SECONDS.observe(time.perf_counter() - capture_start, "capture")
 
-        current_time = time.time()
-        fps = 1.0 / (current_time - last_frame_time)
-        last_frame_time = current_time
+        # Only run face detection on every Nth frame (and, in motion mode, only where
+        # something changed); other frames reuse the tracks
+        frame_count += 1
+        run_detection, region = should_detect(frame, frame_count, luma)
+        if run_detection:
+            with state_lock:
+                settled_boxes = tracker.settled_boxes()
+            downscale, _, upsample = controller.settings()
+            timings = {}
+            if luma is not None:
+                # Dual stream: detect on the camera's lores plane, encode from the full frame
+                detection_luma, origin = crop_region(luma, lores_region(region, source.lores_scale))
+                face_locations, face_encs = detect_and_encode_lores(detection_luma, frame, source.lores_scale, upsample,
+                                                                    settled_boxes, origin, timings)
+            else:
+                detection_frame, origin = crop_region(frame, region)
+                rgb_small_frame = prepare_detection_frame(detection_frame, downscale)
+                face_locations, face_encs = detect_and_encode(rgb_small_frame, upsample, downscale,
+                                                              settled_boxes, origin, timings)
+            record_timings(timings)
+            handle_detections(frame, face_locations, face_encs, region)
+        else:
+            handle_detections(frame)
+
+        # Small sleep to prevent CPU overload; recordings replayed unthrottled run flat out
+        if source.realtime:
+            time.sleep(0.01)
 
-        if current_time - last_save_time > SAVE_INTERVAL:
-            save_logs()
-            last_save_time = current_time
+    finish_frames()
+
+def finish_frames():
+    """
+    End of either loop: after a stop request, or when a recording has been played through.
+    """
+    broadcaster.close()
+    recognition_events.close()
+    if source.finished:
+        stats = source.stats()
+        print(f"[INFO] {stats['source']} finished: {stats['frames']} frames at {stats['fps']} fps, "
+              f"{len(recognized_students)} student(s) recognized")
+    print("[INFO] Frame processing loop stopped.")
+    # Take the whole process down (Flask included); the SIGTERM handler runs cleanup()
+    os.kill(os.getpid(), signal.SIGTERM)
+
+def record_timings(timings):
+    controller.record(timings["detect"], timings["encode"])
+    STAGE_SECONDS.observe(timings["detect"], "detect")
+    STAGE_SECONDS.observe(timings["encode"], "encode")
+
+def on_pipeline_result(frame, face_locations, face_encs, region, timings):
+    if timings is not None:
+        record_timings(timings)
+    handle_detections(frame, face_locations, face_encs, region)
+
+def dropped_frames():
+    """
+    Frames that never got a detection: skipped by the capture stage or rendered out of
+    order in the pipeline, and dropped by a real-time recording that fell behind.
+    """
+    dropped = getattr(source, "dropped", 0)
+    if pipeline is not None:
+        dropped += pipeline.stats["capture"].dropped + pipeline.stats["render"].dropped
+    return dropped
+
+def run_pipeline():
+    """
+    Capture stage of the multi-process pipeline: frames go to the detection workers
+    through shared memory and come back to handle_detections on the render thread.
+    """
+    last_report = time.time()
+    frame_count = 0
 
-        # Prepare frame for face recognition
-        small_frame = cv2.resize(frame, (0, 0), fx=1/FACE_DETECTION_DOWNSCALE_FACTOR, fy=1/FACE_DETECTION_DOWNSCALE_FACTOR)
-        rgb_small_frame = np.ascontiguousarray(small_frame[:, :, ::-1], dtype=np.uint8)
+    while True:
+        if stop_event.is_set():
+            break
 
-        face_locations = []
-        face_encs = []
+        capture_start = time.perf_counter()
+        frame, luma = source.read_pair()
+        if frame is None:
+            if source.finished:
+                break
+            time.sleep(0.01)
+            continue
+        STAGE_SECONDS.observe(time.perf_counter() - capture_start, "capture")
 
-        # Only run face detection on every Nth frame
+        # Skipped (or, in motion mode, static) frames never reach the workers; the render thread draws
+        # them from track state, so frames are only ever published from that one thread
         frame_count += 1
-        if frame_count % FRAME_SKIP_INTERVAL == 0:
-            face_locations = face_recognition.face_locations(rgb_small_frame)
-            face_encs = face_recognition.face_encodings(rgb_small_frame, face_locations)
-
-        # Annotate the original frame
-        annotated_frame = frame.copy()
-
-        # Process faces and update recognition
-        with state_lock:
-            for i, face_enc in enumerate(face_encs):
-                matches = face_recognition.compare_faces(encodings, face_enc)
-                name = "Unknown"
-
-                if True in matches:
-                    first_match_index = matches.index(True)
-                    student_id = names[first_match_index]
-                    name = student_id
-
-                    now = time.time()
-                    last_seen = cooldown.get(student_id, 0)
-
-                    if now - last_seen > COOLDOWN_SECONDS:
-                        cooldown[student_id] = now
-                        student = students_by_id.get(student_id)
-
-                        if student:
-                            student["face"] = True
-                            if student["total_minutes"] >= student["threshold"]:
-                                student["attended"] = True
-                            print(f"[RECOGNIZED] ✅ {student_id}")
-                            recognized_students.add(student_id)
-                            # Put recognition update in queue
-                            recognition_queue.put({
-                                "student_id": student_id,
-                                "timestamp": now,
-                                "action": "recognized"
-                            })
-                            save_logs()
-
-                # Scale up coordinates for drawing
-                if i < len(face_locations):
-                    top, right, bottom, left = face_locations[i]
-                    top *= FACE_DETECTION_DOWNSCALE_FACTOR
-                    right *= FACE_DETECTION_DOWNSCALE_FACTOR
-                    bottom *= FACE_DETECTION_DOWNSCALE_FACTOR
-                    left *= FACE_DETECTION_DOWNSCALE_FACTOR
-
-                    # Draw rectangle and name
-                    color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
-                    cv2.rectangle(annotated_frame, (left, top), (right, bottom), color, 2)
-                    cv2.putText(annotated_frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
-
-        # Add FPS counter
-        cv2.putText(annotated_frame, f"FPS: {fps:.1f}", (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-        # Update the current frame
-        with frame_lock:
-            current_annotated_frame = annotated_frame
-
-        # Small sleep to prevent CPU overload
-        time.sleep(0.01)
-
-    print("[INFO] Frame processing loop stopped.")
+        run_detection, region = should_detect(frame, frame_count, luma)
+        if run_detection:
+            with state_lock:
+                settled_boxes = tracker.settled_boxes()
+            downscale, _, upsample = controller.settings()
+            # A camera's frames may be dropped when the workers are busy, an unthrottled
+            # recording's may not: it waits for a free slot instead
+            if not pipeline.submit(frame, settled_boxes, region, downscale, upsample, block=not source.realtime,
+                                   luma=luma):
+                pipeline.submit_skipped(frame)
+        else:
+            pipeline.submit_skipped(frame)
+
+        if time.time() - last_report > PIPELINE_REPORT_INTERVAL:
+            report = pipeline_report()
+            print(f"[PIPELINE] capture {report['capture']['fps']:.1f} fps (dropped {report['capture']['dropped']}) | "
+                  f"detect {report['detect']['fps']:.1f} fps, {report['detect']['avg_ms']:.0f} ms avg "
+                  f"x{report['workers']} workers | render {report['render']['fps']:.1f} fps | "
+                  f"encoded {report['tracker']['encoded']}, reused {report['tracker']['reused']}")
+            last_report = time.time()
+
+    if source.finished:
+        pipeline.drain()
+    pipeline.stop()
+    finish_frames()
 
 def generate_frames_for_stream():
-    while True:
-        if os.path.exists(STOP_FLAG):
-            break
-        
-        with frame_lock:
-            if current_annotated_frame is not None:
-                ret, buffer = cv2.imencode('.jpg', current_annotated_frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                frame_bytes = buffer.tobytes()
-                
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            else:
-                time.sleep(0.05)
+    return broadcaster.stream(should_stop=stop_event.is_set)
 
 @app.route('/video_feed')
 def video_feed():
@@ -231,35 +388,187 @@ def video_feed():
 
 @app.route('/recognized.json')
 def get_recognized():
-    updates = []
-    # Get all pending updates from the queue
-    while not recognition_queue.empty():
-        try:
-            updates.append(recognition_queue.get_nowait())
-        except:
-            break
+    # Non-destructive read: updates after the client's own cursor (?since=<id>).
+    # With ?wait=<seconds> it long-polls until something new arrives.
+    cursor = request.args.get("since", 0, type=int)
+    wait = min(request.args.get("wait", 0, type=float), 30)
+    if wait > 0:
+        updates = recognition_events.wait(cursor, wait)
+    else:
+        updates = recognition_events.since(cursor)
     
     with state_lock:
         return jsonify({
             "recognized": list(recognized_students),
-            "updates": updates
+            "updates": updates,
+            "cursor": updates[-1]["id"] if updates else recognition_events.cursor(cursor)
         })
 
+@app.route('/events')
+def recognition_event_stream():
+    # Server-Sent Events; browsers resume from Last-Event-ID after a reconnect
+    cursor = request.headers.get("Last-Event-ID", type=int)
+    if cursor is None:
+        cursor = request.args.get("since", recognition_events.last_id, type=int)
+    return Response(recognition_events.sse_stream(cursor, should_stop=stop_event.is_set),
+                    mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+def stream_stats():
+    """
+    /video_feed viewers of whichever server is running.
+    """
+    if async_app is not None:
+        from async_server import HUB
+        if HUB in async_app:
+            return dict(async_app[HUB].stats(), server="asyncio")
+    return {"clients": broadcaster.subscribers, "server": "flask"}
+
+def pipeline_report():
+    report = pipeline.report() if DETECTION_WORKERS > 0 else {"workers": 0}
+    with state_lock:
+        report["tracker"] = tracker.stats()
+    report["detection_mode"] = DETECTION_MODE
+    report["gallery"] = {"faces": len(matcher), "source": gallery_source, "load_ms": round(load_ms, 1)}
+    report["stream"] = dict(stream_stats(), encoded_frames=broadcaster.encoded_frames)
+    report["source"] = source.stats()
+    if DETECTION_MODE == "motion":
+        report["motion"] = motion_gate.stats()
+    return report
+
+@app.route('/pipeline.json')
+def get_pipeline_stats():
+    return jsonify(pipeline_report())
+
+@app.route('/controller.json')
+def get_controller_state():
+    return jsonify(controller.report())
+
 @app.route('/stop_face_recognition', methods=['POST'])
 def stop_recognition_route():
-    with open(STOP_FLAG, 'w') as f:
-        f.write('stop')
-    print("[INFO] Stop flag created. Recognition thread should terminate soon.")
-    return jsonify({"status": "stopping recognition"})
+    return jsonify(stop_recognition())
 
-# Start the frame processing thread
-frame_processing_thread = threading.Thread(target=process_frames, daemon=True)
-frame_processing_thread.start()
+def stop_recognition():
+    request_stop()
+    return {"status": "stopping recognition"}
 
-if __name__ == '__main__':
+def recognized_ids():
+    with state_lock:
+        return list(recognized_students)
+
+def request_stop():
+    stop_event.set()
+    print("[INFO] Stop requested. Recognition thread will terminate.")
+    return {"state": "stopping"}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Live face recognition for the running session.")
+    parser.add_argument("--source", help="picamera2 (default), v4l2[:device], fake[:<photo dir>], images:<dir> or "
+                                         "video:<file>; overrides frame_source in session_config.json")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="replay speed for recordings: 0 runs unthrottled (default), 1 is real time")
+    parser.add_argument("--loop", action="store_true", help="restart a recording at its end (load testing)")
+    parser.add_argument("--config", default="session_config.json")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--server", choices=["asyncio", "flask"],
+                        help="HTTP server: asyncio (aiohttp, default) or Flask's threaded dev server; "
+                             "overrides http_server in session_config.json")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global session_config, course_id, session_id, students_by_id, matcher, gallery_source, load_ms
+    global journal, source, controller, DETECTION_MODE, DETECTION_WORKERS
+    global pipeline, frame_processing_thread, control_server, async_app
+    args = parse_args(argv)
+
+    # === Load session config
+    session_config = load_session_config(args.config)
+    try:
+        course_id = session_config["course_id"]
+        session_id = session_config["session_id"]
+    except KeyError as e:
+        print(f"[ERROR] {args.config} has no {e}")
+        sys.exit(1)
+
+    # === Load roster and encodings
+    session_data, roster_ids, has_journal = load_session_roster(course_id, session_id)
+    students_by_id = {s["student_id"]: s for s in session_data}
+    matcher, gallery_source, load_ms = load_gallery(course_id, roster_ids)
+
+    # Recognitions are appended to the journal; the JSON snapshot is materialized at end_class
+    journal = AttendanceJournal(course_id, session_id)
+    if not has_journal:
+        journal.reset(session_data)
+
+    # === Face Recognition Parameters
+    DETECTION_MODE = session_config.get("detection_mode", "interval")
+    if DETECTION_MODE not in ("interval", "motion"):
+        print(f"[WARNING] Unknown detection_mode '{DETECTION_MODE}', using 'interval'")
+        DETECTION_MODE = "interval"
+    DETECTION_WORKERS = int(session_config.get("detection_workers", max((os.cpu_count() or 1) - 1, 0)))
+
+    # === Frame source: the Pi camera, or a recording to reproduce a lecture / load-test
+    try:
+        # lores_size: the detection stream of the Pi camera, null for a single stream
+        lores_size = session_config.get("lores_size", DEFAULT_LORES_SIZE)
+        source = open_frame_source(args.source or session_config.get("frame_source"),
+                                   speed=args.speed, loop=args.loop, lores_size=lores_size)
+    except Exception as e:
+        print("[ERROR] Could not open the frame source:", e)
+        sys.exit(1)
+    print(f"[INFO] Frame source: {source.describe()}{'' if source.realtime else ' (unthrottled)'}. Press Ctrl+C to exit.")
+
+    # Detecting on a lores stream, the camera fixes the detection size: no downscale knob
+    controller = AdaptiveController.from_config(session_config, FACE_DETECTION_DOWNSCALE_FACTOR, FRAME_SKIP_INTERVAL,
+                                                fixed_resolution=source.lores_scale is not None)
+
+    # Scrape-time gauges; nothing is computed on the hot path
+    gauge("ipbeep_gallery_faces", "Faces in the loaded gallery", fn=lambda: len(matcher))
+    gauge("ipbeep_stream_clients", "Connected /video_feed clients", fn=lambda: stream_stats()["clients"])
+    counter("ipbeep_stream_dropped_frames_total", "Frames skipped for /video_feed clients that fell behind",
+            fn=lambda: stream_stats().get("dropped"))
+    gauge("ipbeep_pipeline_queue_depth", "Frames waiting for a detection worker",
+          fn=lambda: pipeline.report()["queue_depth"] if pipeline is not None else 0)
+    gauge("ipbeep_recognized_students", "Students recognized this session", fn=lambda: len(recognized_students))
+    counter("ipbeep_dropped_frames_total", "Frames dropped before detection", fn=dropped_frames)
+
+    # Register cleanup handlers
+    atexit.register(cleanup)
+    signal.signal(signal.SIGINT, lambda s, f: (cleanup(), sys.exit(0)))
+    signal.signal(signal.SIGTERM, lambda s, f: (cleanup(), sys.exit(0)))
+
+    # Control socket for class_control's supervisor: stop is acknowledged immediately
+    control_server = ControlServer(control_path("recognition"), {
+        "stop": request_stop,
+        "status": lambda: {"state": "stopping" if stop_event.is_set() else "running"},
+        "health": lambda: dict(pipeline_report(), alive=frame_processing_thread.is_alive()),
+    }).start()
+
+    # Start the frame processing thread. Detection workers come from a forkserver, so they
+    # inherit none of the threads (source, journal, control socket) already running here.
+    if DETECTION_WORKERS > 0:
+        pipeline = RecognitionPipeline(source.frame_shape(), on_pipeline_result,
+                                       workers=DETECTION_WORKERS, downscale=FACE_DETECTION_DOWNSCALE_FACTOR,
+                                       lores_shape=source.lores_shape(), lores_scale=source.lores_scale)
+        pipeline.start()
+        frame_processing_thread = threading.Thread(target=run_pipeline, daemon=True)
+    else:
+        frame_processing_thread = threading.Thread(target=process_frames, daemon=True)
+    frame_processing_thread.start()
+
+    server = args.server or session_config.get("http_server", "asyncio")
     try:
-        # Use Flask's built-in threading support
-        app.run(host='0.0.0.0', port=8090, debug=False, threaded=True)
+        if server == "flask":
+            # Use Flask's built-in threading support
+            app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
+        else:
+            # One event loop serves every viewer and dashboard; the Flask routes above are not used
+            import async_server
+            async_app = async_server.create_app(
+                broadcaster, recognition_events, recognized_ids,
+                json_routes={"/pipeline.json": pipeline_report, "/controller.json": controller.report},
+                post_routes={"/stop_face_recognition": stop_recognition},
+                should_stop=stop_event.is_set)
+            async_server.run(async_app, port=args.port)
     finally:
         cleanup()
         if frame_processing_thread.is_alive():
@@ -267,3 +576,6 @@ if __name__ == '__main__':
             frame_processing_thread.join(timeout=5)
             if frame_processing_thread.is_alive():
                 print("[WARNING] Frame processing thread did not terminate gracefully.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+# Event-driven view of which Wi-Fi stations are associated with the hotspot.
+#
+# Instead of forking `iw dev wlan0 station dump` on a timer, StationMonitor listens to
+# hostapd's control interface (enable it with ctrl_interface= in hostapd.conf, see
+# Config/hostapd.conf). hostapd pushes AP-STA-CONNECTED / AP-STA-DISCONNECTED the moment a
+# phone joins or leaves, and STA-FIRST / STA-NEXT give the current list on (re)connect.
+# Every join/leave is stamped with time.monotonic(), so presence minutes are the exact
+# sum of the connected intervals rather than "0.5 min per poll that saw the MAC".
+#
+# Sources yield (kind, payload, t) tuples:
+#   ("connected", mac, t) / ("disconnected", mac, t)
+#   ("sync", {macs}, t)    full list of associated stations, e.g. after hostapd restarted
+
+HOSTAPD_CTRL_DIR = "/var/run/hostapd"
+DEFAULT_INTERFACE = "wlan0"
+PING_INTERVAL = 10  # seconds without events before checking hostapd is still there
+RECONNECT_DELAY = 2
+IW_POLL_INTERVAL = 30
+
+
+def normalize_mac(mac):
+    return mac.strip().upper()
+
+
+class HostapdControlSource:
+    """
+    Reads station events from the hostapd control socket (/var/run/hostapd/<interface>).
+    Uses one socket ATTACHed for unsolicited events and one for commands, so replies
+    and events never interleave.
+    """
+
+    def __init__(self, interface=DEFAULT_INTERFACE, ctrl_dir=HOSTAPD_CTRL_DIR, clock=time.monotonic):
+        self.ctrl_path = os.path.join(ctrl_dir, interface)
+        self.clock = clock
+        self._sockets = []
+        self._closed = False
+
+    def available(self):
+        return os.path.exists(self.ctrl_path)
+
+    def _open(self, name):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        local_path = f"/tmp/ipbeep_{name}_{os.getpid()}_{id(self)}"
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        sock.bind(local_path)
+        sock.connect(self.ctrl_path)
+        self._sockets.append((sock, local_path))
+        return sock
+
+    def _close_sockets(self):
+        for sock, local_path in self._sockets:
+            sock.close()
+            if os.path.exists(local_path):
+                os.remove(local_path)
+        self._sockets = []
+
+    def _request(self, sock, command, timeout=2):
+        sock.settimeout(timeout)
+        sock.send(command.encode())
+        return sock.recv(4096).decode(errors="replace")
+
+    def _station_list(self, sock):
+        macs = set()
+        reply = self._request(sock, "STA-FIRST")
+        while reply and not reply.startswith("FAIL"):
+            mac = reply.splitlines()[0]
+            macs.add(normalize_mac(mac))
+            reply = self._request(sock, f"STA-NEXT {mac}")
+        return macs
+
+    def events(self):
+        while not self._closed:
+            try:
+                commands = self._open("cmd")
+                listener = self._open("ev")
+                if self._request(listener, "ATTACH").strip() != "OK":
+                    raise OSError("hostapd refused ATTACH")
+                yield ("sync", self._station_list(commands), self.clock())
+
+                listener.settimeout(PING_INTERVAL)
+                while not self._closed:
+                    try:
+                        message = listener.recv(4096).decode(errors="replace")
+                    except socket.timeout:
+                        if self._request(commands, "PING").strip() != "PONG":
+                            raise OSError("hostapd did not answer PING")
+                        continue
+                    now = self.clock()
+                    # "<3>AP-STA-CONNECTED aa:bb:cc:dd:ee:ff [extra fields]"
+                    parts = message.split(">", 1)[-1].split()
+                    if len(parts) >= 2 and parts[0] == "AP-STA-CONNECTED":
+                        yield ("connected", normalize_mac(parts[1]), now)
+                    elif len(parts) >= 2 and parts[0] == "AP-STA-DISCONNECTED":
+                        yield ("disconnected", normalize_mac(parts[1]), now)
+            except OSError as e:
+                if self._closed:
+                    break
+                print(f"[WARNING] hostapd control interface {self.ctrl_path}: {e}; reconnecting")
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                self._close_sockets()
+
+    def close(self):
+        self._closed = True
+        for sock, _ in self._sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class IwPollSource:
+    """
+    Fallback for hotspots running hostapd without a control interface: polls
+    `iw station dump` and turns the differences into events. Join/leave times are
+    only accurate to the poll interval.
+    """
+
+    def __init__(self, interface=DEFAULT_INTERFACE, interval=IW_POLL_INTERVAL, clock=time.monotonic):
+        self.interface = interface
+        self.interval = interval
+        self.clock = clock
+        self._stop = threading.Event()
+
+    def events(self):
+        while not self._stop.is_set():
+            try:
+                output = subprocess.check_output(["iw", "dev", self.interface, "station", "dump"]).decode()
+                macs = {normalize_mac(line.split()[1]) for line in output.splitlines()
+                        if line.strip().startswith("Station")}
+                yield ("sync", macs, self.clock())
+            except Exception as e:
+                print(f"[WARNING] iw station dump failed: {e}")
+            self._stop.wait(self.interval)
+
+    def close(self):
+        self._stop.set()
+
+
+class ReplaySource:
+    """
+    Replays a recorded event log for tests and demos. Each line is
+    "<seconds since start> <hostapd event>", e.g. "12.5 AP-STA-CONNECTED aa:bb:cc:dd:ee:ff";
+    "STA-LIST mac1 mac2 ..." stands for a full sync. speed=0 replays instantly on a
+    virtual clock that reads the timestamp of the last event.
+    """
+
+    def __init__(self, lines, speed=0):
+        if isinstance(lines, str):
+            with open(lines) as f:
+                lines = f.readlines()
+        self.records = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            offset, event, *args = line.split()
+            self.records.append((float(offset), event, args))
+        self.speed = speed
+        self._start = time.monotonic()
+        self._virtual_now = 0.0
+        self._closed = False
+
+    def clock(self):
+        if self.speed:
+            return (time.monotonic() - self._start) * self.speed
+        return self._virtual_now
+
+    def events(self):
+        self._start = time.monotonic()
+        for offset, event, args in self.records:
+            if self._closed:
+                return
+            if self.speed:
+                time.sleep(max(0.0, offset / self.speed - (time.monotonic() - self._start)))
+            self._virtual_now = offset
+            if event == "STA-LIST":
+                yield ("sync", {normalize_mac(mac) for mac in args}, offset)
+            elif event == "AP-STA-CONNECTED":
+                yield ("connected", normalize_mac(args[0]), offset)
+            elif event == "AP-STA-DISCONNECTED":
+                yield ("disconnected", normalize_mac(args[0]), offset)
+
+    def close(self):
+        self._closed = True
+
+
+def open_source(spec=None, interface=DEFAULT_INTERFACE):
+    """
+    "hostapd" (default) uses the control interface when hostapd exposes one and falls back
+    to polling iw otherwise; "iw" forces polling; anything else is a replay file path.
+    """
+    spec = spec or "hostapd"
+    if spec == "hostapd":
+        source = HostapdControlSource(interface)
+        if source.available():
+            return source
+        print(f"[WARNING] No hostapd control socket at {source.ctrl_path}; falling back to polling iw "
+              f"every {IW_POLL_INTERVAL}s (add ctrl_interface={HOSTAPD_CTRL_DIR} to hostapd.conf)")
+        return IwPollSource(interface)
+    if spec == "iw":
+        return IwPollSource(interface)
+    return ReplaySource(spec, speed=1)
+
+
+class StationMonitor:
+    """
+    Consumes a station event source on a background thread and keeps, per MAC, the
+    monotonic intervals it was associated. All queries are in-memory and O(1) per MAC.
+    """
+
+    def __init__(self, source, on_change=None):
+        self.source = source
+        self.clock = source.clock
+        self.on_change = on_change
+        self._connected = {}  # mac -> monotonic time it (re)joined
+        self._closed_seconds = {}  # mac -> seconds of presence in finished intervals
+        self._intervals = {}  # mac -> [(start, end or None), ...]
+        self._cond = threading.Condition()
+        self.version = 0
+        self.events = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        for kind, payload, t in self.source.events():
+            if kind == "sync":
+                with self._cond:
+                    joined = payload - set(self._connected)
+                    left = set(self._connected) - payload
+                for mac in sorted(left):
+                    self._apply("disconnected", mac, t)
+                for mac in sorted(joined):
+                    self._apply("connected", mac, t)
+            else:
+                self._apply(kind, payload, t)
+
+    def _apply(self, kind, mac, t):
+        with self._cond:
+            if kind == "connected":
+                if mac in self._connected:
+                    return
+                self._connected[mac] = t
+                self._intervals.setdefault(mac, []).append((t, None))
+            else:
+                start = self._connected.pop(mac, None)
+                if start is None:
+                    return
+                self._closed_seconds[mac] = self._closed_seconds.get(mac, 0.0) + (t - start)
+                self._intervals[mac][-1] = (start, t)
+            self.events += 1
+            self.version += 1
+            self._cond.notify_all()
+        if self.on_change is not None:
+            self.on_change(kind, mac, t)
+
+    def connected_macs(self):
+        with self._cond:
+            return frozenset(self._connected)
+
+    def is_connected(self, mac):
+        with self._cond:
+            return mac in self._connected
+
+    def present_seconds(self, mac, now=None):
+        """
+        Total seconds mac has been associated so far, including the interval still open.
+        """
+        with self._cond:
+            total = self._closed_seconds.get(mac, 0.0)
+            start = self._connected.get(mac)
+        if start is not None:
+            total += (self.clock() if now is None else now) - start
+        return total
+
+    def intervals(self, mac):
+        with self._cond:
+            return list(self._intervals.get(mac, []))
+
+    def wait_for_change(self, version, timeout):
+        """
+        Blocks until the connected set changed after version (or timeout); returns the new version.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def stats(self):
+        with self._cond:
+            return {"source": type(self.source).__name__, "connected": len(self._connected),
+                    "known_macs": len(self._intervals), "events": self.events}
+
+    def stop(self):
+        self.source.close()
+
+
+def wall_clock(monotonic_t, clock=time.monotonic):
+    """
+    Converts a monotonic timestamp from the monitor into a local "HH:MM:SS" string.
+    """
+    return time.strftime("%H:%M:%S", time.localtime(time.time() - (clock() - monotonic_t)))
+
+
+if __name__ == "__main__":
+    # python3 station_monitor.py [hostapd|iw|<replay file>] — prints joins/leaves as they happen
+    monitor = StationMonitor(open_source(sys.argv[1] if len(sys.argv) > 1 else None),
+                             on_change=lambda kind, mac, t: print(f"[{kind.upper()}] {mac} at {t:.1f}"))
+    try:
+        monitor.run()
+    except KeyboardInterrupt:
+        monitor.stop()
@@ -0,0 +1,187 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+from control_channel import CONTROL_ENV, control_path, send_command
+
+# Owns the lifecycle of the processes class_control.py starts (portal, MAC tracking,
+# face recognition). Children with a control socket are asked to stop over it and
+# acknowledge at once; the supervisor then waits on the process itself instead of
+# polling pgrep, and escalates to SIGTERM / SIGKILL only if it does not exit in time.
+
+STOP_TIMEOUT = 5.0
+KILL_TIMEOUT = 2.0
+
+
+class ManagedProcess:
+    """
+    One supervised child. control=False children (e.g. portal.py) are stopped with a signal.
+    """
+
+    def __init__(self, name, argv, control=True, stop_signal=signal.SIGINT, stop_timeout=STOP_TIMEOUT):
+        self.name = name
+        self.stop_timeout = stop_timeout
+        self.argv = list(argv)
+        self.control = control
+        self.stop_signal = stop_signal
+        self.control_path = os.path.abspath(control_path(name)) if control else None
+        self.proc = None
+        self.adopted_pid = None  # running child left over from a previous class_control
+        self.started_at = None
+        self.last_exit = None
+        self._state_lock = threading.Lock()  # guards proc/adopted_pid, which status readers reap too
+
+    @property
+    def pid(self):
+        if self.proc is not None:
+            return self.proc.pid
+        return self.adopted_pid
+
+    def is_running(self):
+        with self._state_lock:
+            if self.proc is not None:
+                if self.proc.poll() is None:
+                    return True
+                self.last_exit = self.proc.returncode
+                self.proc = None
+                return False
+            if self.adopted_pid is not None:
+                try:
+                    os.kill(self.adopted_pid, 0)
+                    return True
+                except OSError:
+                    self.adopted_pid = None
+            return False
+
+    def adopt(self):
+        """
+        Picks up a child that is still running from before a class_control restart.
+        """
+        if not self.control or self.is_running():
+            return False
+        try:
+            self.adopted_pid = send_command(self.control_path, "status")["pid"]
+            self.started_at = time.time()
+            print(f"[SUPERVISOR] Adopted running {self.name} (pid {self.adopted_pid})")
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def start(self):
+        if self.is_running():
+            return False
+        env = dict(os.environ)
+        if self.control:
+            env[CONTROL_ENV] = self.control_path
+        self.proc = subprocess.Popen(self.argv, env=env)
+        self.started_at = time.time()
+        print(f"[SUPERVISOR] Started {self.name} (pid {self.proc.pid})")
+        return True
+
+    def _wait(self, timeout):
+        proc = self.proc
+        if proc is not None:
+            try:
+                proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                return False
+            return True
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.is_running():
+                return True
+            time.sleep(0.05)
+        return not self.is_running()
+
+    def _signal(self, signum):
+        try:
+            os.kill(self.pid, signum)
+        except (OSError, TypeError):
+            pass
+
+    def stop(self, timeout=None):
+        """
+        Stops the child and waits for it to exit. Returns how it went: "not running",
+        "stopped", "terminated" or "killed".
+        """
+        if not self.is_running():
+            return "not running"
+        requested = False
+        if self.control:
+            try:
+                requested = send_command(self.control_path, "stop").get("ok", False)
+            except (OSError, ValueError) as e:
+                print(f"[SUPERVISOR] {self.name} did not take the stop command ({e}), signalling instead")
+        if not requested:
+            self._signal(self.stop_signal)
+
+        outcome = "stopped"
+        if not self._wait(self.stop_timeout if timeout is None else timeout):
+            self._signal(signal.SIGTERM)
+            outcome = "terminated"
+            if not self._wait(KILL_TIMEOUT):
+                self._signal(signal.SIGKILL)
+                self._wait(KILL_TIMEOUT)
+                outcome = "killed"
+        self.is_running()
+        self.adopted_pid = None
+        print(f"[SUPERVISOR] {self.name} {outcome}")
+        return outcome
+
+    def status(self):
+        running = self.is_running()
+        return {
+            "running": running,
+            "pid": self.pid if running else None,
+            "uptime_s": round(time.time() - self.started_at, 1) if running and self.started_at else None,
+            "last_exit": self.last_exit,
+        }
+
+    def health(self):
+        """
+        The child's own health report over the control socket (None if it cannot answer).
+        """
+        if not self.control or not self.is_running():
+            return None
+        try:
+            return send_command(self.control_path, "health")
+        except (OSError, ValueError):
+            return None
+
+
+class Supervisor:
+    """
+    Start/stop of a child is serialized by that child's own lock, so stopping the portal
+    (up to its drain timeout) neither holds up the other children nor the status readers
+    (home page, /processes.json, the metrics gauge), which take no lock at all.
+    """
+
+    def __init__(self, children):
+        self.children = {child.name: child for child in children}
+        self._locks = {name: threading.Lock() for name in self.children}
+        for child in self.children.values():
+            child.adopt()
+
+    def start(self, name):
+        with self._locks[name]:
+            return self.children[name].start()
+
+    def stop(self, name, timeout=None):
+        with self._locks[name]:
+            return self.children[name].stop(timeout)
+
+    def is_running(self, name):
+        return self.children[name].is_running()
+
+    def status(self, with_health=False):
+        report = {}
+        for name, child in self.children.items():
+            report[name] = child.status()
+            if with_health:
+                report[name]["health"] = child.health()
+        return report
+
+    def stop_all(self):
+        for name in self.children:
+            self.stop(name)